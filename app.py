@@ -1,12 +1,21 @@
 import os
-import base64
-from datetime import datetime, timezone
-from flask import Flask, render_template, request, jsonify, abort
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timezone
+from flask import Flask, Response, render_template, request, jsonify, abort, stream_with_context
 from dotenv import load_dotenv
 import requests
 
 load_dotenv()
 
+from resilience import ResilientCaller, CircuitOpenError, kimi_breaker  # noqa: E402
+from image_pipeline import IMAGE_URL, VisionRequestBody, image_source, sha256_file  # noqa: E402
+from response_cache import analyze_cache, make_key, CACHE_REQUESTS  # noqa: E402
+from rate_limiter import (kimi_limiter, estimate_tokens, RateLimitTimeout,  # noqa: E402
+                          PRIORITY_INTERACTIVE)
+
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10MB
 
@@ -15,122 +24,361 @@ KIMI_API_KEY = os.getenv('KIMI_API_KEY')
 # --- LINE Bot Setup ---
 LINE_CHANNEL_ACCESS_TOKEN = os.getenv('LINE_CHANNEL_ACCESS_TOKEN')
 LINE_CHANNEL_SECRET = os.getenv('LINE_CHANNEL_SECRET')
+LINE_BOT_ENABLED = bool(LINE_CHANNEL_ACCESS_TOKEN and LINE_CHANNEL_SECRET)
 
-line_handler = None
-line_configuration = None
-
-if LINE_CHANNEL_ACCESS_TOKEN and LINE_CHANNEL_SECRET:
-    from linebot.v3 import WebhookHandler
-    from linebot.v3.exceptions import InvalidSignatureError
-    from linebot.v3.messaging import Configuration, ApiClient, MessagingApi
-    from linebot.v3.webhooks import MessageEvent, TextMessageContent
-    from models import SessionLocal, LineMessage, create_tables
+# line-bot-sdk 光 import 就要一秒以上，延到第一個 webhook 才載入（gunicorn --preload 時由 master 預先載入）
+_line_handler = None
+_line_configuration = None
+_line_lock = threading.Lock()
 
-    line_configuration = Configuration(access_token=LINE_CHANNEL_ACCESS_TOKEN)
-    line_handler = WebhookHandler(LINE_CHANNEL_SECRET)
+# --- Request-scoped DB session / Metrics ---
+import db_session
+import metrics
+db_session.init_app(app)
+metrics.init_app(app)
 
-    create_tables()
-    app.logger.info("LINE Bot initialized")
 # --- Handbook Blueprint ---
-from handbook import handbook_bp
+# 資料表由部署時的 `python models.py` 建立（Procfile release），不在每個 worker 啟動時檢查
+from handbook.routes import handbook_bp
 app.register_blueprint(handbook_bp)
 
-# 確保 handbook 相關 tables 也建立
-from models import create_tables as _create_handbook_tables
-_create_handbook_tables()
-
-KIMI_API_URL = 'https://api.moonshot.ai/v1/chat/completions'
+KIMI_API_URL = os.getenv('KIMI_API_URL', 'https://api.moonshot.ai/v1/chat/completions')
 MODEL_ID = 'kimi-k2.5'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+DEFAULT_PROMPT = '請詳細描述這張圖片的內容。'
+MAX_TOKENS = 2048
+TEMPERATURE = 1
+# /analyze/batch：每次最多幾張圖、同時送出幾個 Kimi 請求
+BATCH_MAX_IMAGES = int(os.getenv('ANALYZE_BATCH_MAX_IMAGES', '10'))
+BATCH_CONCURRENCY = int(os.getenv('ANALYZE_BATCH_CONCURRENCY', '4'))
+
+# 互動請求只重試一次，避免使用者等待過久
+kimi_caller = ResilientCaller('kimi', kimi_breaker, max_retries=1)
 
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-@app.route('/')
-def index():
-    return render_template('index.html')
+def _mime_type(filename):
+    ext = filename.rsplit('.', 1)[1].lower()
+    mime_map = {'jpg': 'jpeg', 'jpeg': 'jpeg', 'png': 'png', 'gif': 'gif', 'webp': 'webp'}
+    return f"image/{mime_map.get(ext, ext)}"
 
 
-@app.route('/analyze', methods=['POST'])
-def analyze():
+def _validate_analyze_request():
+    """檢查 /analyze 上傳內容，回傳 (file, prompt, error_response)"""
     if not KIMI_API_KEY:
-        return jsonify({'error': '請先在 .env 檔案中設定 KIMI_API_KEY'}), 500
+        return None, None, (jsonify({'error': '請先在 .env 檔案中設定 KIMI_API_KEY'}), 500)
 
     if 'image' not in request.files:
-        return jsonify({'error': '請上傳一張圖片'}), 400
+        return None, None, (jsonify({'error': '請上傳一張圖片'}), 400)
 
     file = request.files['image']
     if file.filename == '':
-        return jsonify({'error': '未選擇檔案'}), 400
+        return None, None, (jsonify({'error': '未選擇檔案'}), 400)
 
     if not allowed_file(file.filename):
-        return jsonify({'error': f'不支援的檔案格式，僅接受：{", ".join(ALLOWED_EXTENSIONS)}'}), 400
+        return None, None, (jsonify({'error': f'不支援的檔案格式，僅接受：{", ".join(ALLOWED_EXTENSIONS)}'}), 400)
 
-    prompt = request.form.get('prompt', '請詳細描述這張圖片的內容。').strip()
+    prompt = request.form.get('prompt', DEFAULT_PROMPT).strip()
     if not prompt:
-        prompt = '請詳細描述這張圖片的內容。'
+        prompt = DEFAULT_PROMPT
+    return file, prompt, None
+
+
+def _build_kimi_request(fileobj, mime_type, prompt, stream=False):
+    """組出 Kimi chat-completions 的串流 body 與 headers，回傳 (body, headers, 圖片大小)"""
+    image = image_source(fileobj)
+    payload = {
+        'model': MODEL_ID,
+        'messages': [
+            {
+                'role': 'user',
+                'content': [
+                    {'type': 'image_url', 'image_url': {'url': IMAGE_URL}},
+                    {'type': 'text', 'text': prompt}
+                ]
+            }
+        ],
+        'max_tokens': MAX_TOKENS,
+        'temperature': TEMPERATURE
+    }
+    if stream:
+        payload['stream'] = True
+
+    headers = {
+        'Authorization': f'Bearer {KIMI_API_KEY}',
+        'Content-Type': 'application/json'
+    }
+    return VisionRequestBody(payload, image, mime_type), headers, image.raw_size
+
+
+def _usage_block(usage, cache_status):
+    return {
+        'prompt_tokens': usage.get('prompt_tokens', 0),
+        'completion_tokens': usage.get('completion_tokens', 0),
+        'total_tokens': usage.get('total_tokens', 0),
+        'cache': cache_status
+    }
+
+
+def _cache_bypassed():
+    """表單欄位 cache=0 或 Cache-Control: no-cache 表示略過快取"""
+    return (request.form.get('cache', '1').lower() in ('0', 'false', 'no')
+            or 'no-cache' in request.headers.get('Cache-Control', ''))
+
+
+def _cache_lookup(fileobj, prompt, bypass):
+    """查詢回應快取，回傳 (cache_key, cached, cache_status)；略過快取時 cache_key 為 None"""
+    if bypass or not analyze_cache.enabled:
+        CACHE_REQUESTS.inc(result='bypass')
+        return None, None, 'bypass'
+    key = make_key(sha256_file(fileobj), prompt, MODEL_ID, TEMPERATURE, MAX_TOKENS)
+    cached = analyze_cache.get(key)
+    status = 'hit' if cached is not None else 'miss'
+    CACHE_REQUESTS.inc(result=status)
+    return key, cached, status
+
+
+def _api_error_detail(response):
+    error_detail = response.text
+    try:
+        error_detail = response.json().get('error', response.text)
+    except Exception:
+        pass
+    return error_detail
+
 
+@app.route('/')
+def index():
+    return render_template('index.html')
+
+
+def _analyze_image(fileobj, mime_type, prompt, bypass_cache=False, prompt_type='analyze'):
+    """分析單張圖片，回傳 (結果 dict, HTTP 狀態碼)；不依賴 request context，可在 worker thread 執行"""
     try:
-        image_data = file.read()
-        filename = file.filename or ''
-        ext = filename.rsplit('.', 1)[1].lower()
-        mime_map = {'jpg': 'jpeg', 'jpeg': 'jpeg', 'png': 'png', 'gif': 'gif', 'webp': 'webp'}
-        mime_type = f"image/{mime_map.get(ext, ext)}"
-        b64_image = base64.b64encode(image_data).decode('utf-8')
-        image_url = f"data:{mime_type};base64,{b64_image}"
-
-        payload = {
-            'model': MODEL_ID,
-            'messages': [
-                {
-                    'role': 'user',
-                    'content': [
-                        {'type': 'image_url', 'image_url': {'url': image_url}},
-                        {'type': 'text', 'text': prompt}
-                    ]
-                }
-            ],
-            'max_tokens': 2048,
-            'temperature': 1
-        }
-
-        headers = {
-            'Authorization': f'Bearer {KIMI_API_KEY}',
-            'Content-Type': 'application/json'
-        }
-
-        response = requests.post(KIMI_API_URL, json=payload, headers=headers, timeout=120)
+        cache_key, cached, cache_status = _cache_lookup(fileobj, prompt, bypass_cache)
+        if cached is not None:
+            return {
+                'success': True,
+                'response': cached['response'],
+                'usage': _usage_block(cached['usage'], cache_status)
+            }, 200
+
+        body, headers, image_size = _build_kimi_request(fileobj, mime_type, prompt)
+        estimated_tokens = estimate_tokens(image_size, prompt, MAX_TOKENS)
+
+        # 在 breaker 之外等待額度：限流逾時不是上游故障，等待時間也不算進 LLM 延遲；
+        # 重試與 hedge 由 before_attempt 各自再扣一次
+        kimi_limiter.acquire(estimated_tokens, PRIORITY_INTERACTIVE, timeout=30)
+        charge_attempt = kimi_limiter.attempt_hook(estimated_tokens, PRIORITY_INTERACTIVE, timeout=30)
+
+        def send():
+            return requests.post(KIMI_API_URL, data=body, headers=headers, timeout=120)
+
+        start = time.perf_counter()
+        outcome = 'error'
+        try:
+            response = kimi_caller.call(send, before_attempt=charge_attempt)
+            if response.status_code == 200:
+                outcome = 'ok'
+        finally:
+            metrics.LLM_REQUEST_DURATION.observe(
+                time.perf_counter() - start, model=MODEL_ID, prompt_type=prompt_type, outcome=outcome)
 
         if response.status_code != 200:
-            error_detail = response.text
-            try:
-                error_detail = response.json().get('error', response.text)
-            except Exception:
-                pass
-            return jsonify({'error': f'API 錯誤 ({response.status_code}): {error_detail}'}), 502
+            return {'error': f'API 錯誤 ({response.status_code}): {_api_error_detail(response)}'}, 502
 
         result = response.json()
         content = result['choices'][0]['message']['content']
         usage = result.get('usage', {})
-
-        return jsonify({
+        metrics.record_llm_usage(MODEL_ID, prompt_type,
+                                 usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0))
+        if usage.get('total_tokens'):
+            kimi_limiter.refund(estimated_tokens - usage['total_tokens'])
+        if cache_key:
+            analyze_cache.set(cache_key, {'response': content, 'usage': usage})
+
+        return {
             'success': True,
             'response': content,
-            'usage': {
-                'prompt_tokens': usage.get('prompt_tokens', 0),
-                'completion_tokens': usage.get('completion_tokens', 0),
-                'total_tokens': usage.get('total_tokens', 0)
-            }
-        })
+            'usage': _usage_block(usage, cache_status)
+        }, 200
 
+    except CircuitOpenError as e:
+        return {'error': str(e)}, 503
+    except RateLimitTimeout as e:
+        return {'error': str(e)}, 429
     except requests.exceptions.Timeout:
-        return jsonify({'error': 'API 請求逾時，請稍後再試'}), 504
+        return {'error': 'API 請求逾時，請稍後再試'}, 504
     except requests.exceptions.ConnectionError:
-        return jsonify({'error': '無法連線至 Kimi API，請檢查網路連線'}), 502
+        return {'error': '無法連線至 Kimi API，請檢查網路連線'}, 502
     except Exception as e:
-        return jsonify({'error': f'伺服器錯誤：{str(e)}'}), 500
+        return {'error': f'伺服器錯誤：{str(e)}'}, 500
+
+
+@app.route('/analyze', methods=['POST'])
+def analyze():
+    file, prompt, error = _validate_analyze_request()
+    if error:
+        return error
+
+    result, status = _analyze_image(file.stream, _mime_type(file.filename), prompt, _cache_bypassed())
+    return jsonify(result), status
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _iter_stream_chunks(response):
+    """解析上游 chat-completions SSE，逐一產生 chunk dict"""
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith('data:'):
+            continue
+        data = line[len('data:'):].strip()
+        if data == '[DONE]':
+            return
+        yield json.loads(data)
+
+
+@app.route('/analyze/stream', methods=['POST'])
+def analyze_stream():
+    """與 /analyze 相同，但以 SSE 逐段回傳模型輸出（delta → done / error 事件）"""
+    file, prompt, error = _validate_analyze_request()
+    if error:
+        return error
+
+    cache_key, cached, cache_status = _cache_lookup(file.stream, prompt, _cache_bypassed())
+    if cached is not None:
+        def replay():
+            yield _sse('delta', {'text': cached['response']})
+            yield _sse('done', {'success': True, 'usage': _usage_block(cached['usage'], cache_status)})
+        return Response(replay(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+    body, headers, image_size = _build_kimi_request(file.stream, _mime_type(file.filename), prompt,
+                                                    stream=True)
+    estimated_tokens = estimate_tokens(image_size, prompt, MAX_TOKENS)
+    try:
+        # 串流開始前等待額度，逾時時仍可回傳一般的 JSON 錯誤
+        kimi_limiter.acquire(estimated_tokens, PRIORITY_INTERACTIVE, timeout=30)
+    except RateLimitTimeout as e:
+        return jsonify({'error': str(e)}), 429
+    charge_attempt = kimi_limiter.attempt_hook(estimated_tokens, PRIORITY_INTERACTIVE, timeout=30)
+
+    def send():
+        return requests.post(KIMI_API_URL, data=body, headers=headers, timeout=120, stream=True)
+
+    def generate():
+        start = time.perf_counter()
+        outcome = 'error'
+        response = None
+        usage = {}
+        try:
+            response = kimi_caller.call(send, before_attempt=charge_attempt)
+            if response.status_code != 200:
+                yield _sse('error', {'error': f'API 錯誤 ({response.status_code}): {_api_error_detail(response)}'})
+                return
+            first_token = True
+            parts = []
+            for chunk in _iter_stream_chunks(response):
+                choices = chunk.get('choices') or [{}]
+                text = choices[0].get('delta', {}).get('content')
+                if text:
+                    if first_token:
+                        metrics.STAGE_DURATION.observe(time.perf_counter() - start,
+                                                       stage='analyze_first_token')
+                        first_token = False
+                    parts.append(text)
+                    yield _sse('delta', {'text': text})
+                # Moonshot 把 usage 放在最後一個 chunk 的 choices[0]，OpenAI 相容格式則在最外層
+                usage = chunk.get('usage') or choices[0].get('usage') or usage
+            outcome = 'ok'
+            metrics.record_llm_usage(MODEL_ID, 'analyze',
+                                     usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0))
+            if usage.get('total_tokens'):
+                kimi_limiter.refund(estimated_tokens - usage['total_tokens'])
+            if cache_key:
+                analyze_cache.set(cache_key, {'response': ''.join(parts), 'usage': usage})
+            yield _sse('done', {'success': True, 'usage': _usage_block(usage, cache_status)})
+        except (CircuitOpenError, RateLimitTimeout) as e:
+            yield _sse('error', {'error': str(e)})
+        except requests.exceptions.Timeout:
+            yield _sse('error', {'error': 'API 請求逾時，請稍後再試'})
+        except requests.exceptions.ConnectionError:
+            yield _sse('error', {'error': '無法連線至 Kimi API，請檢查網路連線'})
+        except Exception as e:
+            # 例如上游 chunk 格式錯誤；串流已開始，只能以 error 事件通知前端
+            app.logger.error(f'Analyze stream error: {e}')
+            yield _sse('error', {'error': f'伺服器錯誤：{str(e)}'})
+        finally:
+            # 用戶端中斷時 generator 會被 close()，在此關閉上游連線以釋放 worker
+            if response is not None:
+                response.close()
+            metrics.LLM_REQUEST_DURATION.observe(
+                time.perf_counter() - start, model=MODEL_ID, prompt_type='analyze_stream', outcome=outcome)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """一次分析多張圖片，並行送出並以 SSE 依完成順序回傳（result × N → done）
+
+    表單欄位：images（多個檔案）、prompts（與 images 一一對應，選填）或共用的 prompt。
+    """
+    if not KIMI_API_KEY:
+        return jsonify({'error': '請先在 .env 檔案中設定 KIMI_API_KEY'}), 500
+
+    files = [f for f in request.files.getlist('images') if f.filename]
+    if not files:
+        return jsonify({'error': '請上傳至少一張圖片'}), 400
+    if len(files) > BATCH_MAX_IMAGES:
+        return jsonify({'error': f'一次最多分析 {BATCH_MAX_IMAGES} 張圖片'}), 400
+
+    prompts = request.form.getlist('prompts')
+    if prompts and len(prompts) != len(files):
+        return jsonify({'error': 'prompts 數量必須與圖片數量相同'}), 400
+    shared_prompt = request.form.get('prompt', '').strip() or DEFAULT_PROMPT
+    prompts = [p.strip() or shared_prompt for p in prompts] or [shared_prompt] * len(files)
+    bypass = _cache_bypassed()
+
+    def generate():
+        start = time.perf_counter()
+        succeeded = 0
+        pending = []
+        executor = ThreadPoolExecutor(max_workers=min(BATCH_CONCURRENCY, len(files)),
+                                      thread_name_prefix='analyze-batch')
+        try:
+            for index, (file, prompt) in enumerate(zip(files, prompts)):
+                if not allowed_file(file.filename):
+                    yield _sse('result', {
+                        'index': index, 'filename': file.filename,
+                        'error': f'不支援的檔案格式，僅接受：{", ".join(ALLOWED_EXTENSIONS)}'})
+                    continue
+                future = executor.submit(_analyze_image, file.stream, _mime_type(file.filename),
+                                         prompt, bypass, 'analyze_batch')
+                future.item = (index, file.filename)
+                pending.append(future)
+
+            for future in as_completed(pending):
+                index, filename = future.item
+                result, status = future.result()
+                if status == 200:
+                    succeeded += 1
+                yield _sse('result', {'index': index, 'filename': filename, **result})
+
+            metrics.STAGE_DURATION.observe(time.perf_counter() - start, stage='analyze_batch')
+            yield _sse('done', {'count': len(files), 'succeeded': succeeded,
+                                'elapsed_ms': round((time.perf_counter() - start) * 1000)})
+        finally:
+            # 用戶端中斷時取消尚未開始的項目；進行中的請求會自行結束
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
 @app.errorhandler(413)
@@ -139,8 +387,30 @@ def too_large(e):
 
 
 # --- LINE Webhook ---
+def get_line_handler():
+    """第一次呼叫時載入 line-bot-sdk 並註冊訊息處理；未設定 LINE 時回傳 None"""
+    global _line_handler, _line_configuration
+    if not LINE_BOT_ENABLED:
+        return None
+    if _line_handler is None:
+        with _line_lock:
+            if _line_handler is None:
+                from linebot.v3 import WebhookHandler
+                from linebot.v3.messaging import Configuration
+                from linebot.v3.webhooks import MessageEvent, TextMessageContent
+
+                _line_configuration = Configuration(access_token=LINE_CHANNEL_ACCESS_TOKEN,
+                                                    host=os.getenv('LINE_API_HOST'))
+                handler = WebhookHandler(LINE_CHANNEL_SECRET)
+                handler.add(MessageEvent, message=TextMessageContent)(handle_text_message)
+                _line_handler = handler
+                app.logger.info("LINE Bot initialized")
+    return _line_handler
+
+
 @app.route('/callback', methods=['POST'])
 def line_callback():
+    line_handler = get_line_handler()
     if not line_handler:
         return jsonify({'error': 'LINE Bot not configured'}), 503
 
@@ -157,52 +427,81 @@ def line_callback():
     return 'OK'
 
 
-if line_handler:
-    @line_handler.add(MessageEvent, message=TextMessageContent)
-    def handle_text_message(event):
-        source = event.source
-        group_id = getattr(source, 'group_id', None)
-        user_id = getattr(source, 'user_id', None)
-
-        display_name = ''
-        if user_id:
-            try:
-                with ApiClient(line_configuration) as api_client:
-                    api = MessagingApi(api_client)
-                    if group_id:
-                        profile = api.get_group_member_profile(group_id, user_id)
-                    else:
-                        profile = api.get_profile(user_id)
-                    display_name = profile.display_name
-            except Exception as e:
-                app.logger.warning(f'Failed to get LINE profile: {e}')
-
-        line_ts = datetime.fromtimestamp(event.timestamp / 1000, tz=timezone.utc)
-
-        db = SessionLocal()
+def handle_text_message(event):
+    from linebot.v3.messaging import ApiClient, MessagingApi
+    from models import LineMessage
+
+    source = event.source
+    group_id = getattr(source, 'group_id', None)
+    user_id = getattr(source, 'user_id', None)
+
+    display_name = ''
+    if user_id:
+        profile_start = time.perf_counter()
         try:
-            msg = LineMessage(
-                group_id=group_id or '',
-                user_id=user_id or '',
-                display_name=display_name,
-                message_type='text',
-                content=event.message.text,
-                line_timestamp=line_ts,
-            )
-            db.add(msg)
-            db.commit()
-            app.logger.info(f'Saved LINE message from {display_name}: {event.message.text[:50]}')
+            with ApiClient(_line_configuration) as api_client:
+                api = MessagingApi(api_client)
+                if group_id:
+                    profile = api.get_group_member_profile(group_id, user_id)
+                else:
+                    profile = api.get_profile(user_id)
+                display_name = profile.display_name
         except Exception as e:
-            db.rollback()
-            app.logger.error(f'DB error: {e}')
-        finally:
-            db.close()
+            app.logger.warning(f'Failed to get LINE profile: {e}')
+        metrics.STAGE_DURATION.observe(time.perf_counter() - profile_start,
+                                       stage='line_profile_fetch')
+
+    line_ts = datetime.fromtimestamp(event.timestamp / 1000, tz=timezone.utc)
+
+    db = db_session.get_db()
+    db_start = time.perf_counter()
+    try:
+        msg = LineMessage(
+            group_id=group_id or '',
+            user_id=user_id or '',
+            display_name=display_name,
+            message_type='text',
+            content=event.message.text,
+            line_timestamp=line_ts,
+        )
+        db.add(msg)
+        db.commit()
+        app.logger.info(f'Saved LINE message from {display_name}: {event.message.text[:50]}')
+    except Exception as e:
+        db.rollback()
+        app.logger.error(f'DB error: {e}')
+    metrics.STAGE_DURATION.observe(time.perf_counter() - db_start, stage='line_db_write')
+
+
+# --- Sentiment Trends ---
+@app.route('/sentiment/trends')
+def sentiment_trends():
+    """情緒趨勢時間序列（讀取週/月彙總表）：period=week|month、group_id（可多個）、from、to
+
+    from、to 皆包含當天，涵蓋這兩天的週期都會回傳。
+    """
+    import sentiment_rollup
+
+    period = request.args.get('period', 'week')
+    if period not in sentiment_rollup.PERIODS:
+        return jsonify({'error': 'period 必須是 week 或 month'}), 400
+    try:
+        date_from = date.fromisoformat(request.args['from']) if request.args.get('from') else None
+        date_to = date.fromisoformat(request.args['to']) if request.args.get('to') else None
+    except ValueError:
+        return jsonify({'error': '日期格式需為 YYYY-MM-DD'}), 400
+    series = sentiment_rollup.query_trends(db_session.get_db(), period,
+                                           request.args.getlist('group_id') or None, date_from, date_to)
+    return jsonify({'period': period, 'groups': series})
 
 
 @app.route('/health', methods=['GET'])
 def health():
-    return {'status': 'ok', 'line_bot': bool(line_handler)}
+    return {'status': 'ok', 'line_bot': LINE_BOT_ENABLED}
 
 
 if __name__ == '__main__':
+    # 本機開發直接執行時順便建表；正式環境由 Procfile 的 release 階段執行 python models.py
+    from models import create_tables
+    create_tables()
     app.run(debug=True, port=5001)
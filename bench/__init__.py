@@ -0,0 +1 @@
+"""離線效能測試 - 本機 mock LLM server、合成資料與情境腳本（python -m bench.run）"""
@@ -0,0 +1,130 @@
+"""圖片處理記憶體量測 - 比較舊的整檔複製流程與 image_pipeline 串流流程的峰值記憶體
+
+    python -m bench.memory --size-mb 10
+
+每個變體在獨立子行程執行，回報 tracemalloc 峰值與 RSS 高水位增量。
+"""
+
+import argparse
+import base64
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+
+
+def _legacy_analyze(path):
+    with open(path, 'rb') as f:
+        image_data = f.read()
+    b64_image = base64.b64encode(image_data).decode('utf-8')
+    image_url = f"data:image/png;base64,{b64_image}"
+    payload = {'model': 'm', 'messages': [{'role': 'user', 'content': [
+        {'type': 'image_url', 'image_url': {'url': image_url}}, {'type': 'text', 'text': 'p'}]}]}
+    # requests 的 json= 參數會 dumps 後再 encode
+    body = json.dumps(payload).encode('utf-8')
+    return len(body)
+
+
+def _stream_analyze(path):
+    from image_pipeline import IMAGE_URL, VisionRequestBody, image_source
+    with open(path, 'rb') as f:
+        payload = {'model': 'm', 'messages': [{'role': 'user', 'content': [
+            {'type': 'image_url', 'image_url': {'url': IMAGE_URL}}, {'type': 'text', 'text': 'p'}]}]}
+        body = VisionRequestBody(payload, image_source(f), 'image/png')
+        # 模擬送出：逐段寫到 socket 後丟棄
+        return sum(len(chunk) for chunk in body)
+
+
+def _legacy_upload(path):
+    with open(path, 'rb') as f:
+        image_data = f.read()
+    b64 = base64.b64encode(image_data).decode('utf-8')
+    stored = f"image/png|{b64}"
+    return len(stored)
+
+
+def _stream_upload(path):
+    from image_pipeline import encode_file_base64
+    with open(path, 'rb') as f:
+        stored = encode_file_base64(f, prefix='image/png|')
+    return len(stored)
+
+
+def _legacy_ocr(stored):
+    mime_type, b64_data = stored.split('|', 1)
+    image_url = f"data:{mime_type};base64,{b64_data}"
+    payload = {'model': 'm', 'messages': [{'role': 'user', 'content': [
+        {'type': 'image_url', 'image_url': {'url': image_url}}, {'type': 'text', 'text': 'p'}]}]}
+    return len(json.dumps(payload).encode('utf-8'))
+
+
+def _stream_ocr(stored):
+    from image_pipeline import IMAGE_URL, VisionRequestBody, image_source
+    sep = stored.find('|', 0, 50)
+    payload = {'model': 'm', 'messages': [{'role': 'user', 'content': [
+        {'type': 'image_url', 'image_url': {'url': IMAGE_URL}}, {'type': 'text', 'text': 'p'}]}]}
+    body = VisionRequestBody(payload, image_source(stored, sep + 1), stored[:sep])
+    return sum(len(chunk) for chunk in body)
+
+
+VARIANTS = {
+    'analyze-legacy': _legacy_analyze,
+    'analyze-stream': _stream_analyze,
+    'upload-legacy': _legacy_upload,
+    'upload-stream': _stream_upload,
+    'ocr-legacy': _legacy_ocr,
+    'ocr-stream': _stream_ocr,
+}
+
+
+def _run_variant(name, path):
+    """子行程：執行單一變體並輸出 JSON 結果"""
+    arg = path
+    if name.startswith('ocr-'):
+        # OCR 的輸入是已從 DB 讀出的字串，不計入峰值
+        with open(path, 'rb') as f:
+            arg = 'image/png|' + base64.b64encode(f.read()).decode('ascii')
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    VARIANTS[name](arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({'peak': peak, 'rss_growth_kb': rss_after - rss_before}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Image pipeline peak memory benchmark')
+    parser.add_argument('--size-mb', type=float, default=10)
+    parser.add_argument('--variant', choices=sorted(VARIANTS), help=argparse.SUPPRESS)
+    parser.add_argument('--path', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        _run_variant(args.variant, args.path)
+        return
+
+    size = int(args.size_mb * 1024 * 1024)
+    with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as f:
+        f.write(os.urandom(size))
+        path = f.name
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        print(f'image size: {size / 1024 / 1024:.1f} MB')
+        print(f'{"variant":<16} {"py peak":>10} {"x image":>8} {"RSS growth":>12}')
+        for name in VARIANTS:
+            out = subprocess.run(
+                [sys.executable, '-m', 'bench.memory', '--variant', name, '--path', path],
+                cwd=root, capture_output=True, text=True, check=True).stdout
+            result = json.loads(out)
+            print(f'{name:<16} {result["peak"] / 1024 / 1024:>8.1f}MB {result["peak"] / size:>7.2f}x '
+                  f'{result["rss_growth_kb"] / 1024:>10.1f}MB')
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+"""本機 mock LLM server - 模擬 Kimi chat-completions、Gemini generateContent 與 LINE profile API
+
+可設定延遲分佈與錯誤注入，讓效能測試不需呼叫付費的遠端 API：
+
+    python -m bench.mock_llm --port 8765 --latency 1.5 --jitter 0.5 --failure-rate 0.05
+"""
+
+import argparse
+import base64
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bench.synthetic import page_type_from_image
+
+CANNED_EXTRACTIONS = {
+    'basic_info': {'name': '王小明', 'id_number': 'A123456789', 'birth_date': '2022-03-15'},
+    'parent_record': {
+        'age_stage': '二至三歲',
+        'visit_number': 6,
+        'record_date': '2024-05-01',
+        'checklist_items': [
+            {'題目': '會自己走上樓梯嗎', '類別': '粗動作', '結果': '是', '是警訊': False},
+            {'題目': '會說兩個字的詞嗎', '類別': '語言認知', '結果': '是', '是警訊': True},
+            {'題目': '會用湯匙吃東西嗎', '類別': '細動作', '結果': '否', '是警訊': False},
+        ],
+        'parent_notes': None,
+    },
+    'health_education': {
+        'age_stage': '二至三歲',
+        'visit_number': 6,
+        'guidance_date': '2024-05-01',
+        'parent_assessment': [{'主題': '事故傷害預防', '未做到': False, '已做到': True}],
+        'doctor_guidance': [
+            {'主題': '營養', '重點': '飲食', '項目': [{'內容': '每天喝奶 500 ml 以內', '已勾': True}]},
+        ],
+        'hospital_code': '範例診所 1234567890',
+        'doctor_name': '陳醫師',
+        'relationship': None,
+    },
+}
+
+SENTIMENT_RESPONSE = {
+    'overall_sentiment': 'positive',
+    'sentiment_scores': {'positive': 0.6, 'negative': 0.1, 'neutral': 0.3},
+    'summary': '群組整體氣氛輕鬆，主要討論工作安排與聚餐。',
+}
+
+
+class MockConfig:
+    """延遲與錯誤注入設定（所有請求執行緒共用）"""
+
+    def __init__(self, latency=1.0, jitter=0.3, failure_rate=0.0, failure_status=429,
+                 retry_after=1, tokens_per_image_kb=2, malformed_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.retry_after = retry_after
+        self.tokens_per_image_kb = tokens_per_image_kb
+        self.malformed_rate = malformed_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.failure_count = 0
+
+    def next_delay(self):
+        with self.lock:
+            self.request_count += 1
+            return max(0.0, self.rng.gauss(self.latency, self.jitter))
+
+    def should_fail(self):
+        with self.lock:
+            failed = self.rng.random() < self.failure_rate
+            if failed:
+                self.failure_count += 1
+            return failed
+
+    def truncate_point(self, length):
+        """依 malformed_rate 決定是否模擬 max_tokens 截斷，回傳保留的字元數或 None"""
+        with self.lock:
+            if self.rng.random() >= self.malformed_rate:
+                return None
+            return int(length * self.rng.uniform(0.4, 0.95))
+
+
+def _image_parts(messages):
+    """取出 chat messages 裡所有 data URL 圖片的 bytes"""
+    images = []
+    for message in messages:
+        content = message.get('content')
+        if not isinstance(content, list):
+            continue
+        for part in content:
+            if part.get('type') == 'image_url':
+                url = part['image_url']['url']
+                images.append(base64.b64decode(url.split(',', 1)[1]) if ',' in url else b'')
+    return images
+
+
+def _prompt_text(messages):
+    texts = []
+    for message in messages:
+        content = message.get('content')
+        if isinstance(content, str):
+            texts.append(content)
+        elif isinstance(content, list):
+            texts.extend(p.get('text', '') for p in content if p.get('type') == 'text')
+    return '\n'.join(texts)
+
+
+def build_chat_content(prompt, images):
+    """依 prompt 類型產生 Kimi 回覆內容"""
+    page_types = [page_type_from_image(img) or 'unknown' for img in images]
+    if '判斷這張圖片' in prompt:
+        page_type = page_types[0] if page_types else 'unknown'
+        return json.dumps({'page_type': page_type, 'confidence': 0.95, 'reason': 'mock'},
+                          ensure_ascii=False)
+    for page_type, marker in (('basic_info', '健保卡'), ('parent_record', '家長紀錄事項'),
+                              ('health_education', '衛教指導紀錄')):
+        if marker in prompt and 'OCR' in prompt:
+            if len(images) > 1:
+                # 多圖擷取：每張圖各一份結果，依圖片順序放在 pages 陣列
+                return json.dumps({'pages': [CANNED_EXTRACTIONS[page_type] for _ in images]},
+                                  ensure_ascii=False)
+            return json.dumps(CANNED_EXTRACTIONS[page_type], ensure_ascii=False)
+    return '這是一張模擬的圖片描述。' * 20
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config = MockConfig()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body, extra_headers=None):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (extra_headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def _inject_failure(self):
+        if not self.config.should_fail():
+            return False
+        status = self.config.failure_status
+        headers = {'Retry-After': str(self.config.retry_after)} if status == 429 else {}
+        self._send_json(status, {'error': {'message': 'mock injected failure', 'code': status}}, headers)
+        return True
+
+    def do_GET(self):
+        # LINE Messaging API profile 端點
+        match = re.match(r'^/v2/bot/(?:group/[^/]+/member|profile)/([^/?]+)', self.path)
+        if match:
+            time.sleep(self.config.next_delay())
+            user_id = match.group(1)
+            self._send_json(200, {'displayName': f'user-{user_id[-4:]}', 'userId': user_id})
+            return
+        self._send_json(404, {'error': 'not found'})
+
+    def _send_stream(self, content, usage, total_delay, pieces=20):
+        """以 SSE 分段送出內容；首段在總延遲的 10% 時送出，其餘平均分散"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        step = max(1, len(content) // pieces)
+        parts = [content[i:i + step] for i in range(0, len(content), step)]
+        time.sleep(total_delay * 0.1)
+        for i, part in enumerate(parts):
+            chunk = {'id': 'chatcmpl-mock', 'object': 'chat.completion.chunk',
+                     'choices': [{'index': 0, 'delta': {'content': part}, 'finish_reason': None}]}
+            if i == len(parts) - 1:
+                chunk['choices'][0]['finish_reason'] = 'stop'
+                chunk['choices'][0]['usage'] = usage
+            try:
+                self.wfile.write(f'data: {json.dumps(chunk, ensure_ascii=False)}\n\n'.encode('utf-8'))
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                return
+            time.sleep(total_delay * 0.9 / len(parts))
+        self.wfile.write(b'data: [DONE]\n\n')
+
+    def do_POST(self):
+        body = self._read_json()
+        delay = self.config.next_delay()
+        streaming = bool(body.get('stream'))
+        if not streaming:
+            time.sleep(delay)
+        if self._inject_failure():
+            return
+
+        if self.path.startswith('/v1/chat/completions'):
+            messages = body.get('messages', [])
+            images = _image_parts(messages)
+            prompt = _prompt_text(messages)
+            content = build_chat_content(prompt, images)
+            finish_reason = 'stop'
+            if 'OCR' in prompt and '判斷這張圖片' not in prompt:
+                cut = self.config.truncate_point(len(content))
+                if cut is not None:
+                    content, finish_reason = content[:cut], 'length'
+            image_kb = sum(len(img) for img in images) // 1024
+            prompt_tokens = len(prompt) + image_kb * self.config.tokens_per_image_kb
+            completion_tokens = len(content)
+            usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                     'total_tokens': prompt_tokens + completion_tokens}
+            if streaming:
+                self._send_stream(content, usage, delay)
+                return
+            self._send_json(200, {
+                'id': 'chatcmpl-mock',
+                'object': 'chat.completion',
+                'model': body.get('model'),
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content},
+                             'finish_reason': finish_reason}],
+                'usage': usage,
+            })
+        elif ':generateContent' in self.path:
+            prompt = body['contents'][0]['parts'][0]['text']
+            text = json.dumps(SENTIMENT_RESPONSE, ensure_ascii=False)
+            self._send_json(200, {
+                'candidates': [{'content': {'parts': [{'text': text}], 'role': 'model'}}],
+                'usageMetadata': {'promptTokenCount': len(prompt), 'candidatesTokenCount': len(text)},
+            })
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+
+def start_server(port=0, config=None):
+    """在背景執行緒啟動 mock server，回傳 (server, base_url)"""
+    handler = type('ConfiguredMockHandler', (MockHandler,), {'config': config or MockConfig()})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mock Kimi / Gemini / LINE API server')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=1.0, help='平均延遲秒數')
+    parser.add_argument('--jitter', type=float, default=0.3, help='延遲標準差秒數')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='錯誤注入比例 0-1')
+    parser.add_argument('--failure-status', type=int, default=429)
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help='OCR 擷取回覆被截斷的比例 0-1')
+    args = parser.parse_args()
+
+    config = MockConfig(latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate,
+                        failure_status=args.failure_status, retry_after=args.retry_after,
+                        malformed_rate=args.malformed_rate)
+    handler = type('ConfiguredMockHandler', (MockHandler,), {'config': config})
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), handler)
+    print(f'Mock LLM server on http://127.0.0.1:{args.port}')
+    print(f'  KIMI_API_URL=http://127.0.0.1:{args.port}/v1/chat/completions')
+    print(f'  GEMINI_API_BASE=http://127.0.0.1:{args.port}/v1beta')
+    print(f'  LINE_API_HOST=http://127.0.0.1:{args.port}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
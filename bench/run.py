@@ -0,0 +1,468 @@
+"""效能測試情境 - 對本機 mock LLM server 量測延遲百分位數與吞吐量
+
+    python -m bench.run analyze --requests 200 --concurrency 8
+    python -m bench.run stream --requests 50
+    python -m bench.run batch --images 8
+    python -m bench.run upload --pages 50
+    python -m bench.run ocrbatch --pages 24 --batch-sizes 1,2,4,8
+    python -m bench.run nightly --groups 100 --messages 40
+    python -m bench.run webhook --requests 500 --concurrency 16
+    python -m bench.run startup --runs 5
+    python -m bench.run all --database-url postgresql://localhost/bench
+
+未指定 --database-url 時使用暫存目錄中的 SQLite。
+"""
+
+import argparse
+import logging
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import json
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from bench import synthetic
+from bench.mock_llm import MockConfig, start_server
+
+LINE_SECRET = 'bench-channel-secret'
+
+
+def percentile(sorted_values, pct):
+    """nearest-rank 百分位數"""
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[k]
+
+
+def report(name, latencies, wall_time, errors=0, unit='req'):
+    values = sorted(latencies)
+    count = len(values)
+    throughput = count / wall_time if wall_time else 0
+    print(f'\n== {name} ==')
+    print(f'  {unit}s: {count}  errors: {errors}  wall: {wall_time:.2f}s  '
+          f'throughput: {throughput:.2f} {unit}/s')
+    if values:
+        print(f'  latency  p50: {percentile(values, 50) * 1000:.0f} ms  '
+              f'p95: {percentile(values, 95) * 1000:.0f} ms  '
+              f'p99: {percentile(values, 99) * 1000:.0f} ms  '
+              f'mean: {statistics.fmean(values) * 1000:.0f} ms  '
+              f'max: {values[-1] * 1000:.0f} ms')
+
+
+def report_cache(cache_statuses):
+    """印出回應中 usage.cache 的分布；量測上游延遲的情境應全部為 bypass"""
+    counts = Counter(cache_statuses)
+    print('  response cache: ' + ('  '.join(f'{k}={v}' for k, v in sorted(counts.items())) or 'n/a'))
+
+
+def run_concurrently(func, total, concurrency):
+    """以固定並行度執行 func(i)，回傳 (latencies, errors, wall_time)"""
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def timed(i):
+        nonlocal errors
+        start = time.perf_counter()
+        ok = func(i)
+        elapsed = time.perf_counter() - start
+        with lock:
+            if ok:
+                latencies.append(elapsed)
+            else:
+                errors += 1
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(timed, range(total)))
+    return latencies, errors, time.perf_counter() - wall_start
+
+
+def _start_app_server():
+    """以多執行緒 WSGI server 啟動 app，回傳 base URL"""
+    from werkzeug.serving import make_server
+    from app import app
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}'
+
+
+def scenario_analyze(base_url, args):
+    import requests
+
+    image = synthetic.make_handbook_image('health_education', scale=args.scale)
+
+    cache_statuses = []
+
+    def call(i):
+        # cache=0：同一張圖重複送出，不略過快取就只是在量快取命中
+        resp = requests.post(f'{base_url}/analyze',
+                             files={'image': ('page.png', image, 'image/png')},
+                             data={'prompt': f'請描述這張圖片 #{i}', 'cache': '0'}, timeout=300)
+        if resp.status_code != 200:
+            return False
+        cache_statuses.append(resp.json()['usage'].get('cache'))
+        return True
+
+    latencies, errors, wall = run_concurrently(call, args.requests, args.concurrency)
+    report(f'/analyze x{args.requests} (concurrency {args.concurrency})', latencies, wall, errors)
+    report_cache(cache_statuses)
+
+
+def scenario_stream(base_url, args):
+    import requests
+
+    image = synthetic.make_handbook_image('health_education', scale=args.scale)
+    first_byte = []
+    cache_statuses = []
+
+    def call(i):
+        start = time.perf_counter()
+        with requests.post(f'{base_url}/analyze/stream', stream=True, timeout=300,
+                           files={'image': ('page.png', image, 'image/png')},
+                           data={'prompt': f'請描述這張圖片 #{i}', 'cache': '0'}) as resp:
+            ok = resp.status_code == 200
+            got_first = False
+            event = None
+            for line in resp.iter_lines(decode_unicode=True):
+                if line.startswith('event:'):
+                    event = line[len('event:'):].strip()
+                    if event == 'delta' and not got_first:
+                        first_byte.append(time.perf_counter() - start)
+                        got_first = True
+                    elif event == 'error':
+                        ok = False
+                elif line.startswith('data:') and event == 'done':
+                    cache_statuses.append(json.loads(line[len('data:'):])['usage'].get('cache'))
+        return ok
+
+    latencies, errors, wall = run_concurrently(call, args.requests, args.concurrency)
+    report(f'/analyze/stream x{args.requests} total time', latencies, wall, errors)
+    report('/analyze/stream time to first delta', first_byte, wall)
+    report_cache(cache_statuses)
+
+
+def scenario_batch(base_url, args):
+    """同樣 N 張圖：逐張呼叫 /analyze 與一次 /analyze/batch 的總耗時比較"""
+    import requests
+
+    images = [synthetic.make_handbook_image('health_education', seed=i, scale=args.scale)
+              for i in range(args.images)]
+    prompts = [f'請描述這張圖片 #{i} ({time.time()})' for i in range(args.images)]
+
+    sequential = []
+    cache_statuses = []
+    start = time.perf_counter()
+    for image, prompt in zip(images, prompts):
+        t0 = time.perf_counter()
+        resp = requests.post(f'{base_url}/analyze', files={'image': ('page.png', image, 'image/png')},
+                             data={'prompt': prompt, 'cache': '0'}, timeout=300)
+        sequential.append(time.perf_counter() - t0)
+        if resp.status_code == 200:
+            cache_statuses.append(resp.json()['usage'].get('cache'))
+    report(f'/analyze sequential x{args.images}', sequential, time.perf_counter() - start)
+    report_cache(cache_statuses)
+
+    arrivals = []
+    cache_statuses = []
+    errors = 0
+    start = time.perf_counter()
+    with requests.post(f'{base_url}/analyze/batch', stream=True, timeout=300,
+                       files=[('images', (f'page{i}.png', image, 'image/png'))
+                              for i, image in enumerate(images)],
+                       data={'prompts': prompts, 'cache': '0'}) as resp:
+        for line in resp.iter_lines(decode_unicode=True):
+            if line.startswith('event: result'):
+                arrivals.append(time.perf_counter() - start)
+            elif line.startswith('data:') and '"error"' in line:
+                errors += 1
+            elif line.startswith('data:') and '"usage"' in line:
+                cache_statuses.append(json.loads(line[len('data:'):])['usage'].get('cache'))
+    report(f'/analyze/batch x{args.images} (result arrival)', arrivals, time.perf_counter() - start, errors)
+    report_cache(cache_statuses)
+
+
+def scenario_upload(base_url, args):
+    import requests
+
+    session = requests.post(f'{base_url}/handbook/sessions', json={'scanned_by': 'bench'}, timeout=30)
+    session_id = session.json()['session_id']
+    images = synthetic.make_handbook_batch(args.pages, scale=args.scale)
+    files = [('images', (f'page{i}.png', data, 'image/png')) for i, (_, data) in enumerate(images)]
+
+    wall_start = time.perf_counter()
+    resp = requests.post(f'{base_url}/handbook/sessions/{session_id}/pages', files=files, timeout=300)
+    upload_time = time.perf_counter() - wall_start
+    if resp.status_code != 201:
+        print(f'upload failed: {resp.status_code} {resp.text[:200]}')
+        return 0
+    page_ids = set(resp.json()['page_ids'])
+
+    from models import SessionLocal, HandbookScannedPage
+
+    # OCR 失敗的頁面會退回 pending 並在 ocr_raw_response 留下錯誤，直接查 DB 判斷
+    done_at = {}
+    failed = set()
+    deadline = wall_start + args.timeout
+    while len(done_at) + len(failed) < len(page_ids) and time.perf_counter() < deadline:
+        requests.get(f'{base_url}/handbook/sessions/{session_id}/status', timeout=30)
+        now = time.perf_counter()
+        db = SessionLocal()
+        try:
+            rows = db.query(HandbookScannedPage.id, HandbookScannedPage.status,
+                            HandbookScannedPage.ocr_raw_response).filter(
+                HandbookScannedPage.id.in_(page_ids)).all()
+        finally:
+            db.close()
+        for page_id, status, raw in rows:
+            if page_id in done_at or page_id in failed:
+                continue
+            if status in ('ocr_complete', 'ocr_incomplete'):
+                done_at[page_id] = now - wall_start
+            elif status == 'pending' and raw is not None:
+                failed.add(page_id)
+        time.sleep(args.poll_interval)
+    wall = time.perf_counter() - wall_start
+
+    print(f'\n  upload request: {upload_time * 1000:.0f} ms for {len(page_ids)} pages')
+    report(f'{args.pages}-page upload → OCR complete', list(done_at.values()), wall,
+           errors=len(page_ids) - len(done_at), unit='page')
+    if failed:
+        print(f'  {len(failed)} pages fell back to pending after an OCR error')
+    outcomes = _metric_totals('ocr_extract_outcome_total', 'outcome')
+    print('  extraction outcomes (cumulative): '
+          + ', '.join(f'{k}={v:.0f}' for k, v in sorted(outcomes.items())))
+    return len(page_ids)
+
+
+def _metric_totals(name, label):
+    """從 metrics.render() 加總某個 counter，依指定 label 分組"""
+    import metrics
+    totals = {}
+    for line in metrics.render().splitlines():
+        if not line.startswith(name + '{'):
+            continue
+        value = line.split(f'{label}="', 1)[1].split('"', 1)[0]
+        totals[value] = totals.get(value, 0) + float(line.rsplit(' ', 1)[1])
+    return totals
+
+
+def scenario_ocrbatch(base_url, args, mock_config):
+    """同一批上傳頁面在不同 OCR_BATCH_SIZE 下的總耗時、Kimi 請求數與每頁 prompt tokens"""
+    from handbook import ocr_service
+
+    original = ocr_service.OCR_BATCH_SIZE
+    rows = []
+    try:
+        for size in [int(s) for s in args.batch_sizes.split(',')]:
+            ocr_service.OCR_BATCH_SIZE = size
+            requests_before = mock_config.request_count
+            tokens_before = _metric_totals('llm_tokens_total', 'kind').get('prompt', 0)
+            print(f'\n-- OCR_BATCH_SIZE={size} --')
+            start = time.perf_counter()
+            pages = scenario_upload(base_url, args)
+            rows.append((size, pages, time.perf_counter() - start,
+                         mock_config.request_count - requests_before,
+                         _metric_totals('llm_tokens_total', 'kind').get('prompt', 0) - tokens_before))
+    finally:
+        ocr_service.OCR_BATCH_SIZE = original
+
+    print(f'\n== OCR batching, {args.pages} pages ==')
+    print('  batch size   wall      Kimi requests   prompt tokens/page')
+    for size, pages, wall, count, tokens in rows:
+        print(f'  {size:>10}   {wall:6.2f}s   {count:>13}   {tokens / max(pages, 1):>18.0f}')
+
+
+def scenario_nightly(args):
+    import sentiment_job
+    from models import LineMessage
+
+    target = date.today() - timedelta(days=1)
+    db = sentiment_job.SessionLocal()
+    try:
+        db.bulk_insert_mappings(
+            LineMessage, synthetic.make_group_messages(target, args.groups, args.messages))
+        db.commit()
+    finally:
+        db.close()
+
+    latencies = []
+    original_call = sentiment_job.call_gemini
+
+    def timed_call(prompt):
+        start = time.perf_counter()
+        try:
+            return original_call(prompt)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    sentiment_job.call_gemini = timed_call
+    wall_start = time.perf_counter()
+    try:
+        sentiment_job.run_analysis(target)
+    finally:
+        sentiment_job.call_gemini = original_call
+    wall = time.perf_counter() - wall_start
+    report(f'nightly sentiment job ({args.groups} groups x {args.messages} msgs), Gemini latency',
+           latencies, wall, unit='group')
+
+
+def scenario_webhook(base_url, args):
+    import requests
+
+    def call(i):
+        body = synthetic.make_webhook_body(args.events_per_request, seed=i)
+        resp = requests.post(f'{base_url}/callback', data=body.encode('utf-8'), timeout=60, headers={
+            'Content-Type': 'application/json',
+            'X-Line-Signature': synthetic.sign_webhook_body(body, LINE_SECRET),
+        })
+        return resp.status_code == 200
+
+    latencies, errors, wall = run_concurrently(call, args.requests, args.concurrency)
+    report(f'webhook storm x{args.requests} (concurrency {args.concurrency})', latencies, wall, errors)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_health(url, proc, timeout):
+    import requests
+
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline and proc.poll() is None:
+        try:
+            if requests.get(url, timeout=5).status_code == 200:
+                return True
+        except requests.RequestException:
+            # master 已開始 listen 但 worker 尚未就緒時會讀取逾時
+            pass
+        time.sleep(0.01)
+    return False
+
+
+def scenario_startup(args):
+    """冷啟動：從啟動 gunicorn 到 /health 回應 200 的時間，以及單純 import app 的時間"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    imports = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'import app'], cwd=root, check=True,
+                       stdout=subprocess.DEVNULL)
+        imports.append(time.perf_counter() - start)
+    report(f'python -c "import app" x{args.runs}', imports, sum(imports), unit='run')
+
+    for preload in ('1', '0'):
+        ready = []
+        errors = 0
+        for _ in range(args.runs):
+            port = _free_port()
+            env = dict(os.environ, GUNICORN_PRELOAD=preload)
+            start = time.perf_counter()
+            proc = subprocess.Popen(
+                [sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f'127.0.0.1:{port}',
+                 '--workers', str(args.workers)],
+                cwd=root, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                if _wait_for_health(f'http://127.0.0.1:{port}/health', proc, args.timeout):
+                    ready.append(time.perf_counter() - start)
+                else:
+                    errors += 1
+            finally:
+                proc.terminate()
+                proc.wait()
+        report(f'gunicorn ({args.workers} workers, preload={preload}) → /health ready',
+               ready, sum(ready), errors, unit='run')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmark scenarios')
+    parser.add_argument('scenario', choices=['analyze', 'stream', 'batch', 'upload', 'ocrbatch', 'nightly',
+                                                       'webhook', 'startup', 'all'])
+    parser.add_argument('--database-url', default=None)
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--pages', type=int, default=50)
+    parser.add_argument('--images', type=int, default=8, help='batch 情境的圖片張數')
+    parser.add_argument('--batch-sizes', default='1,2,4,8', help='ocrbatch 情境比較的 OCR_BATCH_SIZE')
+    parser.add_argument('--scale', type=float, default=1.0, help='合成圖片尺寸倍率')
+    parser.add_argument('--groups', type=int, default=100)
+    parser.add_argument('--messages', type=int, default=40)
+    parser.add_argument('--events-per-request', type=int, default=1)
+    parser.add_argument('--runs', type=int, default=5, help='startup 情境的重複次數')
+    parser.add_argument('--workers', type=int, default=2, help='startup 情境的 gunicorn worker 數')
+    parser.add_argument('--timeout', type=float, default=600)
+    parser.add_argument('--poll-interval', type=float, default=0.5)
+    parser.add_argument('--latency', type=float, default=1.0, help='mock 平均延遲秒數')
+    parser.add_argument('--jitter', type=float, default=0.3)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--failure-status', type=int, default=429)
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help='OCR 擷取回覆被截斷的比例')
+    args = parser.parse_args()
+
+    mock_server, mock_url = start_server(config=MockConfig(
+        latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate,
+        failure_status=args.failure_status, malformed_rate=args.malformed_rate))
+
+    database_url = args.database_url
+    if not database_url:
+        database_url = f'sqlite:///{os.path.join(tempfile.mkdtemp(prefix="bench-"), "bench.db")}'
+
+    # app / models 在 import 時讀取環境變數，必須先設定
+    os.environ.update({
+        'DATABASE_URL': database_url,
+        'KIMI_API_KEY': 'bench',
+        'KIMI_API_URL': f'{mock_url}/v1/chat/completions',
+        'GEMINI_API_KEY': 'bench',
+        'GEMINI_API_BASE': f'{mock_url}/v1beta',
+        'LINE_CHANNEL_ACCESS_TOKEN': 'bench',
+        'LINE_CHANNEL_SECRET': LINE_SECRET,
+        'LINE_API_HOST': mock_url,
+    })
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    from models import create_tables
+    create_tables()
+
+    print(f'database: {database_url}')
+    print(f'mock latency: {args.latency}s ± {args.jitter}s, failure rate: {args.failure_rate}')
+
+    scenarios = ['analyze', 'stream', 'batch', 'upload', 'nightly', 'webhook'] if args.scenario == 'all' else [args.scenario]
+    base_url = _start_app_server() if set(scenarios) - {'nightly', 'startup'} else None
+    for name in scenarios:
+        if name == 'analyze':
+            scenario_analyze(base_url, args)
+        elif name == 'stream':
+            scenario_stream(base_url, args)
+        elif name == 'batch':
+            scenario_batch(base_url, args)
+        elif name == 'upload':
+            scenario_upload(base_url, args)
+        elif name == 'ocrbatch':
+            scenario_ocrbatch(base_url, args, mock_server.RequestHandlerClass.config)
+        elif name == 'nightly':
+            scenario_nightly(args)
+        elif name == 'webhook':
+            scenario_webhook(base_url, args)
+        elif name == 'startup':
+            scenario_startup(args)
+
+    config = mock_server.RequestHandlerClass.config
+    print(f'\nmock server: {config.request_count} requests, {config.failure_count} injected failures')
+    mock_server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""合成測試資料 - 手冊頁面圖片、LINE webhook 事件與群組訊息"""
+
+import base64
+import hashlib
+import hmac
+import json
+import random
+import struct
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+
+# 各頁面類型的底色與尺寸（寬, 高），健保卡為橫式 85.6 x 54 mm
+PAGE_STYLES = {
+    'basic_info': {'background': (120, 175, 140), 'size': (1280, 807)},
+    'parent_record': {'background': (250, 200, 215), 'size': (1200, 1650)},
+    'health_education': {'background': (246, 246, 242), 'size': (1200, 1650)},
+}
+
+# mock server 由此 PNG tEXt 標記判斷圖片的頁面類型
+PAGE_TYPE_MARKER = b'bench-page-type'
+
+
+def _png_chunk(tag, data):
+    chunk = tag + data
+    return struct.pack('>I', len(data)) + chunk + struct.pack('>I', zlib.crc32(chunk) & 0xffffffff)
+
+
+def make_handbook_image(page_type='parent_record', seed=0, scale=1.0):
+    """產生一張模擬手冊頁面的 PNG（底色 + 深色文字列，四周留白）"""
+    rng = random.Random(seed)
+    style = PAGE_STYLES[page_type]
+    width, height = (int(v * scale) for v in style['size'])
+    background = bytes(style['background'])
+    ink = bytes((40, 40, 48))
+
+    line_height = max(8, height // 60)
+    rows = []
+    blank_row = background * width
+    margin = width // 12
+    top_margin = height // 20
+    rows.extend([b'\x00' + blank_row] * top_margin)
+    for y in range(top_margin, height - top_margin, line_height):
+        text_row = bytearray(blank_row)
+        x = margin
+        while x < width - margin:
+            word = rng.randint(width // 40, width // 12)
+            end = min(x + word, width - margin)
+            text_row[x * 3:end * 3] = ink * (end - x)
+            x = end + rng.randint(width // 80, width // 30)
+        glyph_height = line_height * 2 // 3
+        line = [b'\x00' + bytes(text_row)] * glyph_height
+        line += [b'\x00' + blank_row] * (line_height - glyph_height)
+        rows.extend(line[:height - top_margin - y])
+    rows.extend([b'\x00' + blank_row] * (height - len(rows)))
+
+    raw = b''.join(rows)
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return b''.join([
+        b'\x89PNG\r\n\x1a\n',
+        _png_chunk(b'IHDR', header),
+        _png_chunk(b'tEXt', PAGE_TYPE_MARKER + b'\x00' + page_type.encode()),
+        _png_chunk(b'IDAT', zlib.compress(raw, 6)),
+        _png_chunk(b'IEND', b''),
+    ])
+
+
+def make_handbook_batch(count, seed=0, scale=1.0):
+    """產生一批頁面：第一張為健保卡，其餘家長紀錄/衛教頁交錯"""
+    images = [('basic_info', make_handbook_image('basic_info', seed, scale))]
+    for i in range(1, count):
+        page_type = 'parent_record' if i % 2 else 'health_education'
+        images.append((page_type, make_handbook_image(page_type, seed + i, scale)))
+    return images
+
+
+def page_type_from_image(image_bytes):
+    """讀回 make_handbook_image 寫入的頁面類型標記"""
+    idx = image_bytes.find(b'tEXt' + PAGE_TYPE_MARKER + b'\x00')
+    if idx < 4:
+        return None
+    length = struct.unpack('>I', image_bytes[idx - 4:idx])[0]
+    data = image_bytes[idx + 4:idx + 4 + length]
+    return data.split(b'\x00', 1)[1].decode('ascii')
+
+
+SAMPLE_MESSAGES = [
+    '今天天氣真好，大家出去走走吧！', '明天的會議改到下午三點', '謝謝大家的幫忙 🙏',
+    '這個問題還沒解決，有點擔心', '週末有人要一起吃飯嗎？', '收到，我晚點處理',
+    '客戶又改需求了…', '恭喜小王升職！', '系統好像又當機了', '好的沒問題',
+]
+
+
+def make_text_event(group_id, user_id, text, timestamp_ms=None):
+    """產生一筆 LINE 群組文字訊息事件"""
+    return {
+        'type': 'message',
+        'mode': 'active',
+        'timestamp': timestamp_ms or int(time.time() * 1000),
+        'webhookEventId': hashlib.md5(f'{group_id}{user_id}{text}{random.random()}'.encode()).hexdigest()[:26],
+        'deliveryContext': {'isRedelivery': False},
+        'replyToken': hashlib.md5(text.encode()).hexdigest(),
+        'source': {'type': 'group', 'groupId': group_id, 'userId': user_id},
+        'message': {'type': 'text', 'id': str(random.randint(10 ** 12, 10 ** 13)),
+                    'quoteToken': 'q', 'text': text},
+    }
+
+
+def make_webhook_body(events_per_request=1, seed=None, group_count=5):
+    """產生一次 webhook 呼叫的 JSON body"""
+    rng = random.Random(seed)
+    events = [
+        make_text_event(f'C{rng.randrange(group_count):032x}', f'U{rng.randrange(50):032x}',
+                        rng.choice(SAMPLE_MESSAGES))
+        for _ in range(events_per_request)
+    ]
+    return json.dumps({'destination': 'Ubench', 'events': events}, ensure_ascii=False)
+
+
+def sign_webhook_body(body, channel_secret):
+    """計算 X-Line-Signature"""
+    digest = hmac.new(channel_secret.encode(), body.encode(), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode()
+
+
+def make_group_messages(target_date, group_count, messages_per_group, seed=0):
+    """產生某日多個群組的 LineMessage 欄位 dict，供夜間情緒分析情境寫入 DB"""
+    rng = random.Random(seed)
+    day_start = datetime(target_date.year, target_date.month, target_date.day, tzinfo=timezone.utc)
+    rows = []
+    for g in range(group_count):
+        for _ in range(messages_per_group):
+            rows.append({
+                'group_id': f'C{g:032x}',
+                'user_id': f'U{rng.randrange(30):032x}',
+                'display_name': f'成員{rng.randrange(30)}',
+                'message_type': 'text',
+                'content': rng.choice(SAMPLE_MESSAGES),
+                'line_timestamp': day_start + timedelta(seconds=rng.randrange(86400)),
+            })
+    return rows
@@ -0,0 +1,62 @@
+"""Request-scoped DB session - 每個 request 共用一個 Session，並統計查詢次數與耗時"""
+
+import os
+import time
+from flask import g, has_app_context, current_app, request
+from sqlalchemy import event
+
+import metrics
+from models import SessionLocal, engine
+
+# 單一 request 查詢次數超過此值時記錄警告，方便發現 N+1 查詢
+DB_QUERY_COUNT_WARN = int(os.getenv('DB_QUERY_COUNT_WARN', '20'))
+
+
+def get_db():
+    """取得目前 request 的 Session（同一 request 內重複呼叫回傳同一個）"""
+    if 'db' not in g:
+        g.db = SessionLocal()
+    return g.db
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start_times = conn.info.get('query_start_time')
+    if not start_times:
+        return
+    elapsed = time.perf_counter() - start_times.pop()
+    metrics.DB_QUERY_DURATION.observe(elapsed)
+    if has_app_context():
+        g.db_query_count = g.get('db_query_count', 0) + 1
+        g.db_query_time = g.get('db_query_time', 0.0) + elapsed
+
+
+def _teardown_db(exc):
+    db = g.pop('db', None)
+    if db is None:
+        return
+    if exc is not None:
+        db.rollback()
+    db.close()
+
+
+def _add_query_stats(response):
+    count = g.get('db_query_count', 0)
+    elapsed_ms = g.get('db_query_time', 0.0) * 1000
+    response.headers['X-DB-Query-Count'] = str(count)
+    response.headers['X-DB-Query-Time-Ms'] = f'{elapsed_ms:.1f}'
+    if count > DB_QUERY_COUNT_WARN:
+        current_app.logger.warning(
+            f'{count} DB queries ({elapsed_ms:.1f} ms) in {request.method} {request.path}')
+    return response
+
+
+def init_app(app):
+    """註冊 teardown 與查詢統計"""
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    app.teardown_appcontext(_teardown_db)
+    app.after_request(_add_query_stats)
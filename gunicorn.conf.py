@@ -0,0 +1,27 @@
+"""gunicorn 設定 - preload 讓 master 只載入 app 一次，fork 後各 worker 重建自己的 DB 連線池
+
+gunicorn 會自動讀取工作目錄下的 gunicorn.conf.py；worker 數量沿用 WEB_CONCURRENCY。
+資料表不在啟動時建立，部署前先執行 `python models.py`（Procfile 的 release 階段）。
+"""
+
+import os
+
+timeout = 120
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') == '1'
+# master 預先載入 line-bot-sdk、NumPy 等延遲 import 的模組，fork 後各 worker 以 copy-on-write 共用
+warm_imports = os.getenv('GUNICORN_WARM_IMPORTS', '1') == '1'
+
+
+def when_ready(server):
+    if not (preload_app and warm_imports):
+        return
+    import app
+    import handbook.ocr_service  # noqa: F401
+    import handbook.quality_check  # noqa: F401
+    app.get_line_handler()
+
+
+def post_fork(server, worker):
+    # master 的連線不可跨 process 共用；close=False 只丟棄 pool，不關閉 master 持有的連線
+    from models import engine
+    engine.dispose(close=False)
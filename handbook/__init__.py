@@ -1,7 +1,5 @@
-from flask import Blueprint
+"""兒童健康手冊 OCR 數位化
 
-handbook_bp = Blueprint('handbook', __name__,
-                        template_folder='../templates/handbook',
-                        url_prefix='/handbook')
-
-from handbook import routes  # noqa: E402, F401
+Flask 藍圖與路由在 handbook.routes，由 app.py 註冊；匯入本套件不會載入 Flask，
+bulk_import、export_service 等離線腳本只會載入各自用到的模組。
+"""
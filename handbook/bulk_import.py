@@ -0,0 +1,333 @@
+"""批次匯入 - 把診所送回的整箱舊手冊（照片資料夾或 ZIP）建立工作階段並送 OCR
+
+來源中每個第一層子資料夾視為一本手冊（一個病人），建立一個 HandbookScanSession；
+資料夾名稱是身分證字號時直接設為 mpersonid。直接放在根目錄的照片歸為同一本。
+頁面依檔名排序編號，以有限並行度逐頁（或依 OCR_BATCH_SIZE 成批）存入 DB 並同步跑 OCR。
+
+每完成一頁就寫入 checkpoint（JSON Lines），中斷後以相同指令重跑只會處理尚未完成的頁面：
+已建立但 OCR 未完成的頁面直接重跑 OCR，不會重複建立；OCR 已完成的頁面只補記結果。
+
+    python -m handbook.bulk_import /data/box-12 --scanned-by 王小明
+    python -m handbook.bulk_import box-12.zip --concurrency 8 --checkpoint box-12.ckpt
+"""
+
+import io
+import os
+import json
+import time
+import zipfile
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from sqlalchemy import func
+
+import metrics
+from image_pipeline import encode_file_base64
+from models import SessionLocal, HandbookScanSession, HandbookScannedPage
+from handbook.constants import ALLOWED_EXTENSIONS, MIME_MAP, ID_NUMBER_PATTERN
+from handbook import ocr_service
+from handbook.quality_check import assess_image
+
+IMPORT_CONCURRENCY = int(os.getenv('BULK_IMPORT_CONCURRENCY', '4'))
+# 匯入的工作階段狀態；不會被 maintenance.py 當成放棄的掃描清除
+IMPORTED_STATUS = 'imported'
+
+IMPORT_PAGES = metrics.Counter(
+    'bulk_import_pages_total', 'Pages processed by the bulk importer by result', ('result',))
+
+
+def _is_image(name):
+    base = os.path.basename(name)
+    if not base or base.startswith('.') or '__MACOSX' in name:
+        return False
+    return '.' in base and base.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+def scan_source(path):
+    """列出來源中的圖片，回傳 {group: [name, ...]}（依檔名排序）與讀取函式 read(name) -> bytes"""
+    groups = {}
+    if zipfile.is_zipfile(path):
+        archive = zipfile.ZipFile(path)
+        names = [info.filename for info in archive.infolist() if not info.is_dir()]
+        read = archive.read
+    else:
+        names = []
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in filenames:
+                names.append(os.path.relpath(os.path.join(dirpath, filename), path).replace(os.sep, '/'))
+
+        def read(name):
+            with open(os.path.join(path, name), 'rb') as f:
+                return f.read()
+
+    names = [name for name in names if _is_image(name)]
+    # ZIP 常把所有內容包在同一個最上層資料夾，分組時略過這一層
+    prefix = ''
+    while names and all('/' in name[len(prefix):] for name in names):
+        heads = {name[len(prefix):].split('/', 1)[0] for name in names}
+        if len(heads) != 1:
+            break
+        prefix += heads.pop() + '/'
+    for name in names:
+        relative = name[len(prefix):]
+        group = relative.split('/', 1)[0] if '/' in relative else ''
+        groups.setdefault(group, []).append(name)
+    for group_names in groups.values():
+        group_names.sort()
+    return groups, read
+
+
+class Checkpoint:
+    """JSON Lines 進度檔：{"group", "session_id"} / {"page", "page_id"} / {"page", "result"}"""
+
+    def __init__(self, path):
+        self.path = path
+        self.sessions = {}
+        self.page_ids = {}
+        self.results = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 中斷時可能只寫了半行
+                        continue
+                    if 'session_id' in record:
+                        self.sessions[record['group']] = record['session_id']
+                    elif 'page_id' in record:
+                        self.page_ids[record['page']] = record['page_id']
+                    elif 'result' in record:
+                        self.results[record['page']] = record['result']
+        self._file = open(path, 'a', encoding='utf-8')
+        if self._file.tell() and not self._ends_with_newline():
+            self._file.write('\n')
+
+    def _ends_with_newline(self):
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+
+    def is_finished(self, page):
+        # OCR 失敗（failed）的頁面重跑時會再試一次
+        return self.results.get(page) in ('done', 'rejected')
+
+    def record(self, **record):
+        with self._lock:
+            if 'session_id' in record:
+                self.sessions[record['group']] = record['session_id']
+            elif 'page_id' in record:
+                self.page_ids[record['page']] = record['page_id']
+            else:
+                self.results[record['page']] = record['result']
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def _ensure_session(checkpoint, group, scanned_by, source_name):
+    if group in checkpoint.sessions:
+        return checkpoint.sessions[group]
+    label = group or os.path.splitext(source_name)[0]
+    db = SessionLocal()
+    try:
+        session = HandbookScanSession(
+            scanned_by=scanned_by, status=IMPORTED_STATUS,
+            mpersonid=label.upper() if ID_NUMBER_PATTERN.match(label.upper()) else None)
+        db.add(session)
+        db.commit()
+        session_id = session.id
+    finally:
+        db.close()
+    checkpoint.record(group=group, session_id=session_id, source=label)
+    return session_id
+
+
+def _store_page(read, name, session_id, page_order, check_quality):
+    """讀檔、品質檢查並存入 DB，回傳 (page_id, 拒收原因)"""
+    with metrics.STAGE_DURATION.time(stage='import_read'):
+        data = io.BytesIO(read(name))
+    if check_quality:
+        with metrics.STAGE_DURATION.time(stage='quality_check'):
+            quality = assess_image(data)
+        if not quality['ok']:
+            return None, [issue['code'] for issue in quality['issues']]
+    mime = MIME_MAP.get(name.rsplit('.', 1)[1].lower(), 'image/jpeg')
+    db = SessionLocal()
+    try:
+        with metrics.STAGE_DURATION.time(stage='import_store'):
+            page = HandbookScannedPage(session_id=session_id, page_order=page_order, status='pending',
+                                       image_data=encode_file_base64(data, prefix=f'{mime}|'))
+            db.add(page)
+            db.commit()
+        return page.id, None
+    finally:
+        db.close()
+
+
+# 這些狀態的頁面還沒有可用的 OCR 結果，續跑時需要重新 OCR
+_NEEDS_OCR = ('pending', 'ocr_processing')
+
+
+def _stored_statuses(page_ids):
+    """{page_id: status}，供續跑時判斷已存入的頁面是否已完成 OCR"""
+    db = SessionLocal()
+    try:
+        return dict(db.query(HandbookScannedPage.id, HandbookScannedPage.status).filter(
+            HandbookScannedPage.id.in_(page_ids)).all())
+    finally:
+        db.close()
+
+
+def _process_chunk(checkpoint, read, chunk, check_quality):
+    """chunk: [(page key, session_id, page_order)]；存入後跑 OCR，回傳 {page key: result}"""
+    results = {}
+    page_ids = {}
+    resumed = [checkpoint.page_ids[key] for key, _, _ in chunk if key in checkpoint.page_ids]
+    statuses = _stored_statuses(resumed) if resumed else {}
+    for key, session_id, page_order in chunk:
+        page_id = checkpoint.page_ids.get(key)
+        if page_id is not None and statuses.get(page_id, 'pending') not in _NEEDS_OCR:
+            # 上次 OCR 已完成（或已被審核），只是中斷前沒來得及寫入結果，不再重複呼叫 Kimi
+            checkpoint.record(page=key, result='done', status=statuses[page_id])
+            results[key] = 'done'
+            continue
+        if page_id is None:
+            try:
+                page_id, issues = _store_page(read, key, session_id, page_order, check_quality)
+            except Exception as e:
+                checkpoint.record(page=key, result='failed', error=str(e))
+                results[key] = 'failed'
+                continue
+            if issues:
+                checkpoint.record(page=key, result='rejected', issues=issues)
+                results[key] = 'rejected'
+                continue
+            checkpoint.record(page=key, page_id=page_id)
+        page_ids[key] = page_id
+
+    if page_ids:
+        if len(page_ids) > 1:
+            # 每個 chunk 已佔用一個 --concurrency worker，chunk 內逐一送出，總並行度不超過設定值
+            ocr_service.ocr_stored_pages_batched(list(page_ids.values()), workers=1)
+        else:
+            ocr_service.ocr_stored_page(next(iter(page_ids.values())))
+
+        db = SessionLocal()
+        try:
+            rows = db.query(HandbookScannedPage.id, HandbookScannedPage.status,
+                            func.substr(HandbookScannedPage.ocr_raw_response, 1, 200)).filter(
+                HandbookScannedPage.id.in_(list(page_ids.values()))).all()
+        finally:
+            db.close()
+        pages = {page_id: (status, raw) for page_id, status, raw in rows}
+        for key, page_id in page_ids.items():
+            status, raw = pages.get(page_id, (None, None))
+            # OCR 呼叫出錯時頁面退回 pending 並留下 Error:，下次重跑再試；
+            # 擷取不到資料的頁面同樣留在 pending，但算匯入完成，由人工在審核畫面處理
+            if raw and raw.startswith('Error:'):
+                checkpoint.record(page=key, result='failed', error=raw)
+                results[key] = 'failed'
+            else:
+                checkpoint.record(page=key, result='done', status=status)
+                results[key] = 'done'
+    for result in results.values():
+        IMPORT_PAGES.inc(result=result)
+    return results
+
+
+def _stage_report(stage_before, tokens_before):
+    lines = []
+    for (stage,), (count, total) in sorted(metrics.STAGE_DURATION.snapshot().items()):
+        prev_count, prev_total = stage_before.get((stage,), (0, 0.0))
+        count, total = count - prev_count, total - prev_total
+        if count:
+            lines.append(f'  {stage:<20} {count:>6} x  mean {total / count * 1000:7.0f} ms  '
+                         f'total {total:8.1f} s')
+    tokens = {}
+    for (model, prompt_type, kind), value in metrics.LLM_TOKENS.snapshot().items():
+        value -= tokens_before.get((model, prompt_type, kind), 0)
+        if value:
+            by_kind = tokens.setdefault(prompt_type, {})
+            by_kind[kind] = by_kind.get(kind, 0) + value
+    for prompt_type, kinds in sorted(tokens.items()):
+        lines.append(f'  tokens {prompt_type:<20} prompt {kinds.get("prompt", 0):>9}  '
+                     f'completion {kinds.get("completion", 0):>9}')
+    return lines
+
+
+def run_import(source, scanned_by='bulk-import', concurrency=IMPORT_CONCURRENCY, checkpoint_path=None,
+               check_quality=True, progress_interval=10.0):
+    """匯入一個資料夾或 ZIP，回傳 {'done', 'rejected', 'failed', 'skipped', 'elapsed'}"""
+    groups, read = scan_source(source)
+    checkpoint = Checkpoint(checkpoint_path or f'{source.rstrip(os.sep)}.import-checkpoint.jsonl')
+    batch_size = max(1, ocr_service.OCR_BATCH_SIZE)
+    stage_before = metrics.STAGE_DURATION.snapshot()
+    tokens_before = metrics.LLM_TOKENS.snapshot()
+
+    chunks = []
+    skipped = 0
+    for group, names in sorted(groups.items()):
+        pending = [(order, name) for order, name in enumerate(names, 1)
+                   if not checkpoint.is_finished(name)]
+        skipped += len(names) - len(pending)
+        if not pending:
+            continue
+        session_id = _ensure_session(checkpoint, group, scanned_by, os.path.basename(source))
+        pages = [(name, session_id, order) for order, name in pending]
+        chunks.extend(pages[i:i + batch_size] for i in range(0, len(pages), batch_size))
+
+    total = sum(len(chunk) for chunk in chunks)
+    print(f'{len(groups)} handbooks, {total + skipped} pages ({skipped} already imported), '
+          f'concurrency {concurrency}')
+    counts = {'done': 0, 'rejected': 0, 'failed': 0}
+    start = last_report = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = [pool.submit(_process_chunk, checkpoint, read, chunk, check_quality)
+                       for chunk in chunks]
+            for future in as_completed(futures):
+                for result in future.result().values():
+                    counts[result] += 1
+                now = time.perf_counter()
+                if now - last_report >= progress_interval:
+                    last_report = now
+                    finished = sum(counts.values())
+                    rate = finished / (now - start) * 60
+                    eta = (total - finished) / rate if rate else 0
+                    print(f'  {finished}/{total} pages, {rate:.1f} pages/min, ETA {eta:.1f} min')
+    finally:
+        checkpoint.close()
+
+    elapsed = time.perf_counter() - start
+    finished = sum(counts.values())
+    print(f'imported {finished} pages in {elapsed:.1f}s '
+          f'({finished / elapsed * 60 if elapsed else 0:.1f} pages/min): '
+          f'{counts["done"]} done, {counts["rejected"]} rejected by quality check, {counts["failed"]} failed')
+    for line in _stage_report(stage_before, tokens_before):
+        print(line)
+    return {**counts, 'skipped': skipped, 'elapsed': elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk import handbook photos from a folder or ZIP')
+    parser.add_argument('source', help='資料夾或 ZIP 檔')
+    parser.add_argument('--scanned-by', default='bulk-import')
+    parser.add_argument('--concurrency', type=int, default=IMPORT_CONCURRENCY)
+    parser.add_argument('--checkpoint', help='預設為 <source>.import-checkpoint.jsonl')
+    parser.add_argument('--force', action='store_true', help='略過影像品質檢查')
+    parser.add_argument('--progress-interval', type=float, default=10.0, help='進度輸出間隔秒數')
+    args = parser.parse_args()
+    if not os.path.exists(args.source):
+        parser.error(f'找不到 {args.source}')
+    run_import(args.source, args.scanned_by, args.concurrency, args.checkpoint,
+               not args.force, args.progress_interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,10 @@
+"""手冊模組共用的常數；不依賴 Flask 或 DB，離線腳本可直接匯入"""
+
+import re
+
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+MIME_MAP = {'jpg': 'image/jpeg', 'jpeg': 'image/jpeg', 'png': 'image/png',
+            'gif': 'image/gif', 'webp': 'image/webp'}
+
+# 第二碼 1/2 為國民身分證，8/9 為新式外來人口統一證號（居留證）
+ID_NUMBER_PATTERN = re.compile(r'^[A-Z][1289]\d{8}$')
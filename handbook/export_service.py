@@ -0,0 +1,258 @@
+"""手冊紀錄匯出 - 以伺服器端 cursor 分批讀取，攤平 JSON 欄位後逐批寫出 CSV 或 Parquet
+
+不論資料量多大，記憶體中只保留一批（EXPORT_BATCH_SIZE 筆）資料列。
+每個 dataset 都有固定欄位，JSON 陣列（勾選題目、醫師指導項目）以「一個項目一列」攤平：
+
+    parent_records     家長紀錄，每筆一列（含勾選結果統計）
+    parent_checklist   家長紀錄的勾選題目，每題一列
+    health_education   衛教指導紀錄，每筆一列（含評估/指導統計）
+    health_guidance    衛教指導的家長評估與醫師指導項目，每項一列
+
+    python -m handbook.export_service parent_checklist --output out.csv
+    python -m handbook.export_service health_guidance --format parquet --output out.parquet \\
+        --hospital-code 1234567890 --date-from 2024-01-01 --date-to 2025-01-01
+"""
+
+import io
+import os
+import csv
+import argparse
+from datetime import date
+
+from sqlalchemy import select
+
+from models import SessionLocal, HandbookParentRecord, HandbookHealthEducation
+
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '1000'))
+FORMATS = ('csv', 'parquet')
+
+# 各 dataset 的欄位：(名稱, 型別)；型別對應 Parquet schema
+DATASET_COLUMNS = {
+    'parent_records': [
+        ('record_id', 'int'), ('mpersonid', 'str'), ('visit_number', 'int'), ('age_stage', 'str'),
+        ('record_date', 'date'), ('parent_notes', 'str'), ('checklist_total', 'int'),
+        ('checklist_yes', 'int'), ('checklist_no', 'int'), ('checklist_unchecked', 'int'),
+        ('warning_count', 'int'), ('warning_items', 'str'),
+    ],
+    'parent_checklist': [
+        ('record_id', 'int'), ('mpersonid', 'str'), ('visit_number', 'int'), ('record_date', 'date'),
+        ('item_no', 'int'), ('question', 'str'), ('category', 'str'), ('result', 'str'),
+        ('is_warning', 'bool'),
+    ],
+    'health_education': [
+        ('record_id', 'int'), ('mpersonid', 'str'), ('visit_number', 'int'), ('age_stage', 'str'),
+        ('guidance_date', 'date'), ('hospital_code', 'str'), ('doctor_name', 'str'),
+        ('relationship', 'str'), ('assessment_total', 'int'), ('assessment_done', 'int'),
+        ('guidance_topics', 'str'), ('guidance_items_total', 'int'), ('guidance_items_checked', 'int'),
+    ],
+    'health_guidance': [
+        ('record_id', 'int'), ('mpersonid', 'str'), ('visit_number', 'int'), ('guidance_date', 'date'),
+        ('hospital_code', 'str'), ('section', 'str'), ('topic', 'str'), ('key_point', 'str'),
+        ('item_no', 'int'), ('content', 'str'), ('checked', 'bool'),
+    ],
+}
+
+
+def _as_list(value):
+    return value if isinstance(value, list) else []
+
+
+def _as_dict(value):
+    return value if isinstance(value, dict) else {}
+
+
+def _text(value):
+    return None if value is None else str(value)
+
+
+# --- 攤平：每筆紀錄（查詢結果列）產生一或多列輸出 ---
+
+def _parent_record_rows(row):
+    items = [_as_dict(item) for item in _as_list(row.checklist_items)]
+    results = [item.get('結果') for item in items]
+    warnings = [_text(item.get('題目')) for item in items if item.get('是警訊')]
+    yield (row.id, row.mpersonid, row.visit_number, row.age_stage, row.record_date, row.parent_notes,
+           len(items), results.count('是'), results.count('否'), results.count('未勾選'),
+           len(warnings), '；'.join(w for w in warnings if w) or None)
+
+
+def _parent_checklist_rows(row):
+    for no, item in enumerate(_as_list(row.checklist_items), 1):
+        item = _as_dict(item)
+        yield (row.id, row.mpersonid, row.visit_number, row.record_date, no,
+               _text(item.get('題目')), _text(item.get('類別')), _text(item.get('結果')),
+               bool(item.get('是警訊')))
+
+
+def _health_education_rows(row):
+    assessment = [_as_dict(item) for item in _as_list(row.parent_assessment)]
+    guidance = [_as_dict(item) for item in _as_list(row.doctor_guidance)]
+    sub_items = [_as_dict(sub) for g in guidance for sub in _as_list(g.get('項目'))]
+    topics = [_text(g.get('主題')) for g in guidance]
+    yield (row.id, row.mpersonid, row.visit_number, row.age_stage, row.guidance_date,
+           row.hospital_code, row.doctor_name, row.relationship,
+           len(assessment), sum(1 for a in assessment if a.get('已做到')),
+           '；'.join(t for t in topics if t) or None,
+           len(sub_items), sum(1 for sub in sub_items if sub.get('已勾')))
+
+
+def _health_guidance_rows(row):
+    base = (row.id, row.mpersonid, row.visit_number, row.guidance_date, row.hospital_code)
+    for no, item in enumerate(_as_list(row.parent_assessment), 1):
+        item = _as_dict(item)
+        yield base + ('parent_assessment', _text(item.get('主題')), None, no, None,
+                      bool(item.get('已做到')))
+    for guidance in _as_list(row.doctor_guidance):
+        guidance = _as_dict(guidance)
+        topic, key_point = _text(guidance.get('主題')), _text(guidance.get('重點'))
+        sub_items = _as_list(guidance.get('項目'))
+        if not sub_items:
+            yield base + ('doctor_guidance', topic, key_point, None, None, None)
+        for no, sub in enumerate(sub_items, 1):
+            sub = _as_dict(sub)
+            yield base + ('doctor_guidance', topic, key_point, no, _text(sub.get('內容')),
+                          bool(sub.get('已勾')))
+
+
+_FLATTEN = {
+    'parent_records': _parent_record_rows,
+    'parent_checklist': _parent_checklist_rows,
+    'health_education': _health_education_rows,
+    'health_guidance': _health_guidance_rows,
+}
+
+
+def build_query(dataset, hospital_code=None, date_from=None, date_to=None, visit_number=None):
+    """依 dataset 與篩選條件組出 SELECT（依 id 排序，輸出順序固定）
+
+    家長紀錄沒有院所欄位，依院所篩選時取在該院所有衛教紀錄的兒童。
+    """
+    if dataset in ('parent_records', 'parent_checklist'):
+        model, date_column = HandbookParentRecord, HandbookParentRecord.record_date
+        columns = [model.id, model.mpersonid, model.visit_number, model.age_stage,
+                   model.record_date, model.parent_notes, model.checklist_items]
+    else:
+        model, date_column = HandbookHealthEducation, HandbookHealthEducation.guidance_date
+        columns = [model.id, model.mpersonid, model.visit_number, model.age_stage,
+                   model.guidance_date, model.hospital_code, model.doctor_name,
+                   model.relationship, model.parent_assessment, model.doctor_guidance]
+
+    stmt = select(*columns)
+    if hospital_code:
+        if model is HandbookHealthEducation:
+            stmt = stmt.where(model.hospital_code.contains(hospital_code))
+        else:
+            stmt = stmt.where(model.mpersonid.in_(
+                select(HandbookHealthEducation.mpersonid).where(
+                    HandbookHealthEducation.hospital_code.contains(hospital_code))))
+    if date_from:
+        stmt = stmt.where(date_column >= date_from)
+    if date_to:
+        stmt = stmt.where(date_column < date_to)
+    if visit_number:
+        stmt = stmt.where(model.visit_number == visit_number)
+    return stmt.order_by(model.id)
+
+
+def iter_batches(dataset, db=None, batch_size=EXPORT_BATCH_SIZE, **filters):
+    """逐批產生攤平後的資料列（list of tuple）；PostgreSQL 上以 server-side cursor 讀取"""
+    if dataset not in DATASET_COLUMNS:
+        raise ValueError(f'unknown dataset: {dataset}')
+    own_session = db is None
+    if own_session:
+        db = SessionLocal()
+    flatten = _FLATTEN[dataset]
+    try:
+        result = db.execute(build_query(dataset, **filters).execution_options(yield_per=batch_size))
+        for partition in result.partitions():
+            rows = [out for row in partition for out in flatten(row)]
+            if rows:
+                yield rows
+    finally:
+        if own_session:
+            db.close()
+
+
+def _csv_header(dataset):
+    # BOM 讓 Excel 以 UTF-8 開啟，中文不會亂碼
+    return '\ufeff' + ','.join(name for name, _ in DATASET_COLUMNS[dataset]) + '\r\n'
+
+
+def iter_csv(dataset, db=None, **filters):
+    """產生 CSV 文字片段（供 HTTP 串流回應），每批一段"""
+    yield _csv_header(dataset)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for rows in iter_batches(dataset, db=db, **filters):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue()
+
+
+def write_csv(dataset, fileobj, db=None, **filters):
+    """逐批寫入文字檔案物件，回傳資料列數"""
+    fileobj.write(_csv_header(dataset))
+    writer = csv.writer(fileobj)
+    count = 0
+    for rows in iter_batches(dataset, db=db, **filters):
+        writer.writerows(rows)
+        count += len(rows)
+    return count
+
+
+def parquet_available():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def write_parquet(dataset, sink, db=None, **filters):
+    """以 ParquetWriter 每批寫一個 row group 到 sink（路徑或二進位檔案物件），回傳資料列數
+
+    HTTP 匯出只提供 CSV；Parquet 需寫完檔尾才能送出，僅供 CLI 使用。
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    types = {'int': pa.int64(), 'str': pa.string(), 'date': pa.date32(), 'bool': pa.bool_()}
+    columns = DATASET_COLUMNS[dataset]
+    schema = pa.schema([(name, types[kind]) for name, kind in columns])
+    count = 0
+    with pq.ParquetWriter(sink, schema, compression='zstd') as writer:
+        for rows in iter_batches(dataset, db=db, **filters):
+            arrays = [pa.array([row[i] for row in rows], type=types[kind])
+                      for i, (_, kind) in enumerate(columns)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            count += len(rows)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export handbook records as CSV or Parquet')
+    parser.add_argument('dataset', choices=sorted(DATASET_COLUMNS))
+    parser.add_argument('--format', choices=FORMATS, default='csv')
+    parser.add_argument('--output', required=True)
+    parser.add_argument('--hospital-code')
+    parser.add_argument('--date-from', type=date.fromisoformat)
+    parser.add_argument('--date-to', type=date.fromisoformat, help='不含當天')
+    parser.add_argument('--visit-number', type=int)
+    parser.add_argument('--batch-size', type=int, default=EXPORT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    filters = {'hospital_code': args.hospital_code, 'date_from': args.date_from,
+               'date_to': args.date_to, 'visit_number': args.visit_number}
+    if args.format == 'parquet':
+        if not parquet_available():
+            parser.error('Parquet 匯出需要安裝 pyarrow')
+        count = write_parquet(args.dataset, args.output, batch_size=args.batch_size, **filters)
+    else:
+        with open(args.output, 'w', encoding='utf-8', newline='') as f:
+            count = write_csv(args.dataset, f, batch_size=args.batch_size, **filters)
+    print(f'{count} rows written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
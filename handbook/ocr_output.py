@@ -0,0 +1,344 @@
+"""OCR 輸出處理 - 容錯 JSON 解析、各頁面類型的欄位驗證與補抓 prompt
+
+模型輸出常見問題：被 max_tokens 截斷、前後夾雜說明文字、多餘逗號、Python 寫法的 True/None。
+parse_llm_json 逐字掃描並修復這些情況；截斷時保留最後一個完整的值並補上括號，
+同時回報被截斷的頂層欄位，讓呼叫端只針對缺漏欄位補抓，而不是整頁重跑。
+"""
+
+import re
+import json
+
+from handbook.constants import ID_NUMBER_PATTERN
+
+_LITERALS = {'true': 'true', 'false': 'false', 'null': 'null',
+             'True': 'true', 'False': 'false', 'None': 'null', 'NaN': 'null', 'undefined': 'null'}
+_NUMBER = re.compile(r'-?\d+(\.\d+)?([eE][+-]?\d+)?$')
+_TOKEN_END = set(' \t\r\n,:]}')
+
+
+class _Container:
+    __slots__ = ('closer', 'is_object', 'expect')
+
+    def __init__(self, opener):
+        self.closer = '}' if opener == '{' else ']'
+        self.is_object = opener == '{'
+        # 物件：key → colon → value → comma；陣列：value → comma
+        self.expect = 'key' if self.is_object else 'value'
+
+
+def parse_llm_json(text):
+    """解析模型輸出的 JSON（容錯），回傳 (value, info)
+
+    info = {'repaired': 是否有修正, 'truncated': 是否被截斷, 'incomplete': 截斷時未完成的頂層 key}；
+    完全找不到 JSON 時 value 為 None。
+    """
+    info = {'repaired': False, 'truncated': False, 'incomplete': None}
+    if not text:
+        return None, info
+    starts = [i for i in (text.find('{'), text.find('[')) if i != -1]
+    if not starts:
+        return None, info
+    pos = min(starts)
+    if text[:pos].strip() and not text[:pos].strip().startswith('```'):
+        info['repaired'] = True
+
+    out = []
+    stack = []
+    safe = (0, [])  # (out 長度, 需補上的 closers)，截斷時退回此處
+    top_key = None
+    length = len(text)
+
+    def value_done():
+        nonlocal top_key
+        if stack:
+            stack[-1].expect = 'comma'
+        if len(stack) == 1:
+            top_key = None
+        safe_point()
+
+    def safe_point():
+        # 只在頂層物件欄位之間或陣列元素之間記錄，截斷時不留下半個陣列元素
+        nonlocal safe
+        if len(stack) <= 1 or not stack[-1].is_object:
+            safe = (len(out), [c.closer for c in reversed(stack)])
+
+    def ensure_comma():
+        # 兩個值之間漏了逗號
+        if stack and stack[-1].expect == 'comma':
+            out.append(',')
+            stack[-1].expect = 'key' if stack[-1].is_object else 'value'
+            info['repaired'] = True
+
+    while pos < length:
+        ch = text[pos]
+        if ch in ' \t\r\n':
+            pos += 1
+            continue
+
+        if ch in '{[':
+            ensure_comma()
+            out.append(ch)
+            stack.append(_Container(ch))
+            safe_point()
+            pos += 1
+            continue
+
+        if ch in '}]':
+            if not stack:
+                pos += 1
+                continue
+            if out and out[-1] == ',':
+                out.pop()
+                info['repaired'] = True
+            container = stack.pop()
+            if ch != container.closer:
+                info['repaired'] = True
+            out.append(container.closer)
+            pos += 1
+            if not stack:
+                break
+            value_done()
+            continue
+
+        if ch == ':':
+            out.append(':')
+            if stack and stack[-1].is_object:
+                stack[-1].expect = 'value'
+            pos += 1
+            continue
+
+        if ch == ',':
+            if stack and stack[-1].expect == 'comma':
+                out.append(',')
+                stack[-1].expect = 'key' if stack[-1].is_object else 'value'
+            else:
+                info['repaired'] = True
+            pos += 1
+            continue
+
+        if not stack:
+            pos += 1
+            continue
+
+        if ch == '"':
+            end, value = _scan_string(text, pos)
+            if end is None:
+                break
+            pos = end
+            container = stack[-1]
+            if container.is_object and container.expect in ('key', 'comma'):
+                ensure_comma()
+                out.append(json.dumps(value, ensure_ascii=False))
+                container.expect = 'colon'
+                if len(stack) == 1:
+                    top_key = value
+            else:
+                ensure_comma()
+                out.append(json.dumps(value, ensure_ascii=False))
+                value_done()
+            continue
+
+        # 數字或 true/false/null 等字面值；讀到結尾代表可能被截斷，不採用
+        end = pos
+        while end < length and text[end] not in _TOKEN_END:
+            end += 1
+        if end >= length:
+            break
+        token = text[pos:end]
+        pos = end
+        ensure_comma()
+        if token in _LITERALS:
+            if token != _LITERALS[token]:
+                info['repaired'] = True
+            out.append(_LITERALS[token])
+        elif _NUMBER.match(token):
+            out.append(token)
+        else:
+            out.append(json.dumps(token, ensure_ascii=False))
+            info['repaired'] = True
+        value_done()
+
+    if stack:
+        info['truncated'] = info['repaired'] = True
+        info['incomplete'] = top_key
+        size, closers = safe
+        out = out[:size] + closers
+
+    try:
+        return json.loads(''.join(out)), info
+    except ValueError:
+        return None, info
+
+
+def _scan_string(text, pos):
+    """從開頭的雙引號讀到結尾，回傳 (結尾後位置, 字串內容)；未結束則回傳 (None, None)"""
+    chars = []
+    i = pos + 1
+    length = len(text)
+    while i < length:
+        ch = text[i]
+        if ch == '\\':
+            if i + 1 >= length:
+                return None, None
+            nxt = text[i + 1]
+            if nxt == 'u':
+                if i + 6 > length:
+                    return None, None
+                try:
+                    chars.append(chr(int(text[i + 2:i + 6], 16)))
+                except ValueError:
+                    chars.append(text[i + 2:i + 6])
+                i += 6
+                continue
+            chars.append({'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f'}.get(nxt, nxt))
+            i += 2
+            continue
+        if ch == '"':
+            return i + 1, ''.join(chars)
+        chars.append(ch)
+        i += 1
+    return None, None
+
+
+# --- 欄位驗證 ---
+
+_DATE = re.compile(r'^(\d{2,4})[-/.年](\d{1,2})[-/.月](\d{1,2})日?$')
+_CHECKLIST_RESULTS = {'是', '否', '未勾選'}
+
+EXTRACT_SCHEMAS = {
+    'basic_info': {
+        'name': {'type': 'text', 'required': True, 'desc': '姓名'},
+        'id_number': {'type': 'id_number', 'required': True,
+                      'desc': '身分證字號（一個英文字母加九位數字）'},
+        'birth_date': {'type': 'date', 'desc': '出生日期（西元年 YYYY-MM-DD）'},
+    },
+    'parent_record': {
+        'age_stage': {'type': 'text', 'required': True, 'desc': '年齡階段標題（如「二至三歲」）'},
+        'visit_number': {'type': 'visit', 'required': True, 'desc': '對應第幾次健檢（1-7 的數字）'},
+        'record_date': {'type': 'date', 'desc': '填寫日期（西元年 YYYY-MM-DD）或 null'},
+        'checklist_items': {'type': 'checklist', 'required': True,
+                            'desc': '所有勾選題目：[{"題目", "類別", "結果": "是/否/未勾選", "是警訊": true/false}]'},
+        'parent_notes': {'type': 'text', 'desc': '家長備註內容或 null'},
+    },
+    'health_education': {
+        'age_stage': {'type': 'text', 'required': True, 'desc': '年齡階段（如「二至三歲」）'},
+        'visit_number': {'type': 'visit', 'required': True, 'desc': '對應第幾次衛教（1-7 的數字）'},
+        'guidance_date': {'type': 'date', 'desc': '指導日期（西元年 YYYY-MM-DD）或 null'},
+        'parent_assessment': {'type': 'list', 'required': True,
+                              'desc': '家長評估：[{"主題", "未做到": true/false, "已做到": true/false}]'},
+        'doctor_guidance': {'type': 'list', 'required': True,
+                            'desc': '醫師指導重點：[{"主題", "重點", "項目": [{"內容", "已勾": true/false}]}]'},
+        'hospital_code': {'type': 'text', 'desc': '醫療院所名稱及代碼或 null'},
+        'doctor_name': {'type': 'text', 'desc': '醫師簽章名稱或 null'},
+        'relationship': {'type': 'text', 'desc': '衛教醫師與寶寶關係或 null'},
+    },
+}
+
+
+def _normalize_date(value):
+    match = _DATE.match(str(value).strip())
+    if not match:
+        raise ValueError
+    year, month, day = (int(g) for g in match.groups())
+    if year < 1911:
+        # 民國年
+        year += 1911
+    if not (1 <= month <= 12 and 1 <= day <= 31):
+        raise ValueError
+    return f'{year:04d}-{month:02d}-{day:02d}'
+
+
+def _normalize_field(kind, value):
+    """依欄位類型正規化；不合格時丟出 ValueError"""
+    if kind == 'text':
+        if not isinstance(value, (str, int, float)) or isinstance(value, bool):
+            raise ValueError
+        value = str(value).strip()
+        if not value:
+            raise ValueError
+        return value
+    if kind == 'id_number':
+        value = re.sub(r'\s', '', str(value)).upper()
+        if not ID_NUMBER_PATTERN.match(value):
+            raise ValueError
+        return value
+    if kind == 'date':
+        return _normalize_date(value)
+    if kind == 'visit':
+        match = re.search(r'\d+', str(value))
+        if not match or not 1 <= int(match.group()) <= 7:
+            raise ValueError
+        return int(match.group())
+    if kind == 'list':
+        if not isinstance(value, list) or not value:
+            raise ValueError
+        return value
+    if kind == 'checklist':
+        if not isinstance(value, list) or not value:
+            raise ValueError
+        items = [item for item in value if isinstance(item, dict) and item.get('題目')]
+        if not items:
+            raise ValueError
+        for item in items:
+            if item.get('結果') not in _CHECKLIST_RESULTS:
+                item['結果'] = '未勾選'
+            item['是警訊'] = bool(item.get('是警訊'))
+        return items
+    return value
+
+
+def validate_extraction(page_type, data, incomplete=None, truncated=False):
+    """驗證並正規化擷取結果，回傳 (整理後的 dict, 問題欄位 {key: 'missing'/'invalid'/'truncated'})
+
+    非必填欄位為 null 或缺漏時補 None；但輸出被截斷時，缺漏的欄位可能只是還沒輸出，一律列為問題。
+    """
+    schema = EXTRACT_SCHEMAS[page_type]
+    data = data if isinstance(data, dict) else {}
+    cleaned = {}
+    problems = {}
+    for key, spec in schema.items():
+        value = data.get(key)
+        if key == incomplete:
+            problems[key] = 'truncated'
+        if value is None or value == '':
+            cleaned[key] = None
+            if spec.get('required') or (truncated and key not in data):
+                problems.setdefault(key, 'missing')
+            continue
+        try:
+            cleaned[key] = _normalize_field(spec['type'], value)
+        except ValueError:
+            cleaned[key] = value if spec.get('required') else None
+            problems.setdefault(key, 'invalid')
+    return cleaned, problems
+
+
+def extraction_problems(page_type, data):
+    """已存檔的擷取結果仍有哪些欄位缺漏或格式錯誤（{key: 'missing'/'invalid'}），供標記待補正頁面"""
+    if page_type not in EXTRACT_SCHEMAS or not isinstance(data, dict):
+        return {}
+    return validate_extraction(page_type, data)[1]
+
+
+PAGE_LABELS = {
+    'basic_info': '健保卡',
+    'parent_record': '兒童健康手冊的「家長紀錄事項」頁面（粉紅色頁面）',
+    'health_education': '兒童健康手冊的「衛教指導紀錄」頁面（白色頁面）',
+}
+
+FOLLOWUP_PROMPT = """你是一位專業的 OCR 辨識系統。這是{label}的照片。
+先前的辨識結果缺少下列欄位，或格式不正確：
+
+{fields}
+
+請只針對這些欄位重新辨識，回傳只包含上述欄位的 JSON。
+注意：
+- 民國年轉西元年：民國年 + 1911 = 西元年
+- 只回傳 JSON，不要其他文字。"""
+
+
+def build_followup_prompt(page_type, keys):
+    """產生只補抓指定欄位的 prompt"""
+    schema = EXTRACT_SCHEMAS[page_type]
+    fields = '\n'.join(f'- "{key}"：{schema[key]["desc"]}' for key in keys)
+    return FOLLOWUP_PROMPT.format(label=PAGE_LABELS[page_type], fields=fields)
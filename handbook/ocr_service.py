@@ -2,12 +2,33 @@
 
 import os
 import json
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import requests
 
+import metrics
+from resilience import ResilientCaller, kimi_breaker
+from image_pipeline import IMAGE_URL, VisionRequestBody, image_source, raw_image_file
+from handbook import page_classifier
+from handbook.ocr_output import (parse_llm_json, validate_extraction, extraction_problems,
+                                  build_followup_prompt)
+from rate_limiter import kimi_limiter, estimate_tokens, PRIORITY_BACKGROUND
+from models import SessionLocal, HandbookScannedPage
+
 KIMI_API_KEY = os.getenv('KIMI_API_KEY')
-KIMI_API_URL = 'https://api.moonshot.ai/v1/chat/completions'
+KIMI_API_URL = os.getenv('KIMI_API_URL', 'https://api.moonshot.ai/v1/chat/completions')
 MODEL_ID = 'kimi-k2.5'
 
+# 429/5xx 自動重試；KIMI_HEDGE=1 時，超過近期 p95 仍未回應會再送一個請求
+_kimi_caller = ResilientCaller(
+    'kimi',
+    kimi_breaker,
+    max_retries=int(os.getenv('KIMI_MAX_RETRIES', '3')),
+    hedge=os.getenv('KIMI_HEDGE', '0') == '1',
+)
+
 # --- Stage 1: 頁面分類 Prompt ---
 CLASSIFY_PROMPT = """你是一位專業的 OCR 辨識系統。請判斷這張圖片是以下哪一種類型：
 
@@ -125,73 +146,214 @@ EXTRACT_PROMPTS = {
 }
 
 
-def _call_kimi_vision(base64_image, mime_type, prompt):
-    """呼叫 Kimi K2.5 Vision API"""
-    image_url = f"data:{mime_type};base64,{base64_image}"
+# 同一次上傳中同類型的頁面，每 OCR_BATCH_SIZE 張合併成一個多圖請求（1 = 逐頁處理）
+OCR_BATCH_SIZE = int(os.getenv('OCR_BATCH_SIZE', '1'))
+OCR_BATCH_MAX_TOKENS = int(os.getenv('OCR_BATCH_MAX_TOKENS', '16384'))
+# 一次上傳內同時送出的分類/擷取請求數上限
+OCR_BATCH_WORKERS = int(os.getenv('OCR_BATCH_WORKERS', '8'))
+
+BATCH_EXTRACT_PROMPT = """以下共有 {count} 張圖片，依序為第 1 到第 {count} 張，每一張都是下方說明的同一種頁面。
+請對每一張圖片分別依照下方說明擷取，回傳 JSON：{{"pages": [第 1 張的結果, 第 2 張的結果, ...]}}
+pages 陣列必須剛好 {count} 個元素，順序與圖片順序相同；每個元素的格式如下方說明。
+
+{instructions}"""
+
+# 擷取結果部分欄位有問題時，是否送出只補抓這些欄位的請求
+OCR_FOLLOWUP_ENABLED = os.getenv('OCR_FOLLOWUP', '1') == '1'
+
+EXTRACT_OUTCOME = metrics.Counter(
+    'ocr_extract_outcome_total', 'Extraction results by outcome (ok/repaired/followup/incomplete/failed)',
+    ('page_type', 'outcome'))
+
+
+# 背景 OCR 佇列：page_id -> 排入時間，供 /metrics 觀察積壓深度與最舊等待時間
+_ocr_queue = {}
+_ocr_queue_lock = threading.Lock()
+
+
+def _oldest_queued_age():
+    with _ocr_queue_lock:
+        oldest = min(_ocr_queue.values(), default=None)
+    return 0 if oldest is None else time.time() - oldest
+
+
+OCR_QUEUE_DEPTH = metrics.Gauge(
+    'ocr_queue_depth', 'Pages queued or in progress for background OCR',
+    func=lambda: len(_ocr_queue))
+OCR_QUEUE_OLDEST_AGE = metrics.Gauge(
+    'ocr_queue_oldest_age_seconds', 'Age of the oldest page still waiting for OCR',
+    func=_oldest_queued_age)
+
+
+def _call_kimi_vision(base64_image, mime_type, prompt, prompt_type, max_tokens=4096):
+    """呼叫 Kimi K2.5 Vision API（base64_image 可為字串或 image_pipeline 的圖片來源；
+    傳入 list 時為多圖請求，mime_type 也需為對應的 list）"""
+    images = [image_source(img) for img in base64_image] if isinstance(base64_image, list) \
+        else [image_source(base64_image)]
     payload = {
         'model': MODEL_ID,
         'messages': [
             {
                 'role': 'user',
-                'content': [
-                    {'type': 'image_url', 'image_url': {'url': image_url}},
-                    {'type': 'text', 'text': prompt}
-                ]
+                'content': [{'type': 'image_url', 'image_url': {'url': IMAGE_URL}} for _ in images]
+                + [{'type': 'text', 'text': prompt}]
             }
         ],
-        'max_tokens': 4096,
+        'max_tokens': max_tokens,
         'temperature': 1
     }
     headers = {
         'Authorization': f'Bearer {KIMI_API_KEY}',
         'Content-Type': 'application/json'
     }
-    response = requests.post(KIMI_API_URL, json=payload, headers=headers, timeout=120)
-    response.raise_for_status()
-    result = response.json()
-    return result['choices'][0]['message']['content']
+    estimated_tokens = estimate_tokens(sum(img.raw_size for img in images), prompt, max_tokens)
+    body = VisionRequestBody(payload, images, mime_type)
 
+    # OCR 屬於背景工作，與 /analyze 共用額度時讓互動請求優先；在 breaker 與計時之外等待
+    kimi_limiter.acquire(estimated_tokens, PRIORITY_BACKGROUND)
+    charge_attempt = kimi_limiter.attempt_hook(estimated_tokens, PRIORITY_BACKGROUND)
 
-def _clean_json_response(raw_text):
-    """清理 AI 回應中可能的 markdown code block"""
-    clean = raw_text.strip()
-    if clean.startswith("```"):
-        clean = clean.split("\n", 1)[1] if "\n" in clean else clean[3:]
-        if clean.endswith("```"):
-            clean = clean[:-3]
-        clean = clean.strip()
-    return clean
+    def send():
+        return requests.post(KIMI_API_URL, data=body, headers=headers, timeout=120)
+
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        response = _kimi_caller.call(send, before_attempt=charge_attempt)
+        response.raise_for_status()
+        result = response.json()
+        outcome = 'ok'
+    finally:
+        metrics.LLM_REQUEST_DURATION.observe(
+            time.perf_counter() - start, model=MODEL_ID, prompt_type=prompt_type, outcome=outcome)
+    usage = result.get('usage', {})
+    metrics.record_llm_usage(MODEL_ID, prompt_type,
+                             usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0))
+    if usage.get('total_tokens'):
+        kimi_limiter.refund(estimated_tokens - usage['total_tokens'])
+    return result['choices'][0]['message']['content']
 
 
 def classify_page(base64_image, mime_type='image/jpeg'):
     """Stage 1: 判斷頁面類型"""
-    raw = _call_kimi_vision(base64_image, mime_type, CLASSIFY_PROMPT)
-    clean = _clean_json_response(raw)
-    try:
-        result = json.loads(clean)
-        return result.get('page_type', 'unknown'), result.get('confidence', 0), raw
-    except json.JSONDecodeError:
+    raw = _call_kimi_vision(base64_image, mime_type, CLASSIFY_PROMPT, 'classify')
+    result, _ = parse_llm_json(raw)
+    if not isinstance(result, dict):
         return 'unknown', 0, raw
+    return result.get('page_type', 'unknown'), result.get('confidence', 0), raw
+
+
+def _classify_locally(image):
+    """本機分類；讀圖失敗時回傳 ('unknown', 0, None)，交由 Kimi 分類"""
+    try:
+        return page_classifier.classify_image(raw_image_file(image))
+    except Exception:
+        return 'unknown', 0, None
+
+
+def _classify(image, mime_type):
+    """先以本機分類器判斷頁面類型，信心度不足（或被抽樣比對）時才呼叫 Kimi"""
+    if not page_classifier.LOCAL_CLASSIFY_ENABLED:
+        page_classifier.CLASSIFY_SOURCE.inc(source='kimi')
+        return classify_page(image, mime_type)
+
+    local_type, local_confidence, features = _classify_locally(image)
+    confident = (local_type != 'unknown'
+                 and local_confidence >= page_classifier.CONFIDENCE_THRESHOLD)
+    if confident and random.random() >= page_classifier.AGREEMENT_SAMPLE_RATE:
+        page_classifier.CLASSIFY_SOURCE.inc(source='local')
+        raw = json.dumps({'page_type': local_type, 'confidence': local_confidence,
+                          'source': 'local', 'features': features}, ensure_ascii=False)
+        return local_type, local_confidence, raw
+
+    page_classifier.CLASSIFY_SOURCE.inc(source='kimi')
+    page_type, confidence, raw = classify_page(image, mime_type)
+    page_classifier.record_agreement(local_type, page_type, confident)
+    return page_type, confidence, raw
 
 
 def extract_data(base64_image, mime_type, page_type):
-    """Stage 2: 依頁面類型擷取結構化資料"""
+    """Stage 2: 依頁面類型擷取結構化資料
+
+    輸出以容錯解析器修復後依 schema 驗證；只有部分欄位缺漏、截斷或格式錯誤時，
+    再送一次只要求這些欄位的補抓請求，而不是整頁重新擷取。
+    """
     prompt = EXTRACT_PROMPTS.get(page_type)
     if not prompt:
         return None, "unsupported page type"
 
-    raw = _call_kimi_vision(base64_image, mime_type, prompt)
-    clean = _clean_json_response(raw)
-    try:
-        result = json.loads(clean)
-        return result, raw
-    except json.JSONDecodeError:
+    raw = _call_kimi_vision(base64_image, mime_type, prompt, page_type)
+    data, info = parse_llm_json(raw)
+    return _finish_extraction(base64_image, mime_type, page_type, data, raw,
+                              info['incomplete'], info['truncated'], info['repaired'])
+
+
+def _finish_extraction(base64_image, mime_type, page_type, data, raw,
+                       incomplete=None, truncated=False, repaired=False):
+    """驗證一頁的擷取結果，必要時補抓有問題的欄位，回傳 (result, raw)"""
+    if not isinstance(data, dict):
+        EXTRACT_OUTCOME.inc(page_type=page_type, outcome='failed')
         return None, raw
 
+    result, problems = validate_extraction(page_type, data, incomplete, truncated)
+    if len(problems) == len(result):
+        EXTRACT_OUTCOME.inc(page_type=page_type, outcome='failed')
+        return None, raw
+
+    outcome = 'repaired' if repaired else 'ok'
+    if problems and OCR_FOLLOWUP_ENABLED:
+        keys = list(problems)
+        followup_raw = _call_kimi_vision(base64_image, mime_type,
+                                         build_followup_prompt(page_type, keys),
+                                         f'{page_type}_followup')
+        raw = f'{raw}\n\n--- followup: {", ".join(keys)} ---\n{followup_raw}'
+        patch, _ = parse_llm_json(followup_raw)
+        if isinstance(patch, dict):
+            merged = dict(result)
+            merged.update({key: patch[key] for key in keys if key in patch})
+            result, problems = validate_extraction(page_type, merged)
+        outcome = 'followup'
+    if problems:
+        outcome = 'incomplete'
+    EXTRACT_OUTCOME.inc(page_type=page_type, outcome=outcome)
+    return result, raw
+
+
+def extract_batch(images, mime_types, page_type):
+    """同類型的多張頁面合併成一個多圖請求擷取，回傳與 images 對應的 [(result, raw), ...]
+
+    回覆缺少（或因截斷而不完整）的頁面改以單頁 extract_data 補做。
+    """
+    count = len(images)
+    prompt = BATCH_EXTRACT_PROMPT.format(count=count, instructions=EXTRACT_PROMPTS[page_type])
+    with metrics.STAGE_DURATION.time(stage='ocr_extract_batch'):
+        raw = _call_kimi_vision(images, mime_types, prompt, f'{page_type}_batch',
+                                max_tokens=min(4096 * count, OCR_BATCH_MAX_TOKENS))
+    parsed, info = parse_llm_json(raw)
+    entries = parsed.get('pages') if isinstance(parsed, dict) else parsed
+    if not isinstance(entries, list):
+        entries = []
+    if info['truncated'] and entries:
+        # 最後一頁可能只輸出一半，整頁重做比猜哪些欄位被截斷可靠
+        entries = entries[:-1]
+
+    results = []
+    for i, (image, mime_type) in enumerate(zip(images, mime_types)):
+        if i < len(entries):
+            entry_raw = f'[batch {i + 1}/{count}] ' + json.dumps(entries[i], ensure_ascii=False)
+            results.append(_finish_extraction(image, mime_type, page_type, entries[i], entry_raw,
+                                              repaired=info['repaired']))
+        else:
+            with metrics.STAGE_DURATION.time(stage='ocr_extract'):
+                results.append(extract_data(image, mime_type, page_type))
+    return results
+
 
 def process_page(base64_image, mime_type='image/jpeg'):
     """完整處理一張頁面：分類 → 擷取"""
-    page_type, confidence, classify_raw = classify_page(base64_image, mime_type)
+    image = image_source(base64_image)
+    with metrics.STAGE_DURATION.time(stage='ocr_classify'):
+        page_type, confidence, classify_raw = _classify(image, mime_type)
 
     if page_type == 'unknown':
         return {
@@ -202,7 +364,8 @@ def process_page(base64_image, mime_type='image/jpeg'):
             'error': '無法辨識此頁面類型'
         }
 
-    extracted, extract_raw = extract_data(base64_image, mime_type, page_type)
+    with metrics.STAGE_DURATION.time(stage='ocr_extract'):
+        extracted, extract_raw = extract_data(image, mime_type, page_type)
 
     return {
         'page_type': page_type,
@@ -211,3 +374,187 @@ def process_page(base64_image, mime_type='image/jpeg'):
         'raw_response': extract_raw,
         'error': None if extracted else '無法解析 OCR 結果'
     }
+
+
+def _stored_image(page):
+    """從 DB 的 image_data（"mime_type|base64data"）取出圖片來源與 MIME，以起始位置跳過前綴避免複製"""
+    mime_type = 'image/jpeg'
+    image_data = page.image_data
+    sep = image_data.find('|', 0, 50)
+    if sep != -1:
+        mime_type = image_data[:sep]
+    return image_source(image_data, sep + 1), mime_type
+
+
+def _apply_result(page, result):
+    data = result['extracted_data']
+    page.page_type = result['page_type']
+    page.ocr_raw_response = result.get('raw_response', '')
+    page.ocr_extracted_json = data
+    if not data:
+        page.status = 'pending'
+    elif extraction_problems(page.page_type, data):
+        # 補抓後必填欄位仍缺漏或格式錯誤，與完整結果區分，審核畫面會標出問題欄位
+        page.status = 'ocr_incomplete'
+    else:
+        page.status = 'ocr_complete'
+
+
+def ocr_stored_page(page_id, db=None):
+    """對已存入 DB 的頁面執行 OCR 並寫回結果（可傳入既有 Session 共用連線）"""
+    own_session = db is None
+    if own_session:
+        db = SessionLocal()
+    page = None
+    try:
+        page = db.query(HandbookScannedPage).get(page_id)
+        if not page or not page.image_data:
+            return
+
+        page.status = 'ocr_processing'
+        db.commit()
+
+        image, mime_type = _stored_image(page)
+        _apply_result(page, process_page(image, mime_type))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        if page is not None:
+            page.status = 'pending'
+            page.ocr_raw_response = f'Error: {str(e)}'
+            db.commit()
+    finally:
+        if own_session:
+            db.close()
+
+
+def _extract_chunk(page_type, chunk):
+    """chunk: [(page_id, image, mime_type)]，回傳 {page_id: result dict}"""
+    try:
+        if len(chunk) == 1:
+            _, image, mime_type = chunk[0]
+            with metrics.STAGE_DURATION.time(stage='ocr_extract'):
+                extracted = [extract_data(image, mime_type, page_type)]
+        else:
+            extracted = extract_batch([c[1] for c in chunk], [c[2] for c in chunk], page_type)
+    except Exception as e:
+        return {page_id: None for page_id, _, _ in chunk}, f'Error: {str(e)}'
+    return {
+        page_id: {
+            'page_type': page_type,
+            'extracted_data': data,
+            'raw_response': raw,
+        }
+        for (page_id, _, _), (data, raw) in zip(chunk, extracted)
+    }, None
+
+
+def ocr_stored_pages_batched(page_ids, batch_size=None, workers=None):
+    """一次處理同一批上傳的頁面：逐頁分類後，同類型每 batch_size 張合併成一個多圖擷取請求
+
+    workers 為本次呼叫同時送出的 Kimi 請求上限（預設 OCR_BATCH_WORKERS）；
+    呼叫端自己已有並行度限制時（例如 bulk_import）傳 1，避免並行度相乘。
+    """
+    batch_size = batch_size or OCR_BATCH_SIZE
+    workers = workers or OCR_BATCH_WORKERS
+    db = SessionLocal()
+    try:
+        pages = db.query(HandbookScannedPage).filter(
+            HandbookScannedPage.id.in_(page_ids),
+            HandbookScannedPage.image_data.isnot(None)).all()
+        if not pages:
+            return
+        for page in pages:
+            page.status = 'ocr_processing'
+        db.commit()
+
+        stored = {page.id: _stored_image(page) for page in pages}
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(pages)))) as pool:
+            def classify(page_id):
+                image, mime_type = stored[page_id]
+                try:
+                    with metrics.STAGE_DURATION.time(stage='ocr_classify'):
+                        return page_id, _classify(image, mime_type), None
+                except Exception as e:
+                    return page_id, None, f'Error: {str(e)}'
+
+            groups = {}
+            for page_id, classified, error in pool.map(classify, stored):
+                page = db.query(HandbookScannedPage).get(page_id)
+                if error:
+                    page.status, page.ocr_raw_response = 'pending', error
+                    continue
+                page_type, _, classify_raw = classified
+                if page_type not in EXTRACT_PROMPTS:
+                    page.page_type = 'unknown'
+                    page.ocr_raw_response = classify_raw
+                    page.status = 'pending'
+                    continue
+                groups.setdefault(page_type, []).append((page_id, *stored[page_id]))
+            db.commit()
+
+            chunks = [(page_type, items[i:i + batch_size])
+                      for page_type, items in groups.items()
+                      for i in range(0, len(items), batch_size)]
+            for (page_type, chunk), (results, error) in zip(
+                    chunks, pool.map(lambda c: _extract_chunk(*c), chunks)):
+                for page_id, _, _ in chunk:
+                    page = db.query(HandbookScannedPage).get(page_id)
+                    if error:
+                        page.page_type, page.status, page.ocr_raw_response = page_type, 'pending', error
+                    else:
+                        _apply_result(page, results[page_id])
+                db.commit()
+    except Exception as e:
+        db.rollback()
+        for page in db.query(HandbookScannedPage).filter(
+                HandbookScannedPage.id.in_(page_ids),
+                HandbookScannedPage.status == 'ocr_processing'):
+            page.status = 'pending'
+            page.ocr_raw_response = f'Error: {str(e)}'
+        db.commit()
+    finally:
+        db.close()
+
+
+def _run_queued_page(page_id):
+    try:
+        with metrics.STAGE_DURATION.time(stage='ocr_page_total'):
+            ocr_stored_page(page_id)
+    finally:
+        with _ocr_queue_lock:
+            _ocr_queue.pop(page_id, None)
+
+
+def _run_queued_batch(page_ids):
+    try:
+        with metrics.STAGE_DURATION.time(stage='ocr_batch_total'):
+            ocr_stored_pages_batched(page_ids)
+    finally:
+        with _ocr_queue_lock:
+            for page_id in page_ids:
+                _ocr_queue.pop(page_id, None)
+
+
+def enqueue_page_ocr(page_id):
+    """排入背景 OCR 處理"""
+    with _ocr_queue_lock:
+        _ocr_queue[page_id] = time.time()
+    thread = threading.Thread(target=_run_queued_page, args=(page_id,))
+    thread.daemon = True
+    thread.start()
+
+
+def enqueue_pages_ocr(page_ids):
+    """排入同一次上傳的多張頁面；OCR_BATCH_SIZE > 1 時以多圖請求合併擷取，否則逐頁處理"""
+    if OCR_BATCH_SIZE <= 1 or len(page_ids) < 2:
+        for page_id in page_ids:
+            enqueue_page_ocr(page_id)
+        return
+    now = time.time()
+    with _ocr_queue_lock:
+        for page_id in page_ids:
+            _ocr_queue[page_id] = now
+    thread = threading.Thread(target=_run_queued_batch, args=(list(page_ids),))
+    thread.daemon = True
+    thread.start()
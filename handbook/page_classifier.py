@@ -0,0 +1,103 @@
+"""本機頁面分類 - 以色彩分布與紙張長寬比判斷健保卡 / 家長紀錄（粉紅）/ 衛教指導（白色）
+
+只看縮圖的 HSV 直方圖，單張數毫秒；信心度夠高時 OCR 流程可略過 Kimi 分類呼叫。
+另以抽樣方式同時呼叫 Kimi 分類，把兩者是否一致記到 /metrics 追蹤準確率。
+"""
+
+import os
+
+import numpy as np
+from PIL import Image
+
+import metrics
+
+LOCAL_CLASSIFY_ENABLED = os.getenv('LOCAL_CLASSIFY', '1') == '1'
+CONFIDENCE_THRESHOLD = float(os.getenv('LOCAL_CLASSIFY_THRESHOLD', '0.85'))
+# 信心度足夠時，仍有此比例送 Kimi 分類以比對準確率
+AGREEMENT_SAMPLE_RATE = float(os.getenv('LOCAL_CLASSIFY_SAMPLE_RATE', '0.05'))
+
+THUMBNAIL_SIZE = 256
+# 健保卡 85.6 x 54 mm
+CARD_ASPECT = 85.6 / 54
+
+CLASSIFY_SOURCE = metrics.Counter(
+    'page_classify_source_total', 'Page classifications by the source that decided them', ('source',))
+CLASSIFY_AGREEMENT = metrics.Counter(
+    'page_classifier_agreement_total', 'Local vs Kimi page classification on sampled pages',
+    ('local', 'remote', 'confident'))
+
+
+def _clip(value):
+    return float(min(1.0, max(0.0, value)))
+
+
+def extract_features(fileobj):
+    """從圖片計算分類特徵：紙張中粉紅/白色的比例與紙張外框的長寬比"""
+    fileobj.seek(0)
+    try:
+        with Image.open(fileobj) as img:
+            img.draft('RGB', (THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+            thumb = img.convert('RGB')
+        thumb.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+    finally:
+        fileobj.seek(0)
+
+    # PIL 的 HSV 三個通道都是 0-255；粉紅色色相約 330-360° 與 0-15°
+    hsv = np.asarray(thumb.convert('HSV'), dtype=np.int16)
+    hue, sat, val = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+    # 以畫面中最亮的部分當作紙張白，減少室內光線偏暗的影響
+    relative = val / max(float(np.percentile(val, 95)), 1.0)
+    paper = relative > 0.6
+    paper_count = max(int(paper.sum()), 1)
+    pink = paper & ((hue >= 230) | (hue <= 10)) & (sat >= 25)
+    # 暖色燈光下白紙會偏黃橙（色相約 15-60°），飽和度放寬
+    warm = (hue >= 10) & (hue <= 45) & (sat < 70)
+    white = paper & ((sat < 30) | warm) & (relative > 0.8)
+    return {
+        'aspect': _paper_aspect(paper),
+        'pink_fraction': float(pink.sum()) / paper_count,
+        'white_fraction': float(white.sum()) / paper_count,
+    }
+
+
+def _paper_aspect(paper):
+    """紙張外框的長寬比；健保卡通常只佔畫面一小塊，不能用整張照片的長寬比
+
+    外框取紙張像素數達最多那一列/欄一半以上的範圍，零星反光不會把外框撐大。
+    """
+    row_counts, col_counts = paper.sum(axis=1), paper.sum(axis=0)
+    if row_counts.max() == 0:
+        height, width = paper.shape
+        return width / height
+    rows = np.flatnonzero(row_counts >= row_counts.max() / 2)
+    cols = np.flatnonzero(col_counts >= col_counts.max() / 2)
+    return float((cols[-1] - cols[0] + 1) / (rows[-1] - rows[0] + 1))
+
+
+def score_page_types(features):
+    """各頁面類型的 0-1 分數"""
+    aspect = features['aspect']
+    pink = features['pink_fraction']
+    white = features['white_fraction']
+    # 健保卡可能直拍，長寬比不分方向；手冊頁面則一定是直式
+    card_shape = _clip(1 - abs(max(aspect, 1 / aspect) - CARD_ASPECT) / 0.2)
+    return {
+        'parent_record': _clip((pink - 0.15) / 0.35),
+        'health_education': _clip((white - 0.3) / 0.4) * (1.0 if aspect < 1 else 0.5),
+        'basic_info': card_shape * _clip(1 - pink / 0.15) * (1.0 if white < 0.6 else 0.5),
+    }
+
+
+def classify_image(fileobj):
+    """回傳 (page_type, confidence, features)；分數太低時 page_type 為 'unknown'"""
+    features = extract_features(fileobj)
+    scores = score_page_types(features)
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    (best, best_score), (_, second_score) = ranked[0], ranked[1]
+    confidence = round(best_score * (1 - second_score), 3)
+    features['scores'] = {k: round(v, 3) for k, v in scores.items()}
+    return (best if best_score > 0 else 'unknown'), confidence, features
+
+
+def record_agreement(local_type, remote_type, confident):
+    CLASSIFY_AGREEMENT.inc(local=local_type, remote=remote_type, confident='1' if confident else '0')
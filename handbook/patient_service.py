@@ -4,9 +4,11 @@ from sqlalchemy import text
 from models import SessionLocal
 
 
-def search_patient_by_id(mpersonid):
-    """用身分證字號查詢 basic_raw_data_table"""
-    db = SessionLocal()
+def search_patient_by_id(mpersonid, db=None):
+    """用身分證字號查詢 basic_raw_data_table（可傳入既有 Session 共用連線）"""
+    own_session = db is None
+    if own_session:
+        db = SessionLocal()
     try:
         result = db.execute(
             text("SELECT mpersonid, mname, msex, mbirthdt, mtelh, mrec "
@@ -25,12 +27,15 @@ def search_patient_by_id(mpersonid):
             }
         return {'found': False, 'mpersonid': mpersonid}
     finally:
-        db.close()
+        if own_session:
+            db.close()
 
 
-def search_patient_by_name(name):
-    """用姓名模糊搜尋 basic_raw_data_table"""
-    db = SessionLocal()
+def search_patient_by_name(name, db=None):
+    """用姓名模糊搜尋 basic_raw_data_table（可傳入既有 Session 共用連線）"""
+    own_session = db is None
+    if own_session:
+        db = SessionLocal()
     try:
         results = db.execute(
             text("SELECT mpersonid, mname, msex, mbirthdt, mtelh, mrec "
@@ -50,4 +55,5 @@ def search_patient_by_name(name):
             for r in results
         ]
     finally:
-        db.close()
+        if own_session:
+            db.close()
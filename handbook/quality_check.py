@@ -0,0 +1,161 @@
+"""影像品質檢查 - 上傳時先在本機判斷照片是否模糊、過暗/過曝、解析度不足或頁面不完整
+
+全部以 NumPy 向量化運算在縮圖上完成（單張約數十毫秒），
+不合格的照片直接請使用者重拍，不再送進 Kimi 分類 + 擷取兩次 vision 呼叫。
+"""
+
+import os
+
+import numpy as np
+from PIL import Image
+
+import metrics
+
+QUALITY_CHECK_ENABLED = os.getenv('QUALITY_CHECK', '1') == '1'
+
+# 分析用縮圖的長邊（JPEG 會以 draft 模式直接縮小解碼）
+ANALYSIS_SIZE = 1024
+MIN_SHORT_SIDE = int(os.getenv('QUALITY_MIN_SHORT_SIDE', '600'))
+BLUR_MIN = float(os.getenv('QUALITY_BLUR_MIN', '50'))
+# 紙張白色程度（灰階第 95 百分位數）低於此值視為太暗
+DARK_WHITE_LEVEL = float(os.getenv('QUALITY_DARK_WHITE_LEVEL', '90'))
+CLIPPED_MAX = float(os.getenv('QUALITY_CLIPPED_MAX', '0.6'))
+MIN_CONTRAST = float(os.getenv('QUALITY_MIN_CONTRAST', '8'))
+MIN_PAGE_COVERAGE = float(os.getenv('QUALITY_MIN_PAGE_COVERAGE', '0.3'))
+
+# 梯度大於此值視為邊緣（0-255 灰階）
+EDGE_THRESHOLD = 40
+# 判斷內容是否被裁切時檢查的外框寬度（佔邊長比例）
+BORDER_BAND = 0.02
+
+ISSUE_MESSAGES = {
+    'unreadable': '無法讀取圖片檔',
+    'low_resolution': '解析度太低，請靠近一點拍攝',
+    'blurry': '照片模糊，請對焦後重拍',
+    'too_dark': '光線不足，請到較亮處重拍',
+    'overexposed': '反光或過曝，請避開燈光直射',
+    'blank': '看不到內容，請確認鏡頭未被遮住',
+    'page_not_found': '找不到頁面，請讓手冊填滿畫面',
+    'cropped': '頁面被裁切，請把整頁都拍進畫面',
+}
+
+QUALITY_REJECTED = metrics.Counter(
+    'handbook_quality_rejected_total', 'Uploads rejected by the image quality gate', ('reason',))
+
+
+def _load_gray(fileobj):
+    """讀取原始尺寸與灰階縮圖（float32），完成後把讀取位置移回開頭"""
+    fileobj.seek(0)
+    try:
+        with Image.open(fileobj) as img:
+            size = img.size
+            img.draft('L', (ANALYSIS_SIZE, ANALYSIS_SIZE))
+            gray = img.convert('L')
+        gray.thumbnail((ANALYSIS_SIZE, ANALYSIS_SIZE))
+        return size, np.asarray(gray, dtype=np.float32)
+    finally:
+        fileobj.seek(0)
+
+
+def laplacian_variance(gray):
+    """4 鄰域 Laplacian 的變異數，越低越模糊"""
+    lap = (gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:]
+           - 4 * gray[1:-1, 1:-1])
+    return float(lap.var())
+
+
+def otsu_threshold(gray):
+    """以直方圖計算 Otsu 門檻"""
+    hist = np.bincount(gray.astype(np.uint8).ravel(), minlength=256).astype(np.float64)
+    weight = np.cumsum(hist)
+    mean = np.cumsum(hist * np.arange(256))
+    total_weight, total_mean = weight[-1], mean[-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        between = (total_mean * weight - mean * total_weight) ** 2 / (weight * (total_weight - weight))
+    return int(np.nanargmax(between))
+
+
+def _edge_map(gray):
+    gx = np.abs(np.diff(gray, axis=1))[:-1, :]
+    gy = np.abs(np.diff(gray, axis=0))[:, :-1]
+    return np.maximum(gx, gy) > EDGE_THRESHOLD
+
+
+def _page_bounds(gray):
+    """以 Otsu 分出亮色頁面，回傳頁面外框 (top, bottom, left, right)；找不到則回傳 None"""
+    mask = gray > otsu_threshold(gray)
+    rows = np.flatnonzero(mask.mean(axis=1) > 0.25)
+    cols = np.flatnonzero(mask.mean(axis=0) > 0.25)
+    if rows.size == 0 or cols.size == 0:
+        return None
+    return int(rows[0]), int(rows[-1]) + 1, int(cols[0]), int(cols[-1]) + 1
+
+
+def _cropped_sides(edges, bounds):
+    """頁面貼齊畫面邊緣且該處外框仍有文字邊緣，代表內容被裁掉"""
+    height, width = edges.shape
+    band_h = max(2, int(height * BORDER_BAND))
+    band_w = max(2, int(width * BORDER_BAND))
+    interior = float(edges[band_h:-band_h, band_w:-band_w].mean())
+    if interior == 0:
+        return []
+    top, bottom, left, right = bounds
+    bands = {
+        'top': (top == 0, edges[:band_h]),
+        'bottom': (bottom >= height, edges[-band_h:]),
+        'left': (left == 0, edges[:, :band_w]),
+        'right': (right >= width, edges[:, -band_w:]),
+    }
+    return [side for side, (touches, band) in bands.items()
+            if touches and band.mean() > interior * 0.5]
+
+
+def assess_image(fileobj):
+    """檢查一張上傳照片，回傳 {'ok', 'issues': [{'code', 'message'}], 'metrics'}"""
+    try:
+        (width, height), gray = _load_gray(fileobj)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return {'ok': False, 'issues': [_issue('unreadable')], 'metrics': {}}
+
+    edges = _edge_map(gray)
+    stats = {
+        'width': width,
+        'height': height,
+        'blur_score': round(laplacian_variance(gray), 1),
+        'white_level': round(float(np.percentile(gray, 95)), 1),
+        'contrast': round(float(gray.std()), 1),
+        'clipped_fraction': round(float((gray >= 250).mean()), 3),
+    }
+
+    codes = []
+    if min(width, height) < MIN_SHORT_SIDE:
+        codes.append('low_resolution')
+    if stats['white_level'] < DARK_WHITE_LEVEL:
+        codes.append('too_dark')
+    elif stats['clipped_fraction'] > CLIPPED_MAX:
+        codes.append('overexposed')
+    if stats['contrast'] < MIN_CONTRAST:
+        codes.append('blank')
+    elif stats['blur_score'] < BLUR_MIN:
+        codes.append('blurry')
+
+    if 'blank' not in codes:
+        bounds = _page_bounds(gray)
+        coverage = 0.0 if bounds is None else (
+            (bounds[1] - bounds[0]) * (bounds[3] - bounds[2]) / gray.size)
+        stats['page_coverage'] = round(coverage, 3)
+        if coverage < MIN_PAGE_COVERAGE:
+            codes.append('page_not_found')
+        else:
+            sides = _cropped_sides(edges, bounds)
+            stats['cropped_sides'] = sides
+            if sides:
+                codes.append('cropped')
+
+    for code in codes:
+        QUALITY_REJECTED.inc(reason=code)
+    return {'ok': not codes, 'issues': [_issue(code) for code in codes], 'metrics': stats}
+
+
+def _issue(code):
+    return {'code': code, 'message': ISSUE_MESSAGES[code]}
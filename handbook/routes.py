@@ -1,19 +1,29 @@
 """兒童健康手冊 OCR 數位化 - API 路由"""
 
-import base64
-import threading
 from datetime import datetime, timezone, date
-from flask import render_template, request, jsonify
+from flask import Blueprint, Response, render_template, request, jsonify, stream_with_context
+from sqlalchemy import func, case
 
-from handbook import handbook_bp
-from models import (SessionLocal, HandbookScanSession, HandbookScannedPage,
+import metrics
+from db_session import get_db
+from image_pipeline import encode_file_base64
+from models import (HandbookScanSession, HandbookScannedPage,
                     HandbookParentRecord, HandbookHealthEducation)
-from handbook.ocr_service import process_page
 from handbook.patient_service import search_patient_by_id, search_patient_by_name
+from handbook.ocr_output import EXTRACT_SCHEMAS, extraction_problems
+from handbook import export_service
+from handbook.constants import ALLOWED_EXTENSIONS, MIME_MAP
 
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
-MIME_MAP = {'jpg': 'image/jpeg', 'jpeg': 'image/jpeg', 'png': 'image/png',
-            'gif': 'image/gif', 'webp': 'image/webp'}
+PAGE_STATUSES = ('pending', 'ocr_processing', 'ocr_complete', 'ocr_incomplete', 'confirmed', 'rejected',
+                 'expired')
+# OCR 已完成、等待員工審核的頁面狀態
+REVIEW_STATUSES = ('ocr_complete', 'ocr_incomplete')
+LIST_DEFAULT_LIMIT = 50
+LIST_MAX_LIMIT = 200
+
+handbook_bp = Blueprint('handbook', __name__,
+                        template_folder='../templates/handbook',
+                        url_prefix='/handbook')
 
 
 def _get_mime(filename):
@@ -48,7 +58,7 @@ def create_session():
     if not scanned_by:
         return jsonify({'error': '請輸入員工姓名'}), 400
 
-    db = SessionLocal()
+    db = get_db()
     try:
         session = HandbookScanSession(scanned_by=scanned_by, status='in_progress')
         db.add(session)
@@ -62,73 +72,221 @@ def create_session():
     except Exception as e:
         db.rollback()
         return jsonify({'error': str(e)}), 500
-    finally:
-        db.close()
 
 
-def _process_page_async(page_id):
-    """背景處理單張頁面 OCR"""
-    db = SessionLocal()
+def _list_params():
+    """keyset 分頁參數：limit 與 cursor（上一頁最後一筆的 id），回傳 (limit, cursor, error_response)"""
     try:
-        page = db.query(HandbookScannedPage).get(page_id)
-        if not page or not page.image_data:
-            return
+        limit = min(max(int(request.args.get('limit', LIST_DEFAULT_LIMIT)), 1), LIST_MAX_LIMIT)
+        cursor = request.args.get('cursor')
+        cursor = int(cursor) if cursor else None
+    except ValueError:
+        return None, None, (jsonify({'error': 'limit 與 cursor 必須是整數'}), 400)
+    return limit, cursor, None
 
-        page.status = 'ocr_processing'
-        db.commit()
 
-        mime_type = 'image/jpeg'
-        # image_data 欄位儲存的是 "mime_type|base64data" 格式
-        if '|' in page.image_data[:50]:
-            mime_type, b64_data = page.image_data.split('|', 1)
-        else:
-            b64_data = page.image_data
+def _parse_datetime_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    return datetime.fromisoformat(value)
 
-        result = process_page(b64_data, mime_type)
 
-        page.page_type = result['page_type']
-        page.ocr_raw_response = result.get('raw_response', '')
-        page.ocr_extracted_json = result.get('extracted_data')
-        page.status = 'ocr_complete' if result['extracted_data'] else 'pending'
-        db.commit()
-    except Exception as e:
-        page.status = 'pending'
-        page.ocr_raw_response = f'Error: {str(e)}'
-        db.commit()
-    finally:
-        db.close()
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+@handbook_bp.route('/sessions', methods=['GET'])
+def list_sessions():
+    """主管列表：所有員工的掃描工作階段（id 遞減，keyset 分頁）
+
+    篩選：status、scanned_by、created_from / created_to（ISO 日期時間）。
+    各工作階段的頁面狀態統計以一次 GROUP BY 查詢取得。
+    """
+    limit, cursor, error = _list_params()
+    if error:
+        return error
+    try:
+        created_from = _parse_datetime_arg('created_from')
+        created_to = _parse_datetime_arg('created_to')
+    except ValueError:
+        return jsonify({'error': '日期格式錯誤，請使用 ISO 格式'}), 400
+
+    db = get_db()
+    query = db.query(HandbookScanSession)
+    if request.args.get('status'):
+        query = query.filter(HandbookScanSession.status == request.args['status'])
+    if request.args.get('scanned_by'):
+        query = query.filter(HandbookScanSession.scanned_by == request.args['scanned_by'])
+    if created_from:
+        query = query.filter(HandbookScanSession.created_at >= created_from)
+    if created_to:
+        query = query.filter(HandbookScanSession.created_at < created_to)
+    if cursor:
+        query = query.filter(HandbookScanSession.id < cursor)
+    sessions = query.order_by(HandbookScanSession.id.desc()).limit(limit).all()
+
+    counts = {}
+    if sessions:
+        rows = db.query(HandbookScannedPage.session_id, HandbookScannedPage.status, func.count()).filter(
+            HandbookScannedPage.session_id.in_([s.id for s in sessions])
+        ).group_by(HandbookScannedPage.session_id, HandbookScannedPage.status).all()
+        for session_id, status, count in rows:
+            counts.setdefault(session_id, {})[status] = count
+
+    return jsonify({
+        'sessions': [
+            {
+                'id': s.id,
+                'status': s.status,
+                'scanned_by': s.scanned_by,
+                'mpersonid': s.mpersonid,
+                'created_at': _iso(s.created_at),
+                'completed_at': _iso(s.completed_at),
+                'total_pages': sum(counts.get(s.id, {}).values()),
+                'page_status': counts.get(s.id, {}),
+            }
+            for s in sessions
+        ],
+        'next_cursor': sessions[-1].id if len(sessions) == limit else None,
+    })
+
+
+@handbook_bp.route('/sessions/summary')
+def sessions_summary():
+    """主管總覽：依員工與工作階段狀態統計工作階段數與各狀態頁數（單一 GROUP BY 查詢）"""
+    db = get_db()
+    page_counts = [
+        func.sum(case((HandbookScannedPage.status == status, 1), else_=0))
+        for status in PAGE_STATUSES
+    ]
+    query = db.query(
+        HandbookScanSession.scanned_by,
+        HandbookScanSession.status,
+        func.count(func.distinct(HandbookScanSession.id)),
+        func.count(HandbookScannedPage.id),
+        *page_counts,
+    ).outerjoin(HandbookScannedPage, HandbookScannedPage.session_id == HandbookScanSession.id)
+    if request.args.get('scanned_by'):
+        query = query.filter(HandbookScanSession.scanned_by == request.args['scanned_by'])
+    rows = query.group_by(HandbookScanSession.scanned_by, HandbookScanSession.status).all()
+
+    staff = {}
+    for scanned_by, status, session_count, page_count, *by_status in rows:
+        entry = staff.setdefault(scanned_by, {'scanned_by': scanned_by, 'sessions': {}, 'pages': {}})
+        entry['sessions'][status] = session_count
+        for page_status, count in zip(PAGE_STATUSES, by_status):
+            entry['pages'][page_status] = entry['pages'].get(page_status, 0) + int(count or 0)
+        entry['pages']['total'] = entry['pages'].get('total', 0) + page_count
+
+    totals = {'sessions': {}, 'pages': {}}
+    for entry in staff.values():
+        for group in ('sessions', 'pages'):
+            for key, count in entry[group].items():
+                totals[group][key] = totals[group].get(key, 0) + count
+    return jsonify({'staff': sorted(staff.values(), key=lambda e: e['scanned_by'] or ''),
+                    'totals': totals})
+
+
+@handbook_bp.route('/pages', methods=['GET'])
+def list_pages():
+    """主管列表：跨工作階段的頁面（id 遞減，keyset 分頁；不回傳圖片內容）
+
+    篩選：status、page_type、session_id、scanned_by。
+    """
+    limit, cursor, error = _list_params()
+    if error:
+        return error
+
+    db = get_db()
+    query = db.query(
+        HandbookScannedPage.id,
+        HandbookScannedPage.session_id,
+        HandbookScannedPage.page_order,
+        HandbookScannedPage.page_type,
+        HandbookScannedPage.status,
+        HandbookScannedPage.confirmed_by,
+        HandbookScannedPage.created_at,
+        HandbookScannedPage.image_data.isnot(None),
+        HandbookScanSession.scanned_by,
+    ).join(HandbookScanSession, HandbookScanSession.id == HandbookScannedPage.session_id)
+    if request.args.get('status'):
+        query = query.filter(HandbookScannedPage.status == request.args['status'])
+    if request.args.get('page_type'):
+        query = query.filter(HandbookScannedPage.page_type == request.args['page_type'])
+    if request.args.get('session_id', type=int):
+        query = query.filter(HandbookScannedPage.session_id == request.args.get('session_id', type=int))
+    if request.args.get('scanned_by'):
+        query = query.filter(HandbookScanSession.scanned_by == request.args['scanned_by'])
+    if cursor:
+        query = query.filter(HandbookScannedPage.id < cursor)
+    rows = query.order_by(HandbookScannedPage.id.desc()).limit(limit).all()
+
+    return jsonify({
+        'pages': [
+            {
+                'id': row[0],
+                'session_id': row[1],
+                'page_order': row[2],
+                'page_type': row[3],
+                'status': row[4],
+                'confirmed_by': row[5],
+                'created_at': _iso(row[6]),
+                'has_image': bool(row[7]),
+                'scanned_by': row[8],
+            }
+            for row in rows
+        ],
+        'next_cursor': rows[-1][0] if len(rows) == limit else None,
+    })
 
 
 @handbook_bp.route('/sessions/<int:session_id>/pages', methods=['POST'])
 def upload_pages(session_id):
-    """上傳照片（支援批次多張），觸發排隊 OCR"""
-    db = SessionLocal()
+    """上傳照片（支援批次多張），通過品質檢查的頁面觸發排隊 OCR
+
+    品質不合格的照片不會存入，回傳於 rejected 供前端提示重拍；表單 force=1 可略過檢查。
+    """
+    # OCR / 品質檢查會載入 NumPy、Pillow，等第一次上傳才 import，縮短 worker 啟動時間
+    from handbook.ocr_service import enqueue_pages_ocr
+    from handbook.quality_check import QUALITY_CHECK_ENABLED, assess_image
+
+    db = get_db()
     try:
         session = db.query(HandbookScanSession).get(session_id)
         if not session:
             return jsonify({'error': '找不到工作階段'}), 404
+        if session.status == 'expired':
+            return jsonify({'error': '工作階段已逾時失效，請重新開始掃描'}), 409
 
         files = request.files.getlist('images')
         if not files:
             return jsonify({'error': '請上傳至少一張照片'}), 400
 
-        existing_count = db.query(HandbookScannedPage).filter_by(
-            session_id=session_id
-        ).count()
+        # 走 (session_id, page_order) 索引取最大值，不必數整個工作階段的頁數
+        last_order = db.query(func.max(HandbookScannedPage.page_order)).filter(
+            HandbookScannedPage.session_id == session_id
+        ).scalar() or 0
 
+        check_quality = QUALITY_CHECK_ENABLED and request.form.get('force') != '1'
         page_ids = []
+        rejected = []
         for i, file in enumerate(files):
             if not file or not file.filename:
                 continue
-            image_data = file.read()
-            b64 = base64.b64encode(image_data).decode('utf-8')
+            if check_quality:
+                with metrics.STAGE_DURATION.time(stage='quality_check'):
+                    quality = assess_image(file.stream)
+                if not quality['ok']:
+                    rejected.append({'index': i, 'filename': file.filename, **quality})
+                    continue
             mime = _get_mime(file.filename)
 
             page = HandbookScannedPage(
                 session_id=session_id,
-                page_order=existing_count + i + 1,
+                page_order=last_order + len(page_ids) + 1,
                 status='pending',
-                image_data=f"{mime}|{b64}"
+                image_data=encode_file_base64(file.stream, prefix=f"{mime}|")
             )
             db.add(page)
             db.flush()
@@ -136,62 +294,75 @@ def upload_pages(session_id):
 
         db.commit()
 
-        # 逐一啟動背景 OCR 處理
-        for pid in page_ids:
-            thread = threading.Thread(target=_process_page_async, args=(pid,))
-            thread.daemon = True
-            thread.start()
+        # 啟動背景 OCR 處理（OCR_BATCH_SIZE > 1 時同類型頁面合併成多圖請求）
+        enqueue_pages_ocr(page_ids)
+
+        if rejected and not page_ids:
+            reasons = '、'.join(issue['message'] for issue in rejected[0]['issues'])
+            return jsonify({
+                'error': f'照片品質不佳，請重新拍攝：{reasons}',
+                'retake': True,
+                'rejected': rejected
+            }), 422
 
         return jsonify({
             'uploaded': len(page_ids),
-            'page_ids': page_ids
+            'page_ids': page_ids,
+            'rejected': rejected
         }), 201
     except Exception as e:
         db.rollback()
         return jsonify({'error': str(e)}), 500
-    finally:
-        db.close()
 
 
 @handbook_bp.route('/sessions/<int:session_id>/status')
 def session_status(session_id):
     """查詢批次 OCR 處理進度"""
-    db = SessionLocal()
-    try:
-        session = db.query(HandbookScanSession).get(session_id)
-        if not session:
-            return jsonify({'error': '找不到工作階段'}), 404
-
-        pages = db.query(HandbookScannedPage).filter_by(
-            session_id=session_id
-        ).order_by(HandbookScannedPage.page_order).all()
-
-        return jsonify({
-            'session_id': session_id,
-            'mpersonid': session.mpersonid,
-            'status': session.status,
-            'total_pages': len(pages),
-            'completed': sum(1 for p in pages if p.status in ('ocr_complete', 'confirmed')),
-            'pages': [
-                {
-                    'id': p.id,
-                    'page_order': p.page_order,
-                    'page_type': p.page_type,
-                    'status': p.status,
-                    'ocr_extracted_json': p.ocr_extracted_json,
-                    'has_image': bool(p.image_data),
-                }
-                for p in pages
-            ]
-        })
-    finally:
-        db.close()
+    db = get_db()
+    session = db.query(HandbookScanSession).get(session_id)
+    if not session:
+        return jsonify({'error': '找不到工作階段'}), 404
+
+    pages = db.query(HandbookScannedPage).filter_by(
+        session_id=session_id
+    ).order_by(HandbookScannedPage.page_order).all()
+
+    return jsonify({
+        'session_id': session_id,
+        'mpersonid': session.mpersonid,
+        'status': session.status,
+        'total_pages': len(pages),
+        'completed': sum(1 for p in pages if p.status in REVIEW_STATUSES + ('confirmed',)),
+        'pages': [
+            {
+                'id': p.id,
+                'page_order': p.page_order,
+                'page_type': p.page_type,
+                'status': p.status,
+                'ocr_extracted_json': p.ocr_extracted_json,
+                'ocr_problems': _review_problems(p),
+                'has_image': bool(p.image_data),
+            }
+            for p in pages
+        ]
+    })
+
+
+def _review_problems(page):
+    """待補正頁面的問題欄位：[{'field', 'label', 'problem'}]"""
+    if page.status != 'ocr_incomplete':
+        return []
+    schema = EXTRACT_SCHEMAS.get(page.page_type, {})
+    return [
+        {'field': key, 'label': schema[key]['desc'], 'problem': problem}
+        for key, problem in extraction_problems(page.page_type, page.ocr_extracted_json).items()
+    ]
 
 
 @handbook_bp.route('/pages/<int:page_id>/confirm', methods=['PUT'])
 def confirm_page(page_id):
     """員工確認/修正 OCR 結果並存檔"""
-    db = SessionLocal()
+    db = get_db()
     try:
         page = db.query(HandbookScannedPage).get(page_id)
         if not page:
@@ -277,8 +448,6 @@ def confirm_page(page_id):
     except Exception as e:
         db.rollback()
         return jsonify({'error': str(e)}), 500
-    finally:
-        db.close()
 
 
 def _parse_date(date_str):
@@ -296,7 +465,7 @@ def _parse_date(date_str):
 @handbook_bp.route('/pages/<int:page_id>/reject', methods=['PUT'])
 def reject_page(page_id):
     """拒絕 OCR 結果，需重新掃描"""
-    db = SessionLocal()
+    db = get_db()
     try:
         page = db.query(HandbookScannedPage).get(page_id)
         if not page:
@@ -308,8 +477,6 @@ def reject_page(page_id):
     except Exception as e:
         db.rollback()
         return jsonify({'error': str(e)}), 500
-    finally:
-        db.close()
 
 
 @handbook_bp.route('/patients/search')
@@ -320,69 +487,103 @@ def search_patients():
         return jsonify({'results': []})
 
     # 判斷是身分證號還是姓名
+    db = get_db()
     if len(q) == 10 and q[0].isalpha():
-        patient = search_patient_by_id(q)
+        patient = search_patient_by_id(q, db=db)
         if patient.get('found'):
             return jsonify({'results': [patient]})
         return jsonify({'results': []})
     else:
-        results = search_patient_by_name(q)
+        results = search_patient_by_name(q, db=db)
         return jsonify({'results': results})
 
 
 @handbook_bp.route('/patients/<mpersonid>/records')
 def patient_records(mpersonid):
     """查看病人的手冊紀錄"""
-    db = SessionLocal()
+    db = get_db()
+    parent_records = db.query(HandbookParentRecord).filter_by(
+        mpersonid=mpersonid
+    ).order_by(HandbookParentRecord.visit_number).all()
+
+    health_edu = db.query(HandbookHealthEducation).filter_by(
+        mpersonid=mpersonid
+    ).order_by(HandbookHealthEducation.visit_number).all()
+
+    patient = search_patient_by_id(mpersonid, db=db)
+
+    return jsonify({
+        'patient': patient,
+        'parent_records': [
+            {
+                'id': r.id,
+                'visit_number': r.visit_number,
+                'age_stage': r.age_stage,
+                'record_date': r.record_date.isoformat() if r.record_date else None,
+                'checklist_items': r.checklist_items,
+                'parent_notes': r.parent_notes,
+                'created_at': r.created_at.isoformat() if r.created_at else None,
+            }
+            for r in parent_records
+        ],
+        'health_education': [
+            {
+                'id': e.id,
+                'visit_number': e.visit_number,
+                'age_stage': e.age_stage,
+                'guidance_date': e.guidance_date.isoformat() if e.guidance_date else None,
+                'parent_assessment': e.parent_assessment,
+                'doctor_guidance': e.doctor_guidance,
+                'hospital_code': e.hospital_code,
+                'doctor_name': e.doctor_name,
+                'relationship': e.relationship,
+                'created_at': e.created_at.isoformat() if e.created_at else None,
+            }
+            for e in health_edu
+        ]
+    })
+
+
+@handbook_bp.route('/export')
+def export_records():
+    """匯出手冊紀錄（CSV 串流），供公衛通報使用
+
+    參數：dataset（parent_records / parent_checklist / health_education / health_guidance）、
+    hospital_code、date_from、date_to（不含當天）、visit_number。
+
+    HTTP 只提供 CSV：逐批串流，不會在 request 內累積整份檔案。Parquet 的檔尾 metadata
+    要全部寫完才知道，無法邊查邊送，大量資料會超過 gunicorn 的 worker timeout，
+    因此只保留在 CLI（python -m handbook.export_service --format parquet）。
+    """
+    dataset = request.args.get('dataset', 'parent_records')
+    fmt = request.args.get('format', 'csv')
+    if dataset not in export_service.DATASET_COLUMNS:
+        return jsonify({'error': f'不支援的 dataset：{dataset}'}), 400
+    if fmt == 'parquet':
+        return jsonify({'error': 'Parquet 請改用 CLI 匯出：python -m handbook.export_service --format parquet'}), 400
+    if fmt != 'csv':
+        return jsonify({'error': f'不支援的格式：{fmt}'}), 400
     try:
-        parent_records = db.query(HandbookParentRecord).filter_by(
-            mpersonid=mpersonid
-        ).order_by(HandbookParentRecord.visit_number).all()
-
-        health_edu = db.query(HandbookHealthEducation).filter_by(
-            mpersonid=mpersonid
-        ).order_by(HandbookHealthEducation.visit_number).all()
-
-        patient = search_patient_by_id(mpersonid)
-
-        return jsonify({
-            'patient': patient,
-            'parent_records': [
-                {
-                    'id': r.id,
-                    'visit_number': r.visit_number,
-                    'age_stage': r.age_stage,
-                    'record_date': r.record_date.isoformat() if r.record_date else None,
-                    'checklist_items': r.checklist_items,
-                    'parent_notes': r.parent_notes,
-                    'created_at': r.created_at.isoformat() if r.created_at else None,
-                }
-                for r in parent_records
-            ],
-            'health_education': [
-                {
-                    'id': e.id,
-                    'visit_number': e.visit_number,
-                    'age_stage': e.age_stage,
-                    'guidance_date': e.guidance_date.isoformat() if e.guidance_date else None,
-                    'parent_assessment': e.parent_assessment,
-                    'doctor_guidance': e.doctor_guidance,
-                    'hospital_code': e.hospital_code,
-                    'doctor_name': e.doctor_name,
-                    'relationship': e.relationship,
-                    'created_at': e.created_at.isoformat() if e.created_at else None,
-                }
-                for e in health_edu
-            ]
-        })
-    finally:
-        db.close()
+        filters = {
+            'hospital_code': request.args.get('hospital_code') or None,
+            'date_from': date.fromisoformat(request.args['date_from']) if request.args.get('date_from') else None,
+            'date_to': date.fromisoformat(request.args['date_to']) if request.args.get('date_to') else None,
+            'visit_number': int(request.args['visit_number']) if request.args.get('visit_number') else None,
+        }
+    except ValueError:
+        return jsonify({'error': '日期需為 YYYY-MM-DD，visit_number 需為整數'}), 400
+
+    filename = f'{dataset}_{date.today().isoformat()}.csv'
+    # 匯出期間使用自己的 Session，不佔用 request 的連線
+    return Response(stream_with_context(export_service.iter_csv(dataset, **filters)),
+                    mimetype='text/csv; charset=utf-8',
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
 
 
 @handbook_bp.route('/sessions/<int:session_id>/complete', methods=['PUT'])
 def complete_session(session_id):
     """完成掃描工作階段"""
-    db = SessionLocal()
+    db = get_db()
     try:
         session = db.query(HandbookScanSession).get(session_id)
         if not session:
@@ -394,5 +595,3 @@ def complete_session(session_id):
     except Exception as e:
         db.rollback()
         return jsonify({'error': str(e)}), 500
-    finally:
-        db.close()
@@ -0,0 +1,170 @@
+"""Image pipeline - 低複製的圖片 base64 編碼與 vision 請求 body 串流
+
+上傳檔案由 werkzeug 以 SpooledTemporaryFile 暫存（超過 500KB 即寫入磁碟），
+這裡分段讀取、分段 base64 編碼，並把 chat-completions 的 JSON body 做成可重複迭代的串流，
+不再產生「原始 bytes → base64 → data URL → JSON 字串 → UTF-8 bytes」等多份完整複本。
+"""
+
+import io
+import os
+import json
+import uuid
+import base64
+import hashlib
+import threading
+
+# 3 的倍數，確保每段 base64 輸出不含中途的 '=' padding
+CHUNK_SIZE = 3 * 64 * 1024
+
+# 放在 payload 的 image_url.url 位置，VisionRequestBody 會換成實際圖片
+IMAGE_URL = object()
+
+
+def file_size(fileobj):
+    """取得檔案大小並把讀取位置移回開頭"""
+    fileobj.seek(0, os.SEEK_END)
+    size = fileobj.tell()
+    fileobj.seek(0)
+    return size
+
+
+def sha256_file(fileobj):
+    """分段計算檔案的 SHA-256，完成後把讀取位置移回開頭"""
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def base64_length(raw_size):
+    return 4 * ((raw_size + 2) // 3)
+
+
+def iter_base64(fileobj, chunk_size=CHUNK_SIZE):
+    """從檔案開頭分段讀取並產生 base64 bytes"""
+    fileobj.seek(0)
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            return
+        yield base64.b64encode(chunk)
+
+
+def encode_file_base64(fileobj, prefix=''):
+    """分段編碼成單一 base64 字串（可加前綴），不需先把原始檔案整個讀進記憶體"""
+    parts = [prefix]
+    parts.extend(chunk.decode('ascii') for chunk in iter_base64(fileobj))
+    return ''.join(parts)
+
+
+class _FileImage:
+    """原始圖片檔（可 seek），送出時才逐段編碼"""
+
+    def __init__(self, fileobj):
+        self._file = fileobj
+        self._size = file_size(fileobj)
+        # hedged request 可能同時由兩個 thread 迭代，讀取時以 lock 保護 seek + read
+        self._lock = threading.Lock()
+
+    @property
+    def raw_size(self):
+        return self._size
+
+    def __len__(self):
+        return base64_length(self._size)
+
+    def iter_base64(self):
+        offset = 0
+        while offset < self._size:
+            with self._lock:
+                self._file.seek(offset)
+                chunk = self._file.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            offset += len(chunk)
+            yield base64.b64encode(chunk)
+
+
+class _Base64Text:
+    """已是 base64 的字串（例如 DB 中的 image_data），可指定起始位置以避免切片複製"""
+
+    def __init__(self, text, start=0):
+        self._text = text
+        self._start = start
+
+    @property
+    def raw_size(self):
+        return len(self) * 3 // 4
+
+    def __len__(self):
+        return len(self._text) - self._start
+
+    def iter_base64(self):
+        for offset in range(self._start, len(self._text), CHUNK_SIZE):
+            yield self._text[offset:min(offset + CHUNK_SIZE, len(self._text))].encode('ascii')
+
+
+def image_source(data, start=0):
+    """把檔案物件或 base64 字串包成可串流的圖片來源（已是來源物件則原樣回傳）"""
+    if isinstance(data, (_FileImage, _Base64Text)):
+        return data
+    if isinstance(data, str):
+        return _Base64Text(data, start)
+    return _FileImage(data)
+
+
+def raw_image_file(source):
+    """把圖片來源還原成可 seek 的原始 bytes 檔案物件（供 Pillow 等本機處理讀取）"""
+    if isinstance(source, _FileImage):
+        source._file.seek(0)
+        return source._file
+    out = io.BytesIO()
+    # CHUNK_SIZE 是 4 的倍數，每段 base64 都能獨立解碼
+    for chunk in source.iter_base64():
+        out.write(base64.b64decode(chunk))
+    out.seek(0)
+    return out
+
+
+class VisionRequestBody:
+    """chat-completions JSON body；payload 中的 IMAGE_URL 佔位字串在送出時換成串流的 data URL
+
+    具備 __len__，requests 會送出 Content-Length 而非 chunked encoding；
+    每次 __iter__ 都從頭產生，重試與 hedged request 可重複使用同一個 body。
+    """
+
+    def __init__(self, payload, images, mime_type):
+        placeholder = f'__image_{uuid.uuid4().hex}__'
+        sources = images if isinstance(images, list) else [images]
+        mime_types = mime_type if isinstance(mime_type, list) else [mime_type] * len(sources)
+        text = json.dumps(_replace_placeholder(payload, placeholder), ensure_ascii=False)
+        segments = text.split(placeholder)
+        if len(segments) != len(sources) + 1:
+            raise ValueError('payload 中的 IMAGE_URL 數量與圖片數量不符')
+        self._segments = [seg.encode('utf-8') for seg in segments]
+        self._prefixes = [f'data:{m};base64,'.encode('ascii') for m in mime_types]
+        self._sources = sources
+
+    def __len__(self):
+        return (sum(len(seg) for seg in self._segments)
+                + sum(len(p) for p in self._prefixes)
+                + sum(len(src) for src in self._sources))
+
+    def __iter__(self):
+        for segment, prefix, source in zip(self._segments, self._prefixes, self._sources):
+            yield segment
+            yield prefix
+            yield from source.iter_base64()
+        yield self._segments[-1]
+
+
+def _replace_placeholder(value, placeholder):
+    if value is IMAGE_URL:
+        return placeholder
+    if isinstance(value, dict):
+        return {k: _replace_placeholder(v, placeholder) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_replace_placeholder(v, placeholder) for v in value]
+    return value
@@ -0,0 +1,208 @@
+"""定期維護腳本 - 清除被放棄的掃描工作階段暫存圖片並回收資料表空間
+
+image_data 只在頁面確認/退回時清空；工作人員中途放棄的工作階段會一直留著數 MB 的 base64 圖片，
+handbook_scanned_pages 越來越肥、查詢也越來越慢。此腳本：
+
+1. 找出超過 HANDBOOK_SESSION_MAX_AGE_HOURS 沒有新上傳頁面、仍未完成的工作階段，標記為 expired；
+   已完成但仍有未處理頁面圖片的工作階段同樣清除圖片
+2. 以固定批次（依 id 遞增）清空 image_data，可選擇先封存到 HANDBOOK_ARCHIVE_DIR
+3. 執行 VACUUM 讓刪除的空間可重新使用，並回報回收的位元組數
+
+    python maintenance.py                 # 排程執行（例如每天一次）
+    python maintenance.py --dry-run       # 只統計不修改
+    python maintenance.py --archive-dir /data/handbook-archive --full
+"""
+
+import os
+import base64
+import argparse
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from sqlalchemy import func, text, exists, and_  # noqa: E402
+
+import metrics  # noqa: E402
+from models import engine, SessionLocal, HandbookScanSession, HandbookScannedPage  # noqa: E402
+
+SESSION_MAX_AGE_HOURS = float(os.getenv('HANDBOOK_SESSION_MAX_AGE_HOURS', '72'))
+PURGE_BATCH_SIZE = int(os.getenv('HANDBOOK_PURGE_BATCH_SIZE', '200'))
+ARCHIVE_DIR = os.getenv('HANDBOOK_ARCHIVE_DIR') or None
+
+# 清除圖片時，尚未處理完的頁面改為 expired；已確認/退回的頁面狀態不變
+TERMINAL_PAGE_STATUSES = ('confirmed', 'rejected')
+
+PURGED_PAGES = metrics.Counter(
+    'maintenance_purged_pages_total', 'Scanned page images cleared by the maintenance job')
+RECLAIMED_BYTES = metrics.Counter(
+    'maintenance_reclaimed_bytes_total', 'Bytes of image_data cleared by the maintenance job')
+EXPIRED_SESSIONS = metrics.Counter(
+    'maintenance_expired_sessions_total', 'Abandoned scan sessions marked expired')
+
+_EXTENSIONS = {'image/jpeg': 'jpg', 'image/png': 'png', 'image/webp': 'webp', 'image/gif': 'gif'}
+
+
+def stale_session_ids(db, cutoff):
+    """超過 cutoff 沒有活動、且仍有暫存圖片的工作階段 id"""
+    recent_page = exists().where(and_(
+        HandbookScannedPage.session_id == HandbookScanSession.id,
+        HandbookScannedPage.created_at >= cutoff))
+    has_image = exists().where(and_(
+        HandbookScannedPage.session_id == HandbookScanSession.id,
+        HandbookScannedPage.image_data.isnot(None)))
+    abandoned = db.query(HandbookScanSession.id).filter(
+        HandbookScanSession.status == 'in_progress',
+        HandbookScanSession.created_at < cutoff,
+        ~recent_page)
+    leftover = db.query(HandbookScanSession.id).filter(
+        HandbookScanSession.status.in_(('completed', 'expired')),
+        func.coalesce(HandbookScanSession.completed_at, HandbookScanSession.created_at) < cutoff,
+        has_image)
+    return [row[0] for row in abandoned.union(leftover).all()]
+
+
+def _archive_page(archive_dir, page_id, session_id, image_data):
+    """把 "mime_type|base64data" 解碼後寫成 archive_dir/<session_id>/<page_id>.<ext>"""
+    mime_type, sep, data = image_data.partition('|')
+    if not sep:
+        mime_type, data = 'image/jpeg', image_data
+    folder = os.path.join(archive_dir, str(session_id))
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f'{page_id}.{_EXTENSIONS.get(mime_type, "bin")}')
+    with open(path, 'wb') as f:
+        f.write(base64.b64decode(data))
+
+
+def purge_session_images(db, session_ids, batch_size=PURGE_BATCH_SIZE, archive_dir=None, dry_run=False):
+    """分批清空指定工作階段的 image_data，回傳 (頁數, 位元組數)
+
+    依頁面 id 遞增分批，每批各自 commit，避免長交易鎖住資料表或一次載入大量圖片。
+    """
+    pages = 0
+    reclaimed = 0
+    for start in range(0, len(session_ids), 500):
+        chunk = session_ids[start:start + 500]
+        last_id = 0
+        while True:
+            columns = [HandbookScannedPage.id, HandbookScannedPage.session_id,
+                       func.length(HandbookScannedPage.image_data)]
+            if archive_dir:
+                columns.append(HandbookScannedPage.image_data)
+            rows = db.query(*columns).filter(
+                HandbookScannedPage.session_id.in_(chunk),
+                HandbookScannedPage.image_data.isnot(None),
+                HandbookScannedPage.id > last_id,
+            ).order_by(HandbookScannedPage.id).limit(batch_size).all()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            batch_bytes = sum(row[2] or 0 for row in rows)
+            pages += len(rows)
+            reclaimed += batch_bytes
+            if dry_run:
+                continue
+
+            if archive_dir:
+                for row in rows:
+                    _archive_page(archive_dir, row[0], row[1], row[3])
+            ids = [row[0] for row in rows]
+            db.query(HandbookScannedPage).filter(
+                HandbookScannedPage.id.in_(ids),
+                HandbookScannedPage.status.notin_(TERMINAL_PAGE_STATUSES),
+            ).update({'status': 'expired'}, synchronize_session=False)
+            db.query(HandbookScannedPage).filter(HandbookScannedPage.id.in_(ids)).update(
+                {'image_data': None}, synchronize_session=False)
+            db.commit()
+            PURGED_PAGES.inc(len(rows))
+            RECLAIMED_BYTES.inc(batch_bytes)
+    return pages, reclaimed
+
+
+def expire_sessions(db, session_ids):
+    """把仍為 in_progress 的工作階段標記為 expired，回傳筆數"""
+    count = 0
+    for start in range(0, len(session_ids), 500):
+        count += db.query(HandbookScanSession).filter(
+            HandbookScanSession.id.in_(session_ids[start:start + 500]),
+            HandbookScanSession.status == 'in_progress',
+        ).update({'status': 'expired'}, synchronize_session=False)
+    db.commit()
+    EXPIRED_SESSIONS.inc(count)
+    return count
+
+
+def table_size_bytes():
+    """handbook_scanned_pages 佔用的空間（PostgreSQL 含 TOAST 與索引；SQLite 為整個資料庫檔）"""
+    with engine.connect() as conn:
+        if engine.dialect.name == 'postgresql':
+            return conn.execute(text(
+                "SELECT pg_total_relation_size('handbook_scanned_pages')")).scalar()
+        if engine.dialect.name == 'sqlite':
+            page_count = conn.execute(text('PRAGMA page_count')).scalar()
+            page_size = conn.execute(text('PRAGMA page_size')).scalar()
+            return page_count * page_size
+    return None
+
+
+def vacuum(full=False):
+    """VACUUM 必須在交易外執行；PostgreSQL 的 VACUUM FULL 會鎖表並把空間還給作業系統"""
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        if engine.dialect.name == 'postgresql':
+            conn.execute(text(f'VACUUM {"FULL " if full else ""}ANALYZE handbook_scanned_pages'))
+        elif engine.dialect.name == 'sqlite':
+            conn.execute(text('VACUUM'))
+
+
+def run_purge(max_age_hours=SESSION_MAX_AGE_HOURS, batch_size=PURGE_BATCH_SIZE,
+              archive_dir=ARCHIVE_DIR, dry_run=False, run_vacuum=True, full=False):
+    """執行一次清除，回傳統計 dict"""
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=max_age_hours)
+    size_before = table_size_bytes()
+    db = SessionLocal()
+    try:
+        session_ids = stale_session_ids(db, cutoff)
+        pages, reclaimed = purge_session_images(db, session_ids, batch_size, archive_dir, dry_run)
+        expired = 0 if dry_run else expire_sessions(db, session_ids)
+    finally:
+        db.close()
+
+    if run_vacuum and pages and not dry_run:
+        vacuum(full)
+    size_after = table_size_bytes()
+    stats = {
+        'sessions': len(session_ids),
+        'expired_sessions': expired,
+        'pages': pages,
+        'image_bytes': reclaimed,
+        'table_bytes_before': size_before,
+        'table_bytes_after': size_after,
+    }
+    prefix = '[dry run] ' if dry_run else ''
+    print(f"{prefix}{len(session_ids)} stale sessions ({expired} expired), "
+          f"{pages} page images, {reclaimed / 1024 / 1024:.1f} MB of image_data cleared")
+    if size_before is not None and size_after is not None:
+        print(f"{prefix}table size {size_before / 1024 / 1024:.1f} MB → {size_after / 1024 / 1024:.1f} MB "
+              f"(reclaimed {(size_before - size_after) / 1024 / 1024:.1f} MB)")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Purge images of abandoned handbook scan sessions')
+    parser.add_argument('--max-age-hours', type=float, default=SESSION_MAX_AGE_HOURS)
+    parser.add_argument('--batch-size', type=int, default=PURGE_BATCH_SIZE)
+    parser.add_argument('--archive-dir', default=ARCHIVE_DIR, help='清除前把圖片解碼存到此目錄')
+    parser.add_argument('--dry-run', action='store_true', help='只統計，不修改資料')
+    parser.add_argument('--no-vacuum', action='store_true')
+    parser.add_argument('--full', action='store_true', help='PostgreSQL 使用 VACUUM FULL（會鎖表）')
+    args = parser.parse_args()
+    run_purge(args.max_age_hours, args.batch_size, args.archive_dir, args.dry_run,
+              not args.no_vacuum, args.full)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        if os.environ.get("METRICS_TEXTFILE"):
+            metrics.write_textfile(os.environ["METRICS_TEXTFILE"])
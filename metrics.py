@@ -0,0 +1,214 @@
+"""Metrics - 輕量 Prometheus 文字格式指標（histogram / counter / gauge）
+
+每個 process 各自累計；gunicorn 多 worker 時 /metrics 回傳的是處理該次 scrape 的 worker 數據。
+"""
+
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _samples(self):
+        """每組 label 一行 `name{labels} value`；histogram 另行展開 bucket/count/sum"""
+        with self._lock:
+            items = list(self._values.items())
+        return [f'{self.name}{_format_labels(self.labelnames, k)} {v}' for k, v in items]
+
+    def snapshot(self):
+        """目前數值 {label 值 tuple: 值}；histogram 的值為 (count, sum)"""
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self._samples())
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), func=None):
+        super().__init__(name, documentation, labelnames)
+        self._func = func
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def _samples(self):
+        if self._func is not None:
+            return [f'{self.name} {self._func()}']
+        return super()._samples()
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += 1
+            state[2] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """以 with 區塊計時並記錄秒數"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            return {k: (s[1], s[2]) for k, s in self._values.items()}
+
+    def _samples(self):
+        with self._lock:
+            items = [(k, (list(s[0]), s[1], s[2])) for k, s in self._values.items()]
+        lines = []
+        for key, (bucket_counts, count, total) in items:
+            for bound, n in zip(self.buckets, bucket_counts):
+                labels = _format_labels(self.labelnames, key, ('le', bound))
+                lines.append(f'{self.name}_bucket{labels} {n}')
+            labels = _format_labels(self.labelnames, key, ('le', '+Inf'))
+            lines.append(f'{self.name}_bucket{labels} {count}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_count{labels} {count}')
+            lines.append(f'{self.name}_sum{labels} {total}')
+        return lines
+
+
+def render():
+    """輸出所有指標（Prometheus text exposition format 0.0.4）"""
+    with _registry_lock:
+        metrics = list(_registry)
+    return '\n'.join(m.render() for m in metrics) + '\n'
+
+
+def write_textfile(path):
+    """寫出指標檔，供 node_exporter textfile collector 收集（給排程腳本使用）"""
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(render())
+    os.replace(tmp_path, path)
+
+
+# --- 共用指標 ---
+
+HTTP_REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'HTTP request latency by endpoint',
+    ('method', 'endpoint', 'status'))
+
+LLM_REQUEST_DURATION = Histogram(
+    'llm_request_duration_seconds', 'Upstream LLM call latency',
+    ('model', 'prompt_type', 'outcome'))
+
+LLM_TOKENS = Counter(
+    'llm_tokens_total', 'LLM token usage reported by the upstream API',
+    ('model', 'prompt_type', 'kind'))
+
+STAGE_DURATION = Histogram(
+    'stage_duration_seconds', 'Latency of individual processing stages',
+    ('stage',))
+
+DB_QUERY_DURATION = Histogram(
+    'db_query_duration_seconds', 'Database cursor execute latency',
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+
+
+def record_llm_usage(model, prompt_type, prompt_tokens, completion_tokens):
+    """記錄 API 回傳的 token 用量"""
+    if prompt_tokens:
+        LLM_TOKENS.inc(prompt_tokens, model=model, prompt_type=prompt_type, kind='prompt')
+    if completion_tokens:
+        LLM_TOKENS.inc(completion_tokens, model=model, prompt_type=prompt_type, kind='completion')
+
+
+def init_app(app):
+    """註冊 endpoint 延遲統計與 /metrics"""
+    from flask import g, request, Response
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _record_latency(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            HTTP_REQUEST_DURATION.observe(
+                time.perf_counter() - start,
+                method=request.method,
+                endpoint=request.endpoint or 'unmatched',
+                status=response.status_code)
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics_endpoint():
+        return Response(render(), mimetype='text/plain; version=0.0.4')
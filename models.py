@@ -1,7 +1,8 @@
 import os
 from datetime import datetime, timezone
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Date, JSON, ForeignKey, UniqueConstraint
+from sqlalchemy import (create_engine, Column, Integer, Float, String, Text, DateTime, Date, JSON, ForeignKey,
+                        UniqueConstraint, Index)
 from sqlalchemy.orm import declarative_base, sessionmaker, relationship
 
 load_dotenv()
@@ -30,6 +31,11 @@ class LineMessage(Base):
 
 class SentimentReport(Base):
     __tablename__ = "sentiment_reports"
+    __table_args__ = (
+        Index('ix_sentiment_reports_group_date', 'group_id', 'report_date'),
+        # 每個群組每天一份報告；以 unique index 宣告，既有資料表也能由 create_tables 補建
+        Index('uq_sentiment_reports_date_group', 'report_date', 'group_id', unique=True),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     report_date = Column(Date, index=True)
@@ -42,6 +48,53 @@ class SentimentReport(Base):
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
 
 
+class SentimentJobRun(Base):
+    """情緒分析工作紀錄 - 每個 (日期, 群組) 一列，重跑與補跑時略過已完成的組合"""
+    __tablename__ = "sentiment_job_runs"
+    __table_args__ = (
+        UniqueConstraint('report_date', 'group_id', name='uq_sentiment_job_run_date_group'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    report_date = Column(Date, nullable=False)
+    group_id = Column(String(255), nullable=False)
+    status = Column(String(20), nullable=False)  # running / done / failed
+    attempts = Column(Integer, default=0)
+    message_count = Column(Integer)
+    error = Column(Text, nullable=True)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class SentimentRollup(Base):
+    """情緒分析週/月彙總 - 每個群組每個期間一列，run_analysis 寫入報告時增量更新"""
+    __tablename__ = "sentiment_rollups"
+    __table_args__ = (
+        UniqueConstraint('group_id', 'period', 'period_start', name='uq_sentiment_rollup_group_period'),
+        Index('ix_sentiment_rollups_period_start', 'period', 'period_start'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    group_id = Column(String(255), nullable=False)
+    period = Column(String(10), nullable=False)  # week（週一開始）/ month
+    period_start = Column(Date, nullable=False)
+    report_count = Column(Integer, default=0)
+    message_count = Column(Integer, default=0)
+    # 有分數的報告數與各分數總和，平均值 = 總和 / scored_count
+    scored_count = Column(Integer, default=0)
+    positive_sum = Column(Float, default=0.0)
+    negative_sum = Column(Float, default=0.0)
+    neutral_sum = Column(Float, default=0.0)
+    # overall_sentiment 各類別的天數
+    positive_days = Column(Integer, default=0)
+    negative_days = Column(Integer, default=0)
+    neutral_days = Column(Integer, default=0)
+    mixed_days = Column(Integer, default=0)
+    unknown_days = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc),
+                        onupdate=lambda: datetime.now(timezone.utc))
+
+
 class HandbookParentRecord(Base):
     """家長紀錄事項 - 發展里程碑勾選（粉紅色頁面）"""
     __tablename__ = "handbook_parent_records"
@@ -86,12 +139,17 @@ class HandbookHealthEducation(Base):
 class HandbookScanSession(Base):
     """掃描工作階段"""
     __tablename__ = "handbook_scan_sessions"
+    __table_args__ = (
+        # 主管列表依 id 遞減做 keyset 分頁，並可依狀態或掃描人員篩選
+        Index('ix_scan_sessions_status_id', 'status', 'id'),
+        Index('ix_scan_sessions_scanned_by_id', 'scanned_by', 'id'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     mpersonid = Column(String(20), nullable=True)
     status = Column(String(20), default='in_progress')
     scanned_by = Column(String(100))
-    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at = Column(DateTime, index=True, default=lambda: datetime.now(timezone.utc))
     completed_at = Column(DateTime, nullable=True)
 
     pages = relationship("HandbookScannedPage", back_populates="session",
@@ -101,6 +159,10 @@ class HandbookScanSession(Base):
 class HandbookScannedPage(Base):
     """掃描頁面紀錄"""
     __tablename__ = "handbook_scanned_pages"
+    __table_args__ = (
+        Index('ix_scanned_pages_session_order', 'session_id', 'page_order'),
+        Index('ix_scanned_pages_status_id', 'status', 'id'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     session_id = Column(Integer, ForeignKey('handbook_scan_sessions.id'), nullable=False)
@@ -119,6 +181,14 @@ class HandbookScannedPage(Base):
 
 def create_tables():
     Base.metadata.create_all(engine)
+    # create_all 只會替新建的資料表建索引，既有資料表補建之後新增的索引
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(engine, checkfirst=True)
+            except Exception as e:
+                # 例如 unique index 遇到既有的重複資料（sentiment_reports 可先執行 sentiment_job.py --dedupe）
+                print(f"Could not create index {index.name}: {e}")
     print("Tables created successfully.")
 
 
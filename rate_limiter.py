@@ -0,0 +1,149 @@
+"""Rate limiter - 以檔案鎖實作、跨 gunicorn worker 共用的 RPM / TPM token bucket
+
+同一台機器上的所有 process 透過同一個狀態檔協調（不需要 Redis）。
+互動請求（/analyze）優先：只要有互動請求在等待，背景 OCR 就讓路；
+背景請求也不能把 RPM 額度用到低於保留比例，讓互動請求隨時有額度可用。
+"""
+
+import os
+import json
+import time
+import fcntl
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import metrics
+
+PRIORITY_INTERACTIVE = 'interactive'
+PRIORITY_BACKGROUND = 'background'
+
+# 估算每張圖片的 token 數：base64 前的圖片大小 / 每 token bytes
+IMAGE_BYTES_PER_TOKEN = int(os.getenv('KIMI_IMAGE_BYTES_PER_TOKEN', '750'))
+
+_POLL_INTERVAL = 0.2
+# 背景請求（OCR）未指定 timeout 時最多等待的秒數，避免設定錯誤時執行緒永遠卡住
+BACKGROUND_TIMEOUT = float(os.getenv('RATE_LIMIT_BACKGROUND_TIMEOUT', '600'))
+
+RATE_LIMIT_WAIT = metrics.Histogram(
+    'rate_limit_wait_seconds', 'Time spent waiting for rate limiter tokens',
+    ('limiter', 'priority'))
+
+
+class RateLimitTimeout(Exception):
+    """等待額度逾時"""
+
+
+def estimate_tokens(image_size, prompt, max_tokens):
+    """估算一次 vision 呼叫會用掉的 token 數（圖片 + prompt + 回覆上限）"""
+    return image_size // IMAGE_BYTES_PER_TOKEN + len(prompt) + max_tokens
+
+
+class FileTokenBucket:
+    """RPM 與 TPM 兩個 bucket，狀態存在共用檔案中並以 flock 互斥"""
+
+    def __init__(self, name, rpm, tpm, state_dir=None, background_reserve=0.2):
+        if not 0 <= background_reserve < 1:
+            raise ValueError(f'background_reserve must be in [0, 1), got {background_reserve}')
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+        self.background_reserve = background_reserve
+        state_dir = state_dir or tempfile.gettempdir()
+        self.path = os.path.join(state_dir, f'ratelimit-{name}.json')
+
+    @property
+    def enabled(self):
+        return self.rpm > 0 or self.tpm > 0
+
+    @contextmanager
+    def _state(self):
+        with open(self.path, 'a+', encoding='utf-8') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                raw = f.read()
+                state = json.loads(raw) if raw else {}
+                now = time.time()
+                self._refill(state, now)
+                yield state, now
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _refill(self, state, now):
+        elapsed = max(0.0, now - state.get('updated', now))
+        state['requests'] = min(self.rpm, state.get('requests', self.rpm) + elapsed * self.rpm / 60)
+        state['tokens'] = min(self.tpm, state.get('tokens', self.tpm) + elapsed * self.tpm / 60)
+        state['updated'] = now
+        state['waiters'] = {k: v for k, v in state.get('waiters', {}).items() if v > now}
+
+    def _try_take(self, state, tokens, priority, waiter_id, now):
+        """額度足夠就扣除並回傳 True；否則登記等待並回傳 False"""
+        tokens = min(tokens, self.tpm) if self.tpm > 0 else 0
+        need_requests = 1 if self.rpm > 0 else 0
+        if priority == PRIORITY_INTERACTIVE:
+            floor = 0
+        else:
+            other_waiters = [k for k in state['waiters'] if k != waiter_id]
+            if other_waiters:
+                return False
+            # bucket 最多只有 rpm 個請求額度，保留量至少要讓背景請求能拿到一個（例如 rpm=1）
+            floor = max(0, min(self.rpm * self.background_reserve, self.rpm - 1))
+        if state['requests'] - need_requests >= floor and state['tokens'] >= tokens:
+            state['requests'] -= need_requests
+            state['tokens'] -= tokens
+            state['waiters'].pop(waiter_id, None)
+            return True
+        if priority == PRIORITY_INTERACTIVE:
+            state['waiters'][waiter_id] = now + _POLL_INTERVAL * 5
+        return False
+
+    def acquire(self, tokens=0, priority=PRIORITY_BACKGROUND, timeout=None):
+        """取得一個請求額度與 tokens 個 token 額度，必要時等待；背景請求預設最多等 BACKGROUND_TIMEOUT 秒"""
+        if not self.enabled:
+            return 0.0
+        if timeout is None and priority == PRIORITY_BACKGROUND:
+            timeout = BACKGROUND_TIMEOUT
+        waiter_id = f'{os.getpid()}-{threading.get_ident()}'
+        start = time.monotonic()
+        try:
+            while True:
+                with self._state() as (state, now):
+                    if self._try_take(state, tokens, priority, waiter_id, now):
+                        return time.monotonic() - start
+                if timeout is not None and time.monotonic() - start >= timeout:
+                    with self._state() as (state, _):
+                        state['waiters'].pop(waiter_id, None)
+                    raise RateLimitTimeout(f'{self.name} 請求量已達上限，請稍後再試')
+                time.sleep(_POLL_INTERVAL)
+        finally:
+            RATE_LIMIT_WAIT.observe(time.monotonic() - start, limiter=self.name, priority=priority)
+
+    def attempt_hook(self, tokens, priority=PRIORITY_BACKGROUND, timeout=None):
+        """給 ResilientCaller.call(before_attempt=...)：每次重試與 hedge 都是真的 API 呼叫，各扣一次額度
+
+        重試依 timeout 等待；hedge 只是加速手段，不等待額度（取不到就不送）。
+        """
+        def before_attempt(hedge=False):
+            self.acquire(tokens, priority, timeout=0 if hedge else timeout)
+        return before_attempt
+
+    def refund(self, tokens):
+        """回補預估多扣的 token（拿到實際 usage 之後）"""
+        if not self.enabled or self.tpm <= 0 or tokens <= 0:
+            return
+        with self._state() as (state, _):
+            state['tokens'] = min(self.tpm, state['tokens'] + tokens)
+
+
+kimi_limiter = FileTokenBucket(
+    'kimi',
+    rpm=int(os.getenv('KIMI_RPM', '200')),
+    tpm=int(os.getenv('KIMI_TPM', '2000000')),
+    state_dir=os.getenv('RATE_LIMIT_STATE_DIR'),
+    background_reserve=float(os.getenv('KIMI_BACKGROUND_RESERVE', '0.2')),
+)
@@ -0,0 +1,230 @@
+"""Resilience - 上游 API 呼叫的重試（指數退避 + jitter）、circuit breaker 與 hedged request"""
+
+import os
+import time
+import random
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from email.utils import parsedate_to_datetime
+
+import requests
+
+import metrics
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+RETRIES = metrics.Counter(
+    'upstream_retries_total', 'Retried upstream calls by reason', ('upstream', 'reason'))
+HEDGED = metrics.Counter(
+    'upstream_hedged_requests_total', 'Hedged upstream calls by winning request',
+    ('upstream', 'winner'))
+CIRCUIT_OPEN = metrics.Gauge(
+    'upstream_circuit_open', '1 while the circuit breaker is open', ('upstream',))
+CIRCUIT_REJECTED = metrics.Counter(
+    'upstream_circuit_rejected_total', 'Calls rejected while the circuit was open', ('upstream',))
+
+
+class CircuitOpenError(Exception):
+    """circuit breaker 開啟中，直接拒絕呼叫"""
+
+
+def parse_retry_after(value):
+    """解析 Retry-After（秒數或 HTTP 日期），回傳秒數或 None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, base, cap, retry_after=None):
+    """full-jitter 指數退避；若伺服器給了 Retry-After 則至少等那麼久"""
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, cap))
+    return delay
+
+
+class CircuitBreaker:
+    """連續失敗達門檻即開啟，冷卻後放行單一探測請求（half-open）"""
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+        CIRCUIT_OPEN.set(0, upstream=name)
+
+    def before_call(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at >= self.reset_timeout and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+        CIRCUIT_REJECTED.inc(upstream=self.name)
+        raise CircuitOpenError(f'{self.name} API 暫時無法使用，請稍後再試')
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probe_in_flight = False
+        CIRCUIT_OPEN.set(0, upstream=self.name)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probe_in_flight or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                CIRCUIT_OPEN.set(1, upstream=self.name)
+            self._probe_in_flight = False
+
+    def release_probe(self):
+        """探測請求因非上游因素中止（例如等待限流逾時），狀態不變，讓下一個呼叫可以再探測"""
+        with self._lock:
+            self._probe_in_flight = False
+
+
+class LatencyTracker:
+    """保留最近 N 次延遲，用於估計 hedge 觸發點"""
+
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, pct):
+        with self._lock:
+            values = sorted(self._samples)
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+_hedge_pool = ThreadPoolExecutor(max_workers=int(os.getenv('HEDGE_POOL_SIZE', '16')),
+                                 thread_name_prefix='hedge')
+
+
+def _close_response(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+class ResilientCaller:
+    """以重試、circuit breaker 與（選用）hedging 包裝一個回傳 requests.Response 的呼叫"""
+
+    def __init__(self, name, breaker, max_retries=3, backoff_base=1.0, backoff_cap=30.0,
+                 hedge=False, hedge_percentile=95, hedge_min_samples=20):
+        self.name = name
+        self.breaker = breaker
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.latency = LatencyTracker()
+
+    def call(self, send, before_attempt=None):
+        """執行 send()；429/5xx 與連線錯誤會重試，最後一次的回應原樣回傳給呼叫端
+
+        before_attempt(hedge=False) 在每次重試與每個 hedge 請求送出前呼叫（例如取得限流額度）；
+        第一次呼叫的額度由呼叫端自行取得。它在 breaker 之外執行，丟出的例外不算上游失敗；
+        hedge 取不到額度時不送 hedge，繼續等第一個請求。
+        """
+        for attempt in range(self.max_retries + 1):
+            if attempt and before_attempt is not None:
+                before_attempt(hedge=False)
+            self.breaker.before_call()
+            try:
+                response = self._send_once(send, before_attempt)
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+                self.breaker.record_failure()
+                if attempt == self.max_retries:
+                    raise
+                reason, retry_after = 'connection', None
+            except requests.exceptions.RequestException:
+                # 回應中斷（chunked encoding 等）也是上游問題，但不重試
+                self.breaker.record_failure()
+                raise
+            except BaseException:
+                # 其他例外與上游無關，只需清除 half-open 探測旗標，否則 breaker 會一直開著
+                self.breaker.release_probe()
+                raise
+            else:
+                # 429 代表服務存活只是被限流，對 breaker 而言視為成功
+                if response.status_code >= 500:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                if response.status_code not in RETRYABLE_STATUS or attempt == self.max_retries:
+                    return response
+                reason = str(response.status_code)
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                response.close()
+            RETRIES.inc(upstream=self.name, reason=reason)
+            time.sleep(backoff_delay(attempt, self.backoff_base, self.backoff_cap, retry_after))
+
+    def _send_once(self, send, before_attempt=None):
+        start = time.perf_counter()
+        if not self.hedge or len(self.latency) < self.hedge_min_samples:
+            response = send()
+            self.latency.add(time.perf_counter() - start)
+            return response
+
+        primary = _hedge_pool.submit(send)
+        done, _ = wait([primary], timeout=self.latency.percentile(self.hedge_percentile))
+        if done:
+            self.latency.add(time.perf_counter() - start)
+            return primary.result()
+
+        if before_attempt is not None:
+            try:
+                before_attempt(hedge=True)
+            except Exception:
+                response = primary.result()
+                self.latency.add(time.perf_counter() - start)
+                return response
+
+        # 第一個請求超過 p95 仍未回應，再送一個，取先成功者
+        secondary = _hedge_pool.submit(send)
+        pending = {primary, secondary}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                for other in (primary, secondary):
+                    if other is not future:
+                        other.add_done_callback(_close_response)
+                HEDGED.inc(upstream=self.name,
+                           winner='primary' if future is primary else 'hedge')
+                self.latency.add(time.perf_counter() - start)
+                return future.result()
+        raise error
+
+
+# Kimi API 共用同一個 breaker：OCR 背景工作與 /analyze 在 Kimi 故障時一起快速失敗
+kimi_breaker = CircuitBreaker(
+    'kimi',
+    failure_threshold=int(os.getenv('KIMI_BREAKER_THRESHOLD', '5')),
+    reset_timeout=float(os.getenv('KIMI_BREAKER_RESET_SECONDS', '30')),
+)
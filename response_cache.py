@@ -0,0 +1,143 @@
+"""Response cache - /analyze 回應快取（圖片 digest + 正規化 prompt + 模型參數為 key）
+
+記憶體內 LRU（筆數與總大小雙重上限）+ TTL；設定 ANALYZE_CACHE_DIR 時同時寫入磁碟，
+同機的其他 gunicorn worker 也能命中，記憶體淘汰後仍可從磁碟讀回。
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import metrics
+
+CACHE_REQUESTS = metrics.Counter(
+    'analyze_cache_requests_total', 'Analyze response cache lookups by result', ('result',))
+
+
+def normalize_prompt(prompt):
+    """全形轉半形、合併空白，讓只差排版的 prompt 共用快取"""
+    return ' '.join(unicodedata.normalize('NFKC', prompt).split())
+
+
+def make_key(image_digest, prompt, model, temperature, max_tokens):
+    raw = json.dumps([image_digest, normalize_prompt(prompt), model, temperature, max_tokens],
+                     ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """執行緒安全的 LRU + TTL 快取，值為可 JSON 序列化的 dict"""
+
+    def __init__(self, max_entries=256, max_bytes=32 * 1024 * 1024, ttl=86400, disk_dir=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._disk_writes = 0
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    return entry[2]
+                self._remove(key)
+        value, expires_at = self._read_disk(key, now)
+        if value is not None:
+            self._store(key, value, expires_at)
+        return value
+
+    def set(self, key, value):
+        if not self.enabled:
+            return
+        expires_at = time.time() + self.ttl
+        self._store(key, value, expires_at)
+        self._write_disk(key, value, expires_at)
+
+    def _store(self, key, value, expires_at):
+        size = len(json.dumps(value, ensure_ascii=False).encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires_at, size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f'{key}.json')
+
+    def _read_disk(self, key, now):
+        if not self.disk_dir:
+            return None, None
+        path = self._disk_path(key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None, None
+        if record.get('expires_at', 0) <= now:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None, None
+        return record['value'], record['expires_at']
+
+    def _write_disk(self, key, value, expires_at):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'expires_at': expires_at, 'value': value}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError:
+            return
+        self._disk_writes += 1
+        if self._disk_writes % 200 == 0:
+            self.prune_disk()
+
+    def prune_disk(self):
+        """刪除磁碟上已過期的快取檔（以修改時間判斷）"""
+        if not self.disk_dir:
+            return
+        cutoff = time.time() - self.ttl
+        for entry in os.scandir(self.disk_dir):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                continue
+
+
+analyze_cache = ResponseCache(
+    max_entries=int(os.getenv('ANALYZE_CACHE_MAX_ENTRIES', '256')),
+    max_bytes=int(float(os.getenv('ANALYZE_CACHE_MAX_MB', '32')) * 1024 * 1024),
+    ttl=int(os.getenv('ANALYZE_CACHE_TTL', '86400')),
+    disk_dir=os.getenv('ANALYZE_CACHE_DIR') or None,
+)
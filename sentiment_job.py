@@ -1,28 +1,30 @@
 """每日情緒分析腳本 - 查詢前一天的 LINE 群組訊息，透過 Gemini 分析情緒，結果存入 DB。"""
 
 import os
+import sys
 import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import date, datetime, timedelta, timezone
 from dotenv import load_dotenv
 import requests
 
 load_dotenv()
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import func
 
-DATABASE_URL = os.environ.get("DATABASE_URL", "")
-if DATABASE_URL.startswith("postgres://"):
-    DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
-
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
-SessionLocal = sessionmaker(bind=engine)
-
-from models import LineMessage, SentimentReport
+import metrics
+import sentiment_rollup
+from models import SessionLocal, LineMessage, SentimentReport, SentimentJobRun
 
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", "")
 GEMINI_MODEL = "gemini-2.0-flash"
-GEMINI_URL = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent?key={GEMINI_API_KEY}"
+GEMINI_API_BASE = os.environ.get("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta")
+GEMINI_URL = f"{GEMINI_API_BASE}/models/{GEMINI_MODEL}:generateContent?key={GEMINI_API_KEY}"
+
+SENTIMENT_GROUPS = metrics.Counter(
+    "sentiment_groups_total", "Groups handled by the sentiment job by result", ("result",))
 
 SENTIMENT_PROMPT = """你是一位情緒分析專家。請分析以下 LINE 群組的對話內容，產生一份情緒分析報告。
 
@@ -45,38 +47,117 @@ def call_gemini(prompt):
         "contents": [{"parts": [{"text": prompt}]}],
         "generationConfig": {"temperature": 0.3, "maxOutputTokens": 1024},
     }
-    resp = requests.post(GEMINI_URL, json=payload, timeout=60)
-    resp.raise_for_status()
-    data = resp.json()
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        resp = requests.post(GEMINI_URL, json=payload, timeout=60)
+        resp.raise_for_status()
+        data = resp.json()
+        outcome = "ok"
+    finally:
+        metrics.LLM_REQUEST_DURATION.observe(
+            time.perf_counter() - start, model=GEMINI_MODEL, prompt_type="sentiment", outcome=outcome)
+    usage = data.get("usageMetadata", {})
+    metrics.record_llm_usage(GEMINI_MODEL, "sentiment",
+                             usage.get("promptTokenCount", 0), usage.get("candidatesTokenCount", 0))
     return data["candidates"][0]["content"]["parts"][0]["text"]
 
 
-def run_analysis(target_date=None):
+def _parse_result(raw_text):
+    # 移除可能的 markdown code block 包裝
+    clean = raw_text.strip()
+    if clean.startswith("```"):
+        clean = clean.split("\n", 1)[1] if "\n" in clean else clean[3:]
+        if clean.endswith("```"):
+            clean = clean[:-3]
+        clean = clean.strip()
+
+    try:
+        return json.loads(clean)
+    except json.JSONDecodeError:
+        return {
+            "overall_sentiment": "unknown",
+            "sentiment_scores": {},
+            "summary": raw_text,
+        }
+
+
+def _mark_run(db, target_date, group_id, **fields):
+    """更新（或建立）工作紀錄"""
+    run = db.query(SentimentJobRun).filter_by(report_date=target_date, group_id=group_id).first()
+    if run is None:
+        run = SentimentJobRun(report_date=target_date, group_id=group_id, attempts=0)
+        db.add(run)
+    for name, value in fields.items():
+        setattr(run, name, value)
+    return run
+
+
+def _save_report(db, target_date, group_id, message_count, result, raw_text):
+    """同一天同一群組只保留一份報告：已存在則覆寫，並把舊報告從彙總扣除"""
+    report = db.query(SentimentReport).filter_by(report_date=target_date, group_id=group_id).first()
+    if report is None:
+        report = SentimentReport(report_date=target_date, group_id=group_id)
+        db.add(report)
+    else:
+        sentiment_rollup.apply_report(db, report, sign=-1)
+    report.message_count = message_count
+    report.overall_sentiment = result.get("overall_sentiment", "unknown")
+    report.sentiment_scores = result.get("sentiment_scores")
+    report.summary = result.get("summary", "")
+    report.raw_response = raw_text
+    sentiment_rollup.apply_report(db, report)
+    return report
+
+
+def _completed_groups(db, target_date):
+    """已完成的群組：工作紀錄為 done，或（工作紀錄上線前）已有報告"""
+    done = {gid for (gid,) in db.query(SentimentJobRun.group_id).filter_by(
+        report_date=target_date, status="done")}
+    done.update(gid for (gid,) in db.query(SentimentReport.group_id).filter_by(report_date=target_date))
+    return done
+
+
+def run_analysis(target_date=None, force=False):
+    """分析某一天的所有群組，回傳 {'done', 'skipped', 'failed'} 筆數
+
+    每個群組各自 commit；單一群組失敗只記入工作紀錄，不影響其他群組。
+    已完成的 (日期, 群組) 預設略過，不會重複呼叫 Gemini；force=True 時重新分析並覆寫報告。
+    """
     if target_date is None:
         target_date = date.today() - timedelta(days=1)
 
+    stats = {"done": 0, "skipped": 0, "failed": 0}
     db = SessionLocal()
     try:
         start = datetime(target_date.year, target_date.month, target_date.day, tzinfo=timezone.utc)
         end = start + timedelta(days=1)
 
-        messages = (
-            db.query(LineMessage)
-            .filter(LineMessage.line_timestamp >= start, LineMessage.line_timestamp < end)
-            .order_by(LineMessage.line_timestamp)
-            .all()
-        )
+        with metrics.STAGE_DURATION.time(stage="sentiment_query"):
+            messages = (
+                db.query(LineMessage)
+                .filter(LineMessage.line_timestamp >= start, LineMessage.line_timestamp < end)
+                .order_by(LineMessage.line_timestamp)
+                .all()
+            )
 
         if not messages:
             print(f"No messages found for {target_date}")
-            return
+            return stats
 
         groups = {}
         for msg in messages:
             gid = msg.group_id or "direct"
             groups.setdefault(gid, []).append(msg)
 
+        completed = set() if force else _completed_groups(db, target_date)
+
         for group_id, group_msgs in groups.items():
+            if group_id in completed:
+                stats["skipped"] += 1
+                SENTIMENT_GROUPS.inc(result="skipped")
+                continue
+
             formatted = "\n".join(
                 f"[{m.line_timestamp.strftime('%H:%M')}] {m.display_name}: {m.content}"
                 for m in group_msgs
@@ -86,38 +167,35 @@ def run_analysis(target_date=None):
             if not formatted.strip():
                 continue
 
-            prompt = SENTIMENT_PROMPT.format(messages=formatted)
-            raw_text = call_gemini(prompt)
-
-            # 移除可能的 markdown code block 包裝
-            clean = raw_text.strip()
-            if clean.startswith("```"):
-                clean = clean.split("\n", 1)[1] if "\n" in clean else clean[3:]
-                if clean.endswith("```"):
-                    clean = clean[:-3]
-                clean = clean.strip()
+            run = _mark_run(db, target_date, group_id, status="running",
+                            started_at=datetime.now(timezone.utc), finished_at=None,
+                            message_count=len(group_msgs), error=None)
+            run.attempts = (run.attempts or 0) + 1
+            db.commit()
 
             try:
-                result = json.loads(clean)
-            except json.JSONDecodeError:
-                result = {
-                    "overall_sentiment": "unknown",
-                    "sentiment_scores": {},
-                    "summary": raw_text,
-                }
-
-            report = SentimentReport(
-                report_date=target_date,
-                group_id=group_id,
-                message_count=len(group_msgs),
-                overall_sentiment=result.get("overall_sentiment", "unknown"),
-                sentiment_scores=result.get("sentiment_scores"),
-                summary=result.get("summary", ""),
-                raw_response=raw_text,
-            )
-            db.add(report)
-            db.commit()
+                # prompt 內含 JSON 範例的大括號，不能用 str.format
+                prompt = SENTIMENT_PROMPT.replace("{messages}", formatted)
+                raw_text = call_gemini(prompt)
+                result = _parse_result(raw_text)
+                _save_report(db, target_date, group_id, len(group_msgs), result, raw_text)
+                _mark_run(db, target_date, group_id, status="done",
+                          finished_at=datetime.now(timezone.utc))
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                _mark_run(db, target_date, group_id, status="failed", error=str(e)[:2000],
+                          finished_at=datetime.now(timezone.utc))
+                db.commit()
+                stats["failed"] += 1
+                SENTIMENT_GROUPS.inc(result="failed")
+                print(f"Error for group {group_id} on {target_date}: {e}")
+                continue
+
+            stats["done"] += 1
+            SENTIMENT_GROUPS.inc(result="done")
             print(f"Report saved for group {group_id}: {result.get('overall_sentiment')}")
+        return stats
 
     except Exception as e:
         db.rollback()
@@ -127,5 +205,69 @@ def run_analysis(target_date=None):
         db.close()
 
 
+def backfill(date_from, date_to, workers=4, force=False):
+    """平行分析 date_from 到 date_to（含）的每一天，已完成的 (日期, 群組) 略過"""
+    days = [date_from + timedelta(days=i) for i in range((date_to - date_from).days + 1)]
+    totals = {"done": 0, "skipped": 0, "failed": 0}
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run_analysis, day, force): day for day in days}
+        for future in as_completed(futures):
+            try:
+                stats = future.result()
+            except Exception as e:
+                # 查詢訊息等整天層級的錯誤，該天的群組都未處理
+                print(f"Backfill failed for {futures[future]}: {e}")
+                totals["failed"] += 1
+                continue
+            for key, value in stats.items():
+                totals[key] += value
+    print(f"Backfill {date_from} → {date_to}: {len(days)} days, {totals['done']} groups analyzed, "
+          f"{totals['skipped']} already done, {totals['failed']} failed "
+          f"in {time.perf_counter() - wall_start:.1f}s")
+    return totals
+
+
+def dedupe_reports():
+    """刪除同一天同一群組的重複報告（保留最新一份）並重算彙總，供建立 unique index 前執行"""
+    db = SessionLocal()
+    try:
+        keep = (db.query(func.max(SentimentReport.id))
+                .group_by(SentimentReport.report_date, SentimentReport.group_id))
+        removed = db.query(SentimentReport).filter(SentimentReport.id.notin_(keep.scalar_subquery())).delete(
+            synchronize_session=False)
+        db.commit()
+        sentiment_rollup.rebuild_rollups(db)
+        print(f"Removed {removed} duplicate reports")
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Daily LINE group sentiment analysis")
+    parser.add_argument("--date", type=date.fromisoformat, help="分析的日期，預設為昨天")
+    parser.add_argument("--backfill", nargs=2, type=date.fromisoformat, metavar=("FROM", "TO"),
+                        help="補跑區間內（含頭尾）的每一天")
+    parser.add_argument("--workers", type=int, default=4, help="補跑時同時處理的天數")
+    parser.add_argument("--force", action="store_true", help="已完成的群組也重新分析並覆寫報告")
+    parser.add_argument("--dedupe", action="store_true", help="移除重複報告後結束")
+    args = parser.parse_args()
+
+    if args.dedupe:
+        dedupe_reports()
+        return 0
+    if args.backfill:
+        stats = backfill(args.backfill[0], args.backfill[1], args.workers, args.force)
+    else:
+        stats = run_analysis(args.date, args.force)
+    return 1 if stats["failed"] else 0
+
+
 if __name__ == "__main__":
-    run_analysis()
+    try:
+        exit_code = main()
+    finally:
+        # 排程執行時可設定 METRICS_TEXTFILE 讓 node_exporter 收集本次執行的指標
+        if os.environ.get("METRICS_TEXTFILE"):
+            metrics.write_textfile(os.environ["METRICS_TEXTFILE"])
+    sys.exit(exit_code)
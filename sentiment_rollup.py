@@ -0,0 +1,149 @@
+"""情緒分析彙總 - 把每日 SentimentReport 累加成每群組的週/月彙總，供趨勢圖直接讀取
+
+run_analysis 每寫入一份報告就呼叫 apply_report，以 UPDATE col = col + x 原子累加，
+不必重新讀取或解析該期間的所有報告 JSON。既有資料可用 rebuild_rollups 一次重算：
+
+    python sentiment_rollup.py --rebuild
+"""
+
+import argparse
+from datetime import timedelta
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from sqlalchemy.exc import IntegrityError  # noqa: E402
+
+from models import SessionLocal, SentimentReport, SentimentRollup  # noqa: E402
+
+PERIODS = ('week', 'month')
+SCORE_KEYS = ('positive', 'negative', 'neutral')
+SENTIMENT_LABELS = ('positive', 'negative', 'neutral', 'mixed')
+_COUNTERS = ('report_count', 'message_count', 'scored_count',
+             'positive_days', 'negative_days', 'neutral_days', 'mixed_days', 'unknown_days')
+_SUMS = ('positive_sum', 'negative_sum', 'neutral_sum')
+
+
+def period_start(day, period):
+    """週以週一為起點，月以 1 號為起點"""
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def _score(scores, key):
+    try:
+        return float(scores.get(key) or 0.0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def report_deltas(report, sign=1):
+    """一份報告對彙總各欄位的增量；sign=-1 用於撤銷被取代的舊報告"""
+    scores = report.sentiment_scores if isinstance(report.sentiment_scores, dict) else {}
+    scored = any(key in scores for key in SCORE_KEYS)
+    label = report.overall_sentiment if report.overall_sentiment in SENTIMENT_LABELS else 'unknown'
+    deltas = {
+        'report_count': sign,
+        'message_count': sign * (report.message_count or 0),
+        'scored_count': sign if scored else 0,
+        f'{label}_days': sign,
+    }
+    if scored:
+        for key in SCORE_KEYS:
+            deltas[f'{key}_sum'] = sign * _score(scores, key)
+    return deltas
+
+
+def apply_report(db, report, sign=1):
+    """把報告累加到所屬的週與月彙總（不 commit，與報告寫入在同一個交易）"""
+    deltas = report_deltas(report, sign)
+    for period in PERIODS:
+        start = period_start(report.report_date, period)
+        _increment(db, report.group_id, period, start, deltas)
+
+
+def _increment(db, group_id, period, start, deltas):
+    columns = {name: getattr(SentimentRollup, name) + value for name, value in deltas.items()}
+    match = (SentimentRollup.group_id == group_id, SentimentRollup.period == period,
+             SentimentRollup.period_start == start)
+    if db.query(SentimentRollup).filter(*match).update(columns, synchronize_session=False):
+        return
+    row = SentimentRollup(group_id=group_id, period=period, period_start=start,
+                          **{name: 0 for name in _COUNTERS}, **{name: 0.0 for name in _SUMS})
+    for name, value in deltas.items():
+        setattr(row, name, value)
+    try:
+        # 另一個 process 可能同時建立同一列，以 savepoint 包住，衝突時改走 UPDATE
+        with db.begin_nested():
+            db.add(row)
+    except IntegrityError:
+        db.query(SentimentRollup).filter(*match).update(columns, synchronize_session=False)
+
+
+def rebuild_rollups(db, group_id=None):
+    """由 sentiment_reports 重算彙總（可限定單一群組），回傳處理的報告數"""
+    delete = db.query(SentimentRollup)
+    reports = db.query(SentimentReport).order_by(SentimentReport.id)
+    if group_id:
+        delete = delete.filter(SentimentRollup.group_id == group_id)
+        reports = reports.filter(SentimentReport.group_id == group_id)
+    delete.delete(synchronize_session=False)
+
+    totals = {}
+    count = 0
+    for report in reports.yield_per(1000):
+        count += 1
+        deltas = report_deltas(report)
+        for period in PERIODS:
+            key = (report.group_id, period, period_start(report.report_date, period))
+            row = totals.setdefault(key, {name: 0 for name in _COUNTERS + _SUMS})
+            for name, value in deltas.items():
+                row[name] += value
+    db.bulk_insert_mappings(SentimentRollup, [
+        {'group_id': g, 'period': p, 'period_start': s, **values}
+        for (g, p, s), values in totals.items()
+    ])
+    db.commit()
+    return count
+
+
+def query_trends(db, period='week', group_ids=None, date_from=None, date_to=None):
+    """趨勢圖資料：{group_id: [{period_start, report_count, message_count, avg_*, days}]}
+
+    date_from、date_to 都包含在內：回傳涵蓋這兩天的週期以及兩者之間的所有週期。
+    """
+    query = db.query(SentimentRollup).filter(SentimentRollup.period == period)
+    if group_ids:
+        query = query.filter(SentimentRollup.group_id.in_(group_ids))
+    if date_from:
+        query = query.filter(SentimentRollup.period_start >= period_start(date_from, period))
+    if date_to:
+        query = query.filter(SentimentRollup.period_start <= date_to)
+    series = {}
+    for row in query.order_by(SentimentRollup.group_id, SentimentRollup.period_start):
+        scored = row.scored_count or 0
+        series.setdefault(row.group_id, []).append({
+            'period_start': row.period_start.isoformat(),
+            'report_count': row.report_count,
+            'message_count': row.message_count,
+            'avg_scores': {key: round(getattr(row, f'{key}_sum') / scored, 4) if scored else None
+                           for key in SCORE_KEYS},
+            'days': {label: getattr(row, f'{label}_days')
+                     for label in SENTIMENT_LABELS + ('unknown',)},
+        })
+    return series
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Sentiment rollup maintenance')
+    parser.add_argument('--rebuild', action='store_true', help='由 sentiment_reports 重算所有彙總')
+    parser.add_argument('--group-id')
+    args = parser.parse_args()
+    if not args.rebuild:
+        parser.error('請指定 --rebuild')
+    session = SessionLocal()
+    try:
+        print(f"Rebuilt rollups from {rebuild_rollups(session, args.group_id)} reports")
+    finally:
+        session.close()
@@ -82,12 +82,11 @@ document.addEventListener('DOMContentLoaded', () => {
         formData.append('images', file);
 
         try {
-            const res = await fetch(`/handbook/sessions/${sessionId}/pages`, {
-                method: 'POST',
-                body: formData
-            });
-            const data = await res.json();
-            if (!res.ok) { alert(data.error); return; }
+            const data = await postPages(formData);
+            if (!data) {
+                document.getElementById('icProcessing').classList.add('hb-hidden');
+                return;
+            }
 
             // Poll for result
             const pageId = data.page_ids[0];
@@ -216,12 +215,8 @@ document.addEventListener('DOMContentLoaded', () => {
         updateProgress(0, files.length);
 
         try {
-            const res = await fetch(`/handbook/sessions/${sessionId}/pages`, {
-                method: 'POST',
-                body: formData
-            });
-            const data = await res.json();
-            if (!res.ok) { alert(data.error); return; }
+            const data = await postPages(formData);
+            if (!data) return;
 
             // Start polling
             startPolling();
@@ -233,6 +228,33 @@ document.addEventListener('DOMContentLoaded', () => {
         pageCameraInput.value = '';
     }
 
+    // 上傳頁面；品質檢查不通過時提示重拍，使用者仍可選擇強制上傳。失敗回傳 null
+    async function postPages(formData) {
+        let res = await fetch(`/handbook/sessions/${sessionId}/pages`, {
+            method: 'POST',
+            body: formData
+        });
+        let data = await res.json();
+
+        if (res.status === 422 && data.retake) {
+            if (!confirm(`${data.error}\n\n確定仍要上傳這張照片嗎？`)) return null;
+            formData.append('force', '1');
+            res = await fetch(`/handbook/sessions/${sessionId}/pages`, {
+                method: 'POST',
+                body: formData
+            });
+            data = await res.json();
+        }
+        if (!res.ok) { alert(data.error); return null; }
+
+        if (data.rejected && data.rejected.length > 0) {
+            const lines = data.rejected.map(r =>
+                `第 ${r.index + 1} 張（${r.filename}）：${r.issues.map(i => i.message).join('、')}`);
+            alert(`以下照片品質不佳未上傳，請重新拍攝：\n${lines.join('\n')}`);
+        }
+        return data;
+    }
+
     function startPolling() {
         if (pollingTimer) clearInterval(pollingTimer);
         pollingTimer = setInterval(pollSessionStatus, 3000);
@@ -247,13 +269,13 @@ document.addEventListener('DOMContentLoaded', () => {
             // Filter out basic_info pages (already handled in step 2)
             const pages = data.pages.filter(p => p.page_type !== 'basic_info' || p.status === 'confirmed');
             const handbookPages = data.pages.filter(p => p.page_type !== 'basic_info');
-            const completed = handbookPages.filter(p => p.status === 'ocr_complete' || p.status === 'confirmed');
+            const completed = handbookPages.filter(p => isReviewable(p.status) || p.status === 'confirmed');
 
             updateProgress(completed.length, handbookPages.length);
             renderPageQueue(handbookPages);
 
             // Show first unreviewed result
-            const unreviewed = handbookPages.find(p => p.status === 'ocr_complete');
+            const unreviewed = handbookPages.find(p => isReviewable(p.status));
             if (unreviewed && unreviewed.id !== currentReviewPageId) {
                 showReview(unreviewed);
             }
@@ -288,7 +310,7 @@ document.addEventListener('DOMContentLoaded', () => {
                     <div class="type">${PAGE_TYPE_LABELS[p.page_type] || '處理中...'}</div>
                 </div>
                 <span class="hb-status">
-                    <span class="hb-status-dot ${p.status === 'ocr_processing' ? 'processing' : p.status === 'ocr_complete' ? 'complete' : p.status === 'confirmed' ? 'confirmed' : p.status === 'rejected' ? 'rejected' : 'pending'}"></span>
+                    <span class="hb-status-dot ${p.status === 'ocr_processing' ? 'processing' : p.status === 'ocr_complete' ? 'complete' : p.status === 'ocr_incomplete' ? 'incomplete' : p.status === 'confirmed' ? 'confirmed' : p.status === 'rejected' ? 'rejected' : 'pending'}"></span>
                     ${statusLabel(p.status)}
                 </span>
             </div>
@@ -299,7 +321,7 @@ document.addEventListener('DOMContentLoaded', () => {
             el.addEventListener('click', () => {
                 const pid = parseInt(el.dataset.pageId);
                 const page = pages.find(p => p.id === pid);
-                if (page && (page.status === 'ocr_complete' || page.status === 'confirmed')) {
+                if (page && (isReviewable(page.status) || page.status === 'confirmed')) {
                     showReview(page);
                 }
             });
@@ -311,12 +333,26 @@ document.addEventListener('DOMContentLoaded', () => {
             'pending': '等待中',
             'ocr_processing': '辨識中',
             'ocr_complete': '待確認',
+            'ocr_incomplete': '待補正',
             'confirmed': '已確認',
-            'rejected': '已拒絕'
+            'rejected': '已拒絕',
+            'expired': '已逾時'
         };
         return map[status] || status;
     }
 
+    // OCR 完成等待審核；ocr_incomplete 表示仍有欄位需人工補正
+    function isReviewable(status) {
+        return status === 'ocr_complete' || status === 'ocr_incomplete';
+    }
+
+    function renderProblems(problems) {
+        if (!problems || problems.length === 0) return '';
+        const labels = { missing: '未辨識', invalid: '格式錯誤', truncated: '不完整' };
+        return `<div class="hb-problems">以下欄位需人工補正：<ul>${problems.map(p =>
+            `<li>${esc(p.label)}（${labels[p.problem] || esc(p.problem)}）</li>`).join('')}</ul></div>`;
+    }
+
     function showReview(page) {
         currentReviewPageId = page.id;
         const area = document.getElementById('reviewArea');
@@ -338,6 +374,7 @@ document.addEventListener('DOMContentLoaded', () => {
         } else {
             content.innerHTML = `<pre style="font-size:0.85rem; overflow:auto;">${esc(JSON.stringify(data, null, 2))}</pre>`;
         }
+        content.insertAdjacentHTML('afterbegin', renderProblems(page.ocr_problems));
 
         // Scroll to review
         area.scrollIntoView({ behavior: 'smooth', block: 'start' });
@@ -525,7 +562,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 const res = await fetch(`/handbook/sessions/${sessionId}/status`);
                 const data = await res.json();
                 const page = data.pages.find(p => p.id === pageId);
-                if (page && (page.status === 'ocr_complete' || page.status === 'confirmed')) {
+                if (page && (isReviewable(page.status) || page.status === 'confirmed')) {
                     callback(page);
                     return;
                 }
@@ -12,11 +12,14 @@ document.addEventListener('DOMContentLoaded', () => {
     const resultCard = document.getElementById('resultCard');
     const resultText = document.getElementById('resultText');
     const usageInfo = document.getElementById('usageInfo');
+    const previewCount = document.getElementById('previewCount');
+    const batchResults = document.getElementById('batchResults');
 
     const MAX_SIZE = 10 * 1024 * 1024; // 10MB
     const ALLOWED_TYPES = ['image/png', 'image/jpeg', 'image/gif', 'image/webp'];
+    const MAX_BATCH = 10;
 
-    let selectedFile = null;
+    let selectedFiles = [];
 
     // Click to select file
     dropZone.addEventListener('click', (e) => {
@@ -32,13 +35,13 @@ document.addEventListener('DOMContentLoaded', () => {
 
     fileInput.addEventListener('change', () => {
         if (fileInput.files.length > 0) {
-            handleFile(fileInput.files[0]);
+            handleFiles(fileInput.files);
         }
     });
 
     cameraInput.addEventListener('change', () => {
         if (cameraInput.files.length > 0) {
-            handleFile(cameraInput.files[0]);
+            handleFiles(cameraInput.files);
         }
     });
 
@@ -56,7 +59,7 @@ document.addEventListener('DOMContentLoaded', () => {
         e.preventDefault();
         dropZone.classList.remove('dragover');
         if (e.dataTransfer.files.length > 0) {
-            handleFile(e.dataTransfer.files[0]);
+            handleFiles(e.dataTransfer.files);
         }
     });
 
@@ -66,68 +69,90 @@ document.addEventListener('DOMContentLoaded', () => {
         clearImage();
     });
 
-    function handleFile(file) {
+    function handleFiles(fileList) {
         hideError();
+        const files = Array.from(fileList);
 
-        if (!ALLOWED_TYPES.includes(file.type)) {
+        if (files.length > MAX_BATCH) {
+            showError(`一次最多選擇 ${MAX_BATCH} 張圖片`);
+            return;
+        }
+
+        if (files.some(file => !ALLOWED_TYPES.includes(file.type))) {
             showError('不支援的檔案格式，僅接受 PNG、JPG、GIF、WebP');
             return;
         }
 
-        if (file.size > MAX_SIZE) {
+        // 伺服器的上傳上限是整個請求 10MB
+        if (files.reduce((sum, file) => sum + file.size, 0) > MAX_SIZE) {
             showError('檔案大小超過 10MB 限制');
             return;
         }
 
-        selectedFile = file;
-        const objectUrl = URL.createObjectURL(file);
+        selectedFiles = files;
+        const objectUrl = URL.createObjectURL(files[0]);
         preview.onload = () => URL.revokeObjectURL(objectUrl);
         preview.src = objectUrl;
+        previewCount.textContent = files.length > 1 ? `已選擇 ${files.length} 張圖片，將同時分析` : '';
+        previewCount.hidden = files.length < 2;
         dropZone.classList.add('has-image');
         analyzeBtn.disabled = false;
     }
 
     function clearImage() {
-        selectedFile = null;
+        selectedFiles = [];
         fileInput.value = '';
         cameraInput.value = '';
         preview.src = '';
+        previewCount.hidden = true;
         dropZone.classList.remove('has-image');
         analyzeBtn.disabled = true;
     }
 
     // Analyze
     analyzeBtn.addEventListener('click', async () => {
-        if (!selectedFile) return;
+        if (selectedFiles.length === 0) return;
 
         hideError();
         resultCard.hidden = true;
+        resultText.textContent = '';
+        batchResults.textContent = '';
+        usageInfo.textContent = '';
         setLoading(true);
 
+        if (selectedFiles.length > 1) {
+            await analyzeBatch();
+            return;
+        }
+
         const formData = new FormData();
-        formData.append('image', selectedFile);
+        formData.append('image', selectedFiles[0]);
         formData.append('prompt', promptInput.value);
 
         try {
-            const res = await fetch('/analyze', {
+            const res = await fetch('/analyze/stream', {
                 method: 'POST',
                 body: formData
             });
 
-            const data = await res.json();
-
-            if (!res.ok || data.error) {
+            // 驗證錯誤仍以 JSON 回傳
+            if (!res.ok) {
+                const data = await res.json();
                 showError(data.error || '未知錯誤');
                 return;
             }
 
-            resultText.textContent = data.response;
-            if (data.usage) {
-                usageInfo.textContent = `Token 用量：提示 ${data.usage.prompt_tokens} + 回覆 ${data.usage.completion_tokens} = 共 ${data.usage.total_tokens}`;
-            } else {
-                usageInfo.textContent = '';
-            }
-            resultCard.hidden = false;
+            await readEventStream(res, (event, data) => {
+                if (event === 'delta') {
+                    resultText.textContent += data.text;
+                    resultCard.hidden = false;
+                } else if (event === 'done') {
+                    showUsage(data.usage);
+                    resultCard.hidden = false;
+                } else if (event === 'error') {
+                    showError(data.error || '未知錯誤');
+                }
+            });
         } catch (err) {
             showError('請求失敗，請確認伺服器是否正在運行');
         } finally {
@@ -135,6 +160,98 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
+    // 多張圖片：一次送出，依完成順序填入各自的結果區塊
+    async function analyzeBatch() {
+        const formData = new FormData();
+        selectedFiles.forEach(file => formData.append('images', file));
+        formData.append('prompt', promptInput.value);
+
+        const items = selectedFiles.map(file => {
+            const item = document.createElement('div');
+            item.className = 'batch-item';
+            const title = document.createElement('h3');
+            title.textContent = file.name;
+            const text = document.createElement('div');
+            text.className = 'result-text pending';
+            text.textContent = '分析中...';
+            item.append(title, text);
+            batchResults.append(item);
+            return text;
+        });
+        resultCard.hidden = false;
+
+        try {
+            const res = await fetch('/analyze/batch', {
+                method: 'POST',
+                body: formData
+            });
+
+            if (!res.ok) {
+                const data = await res.json();
+                resultCard.hidden = true;
+                showError(data.error || '未知錯誤');
+                return;
+            }
+
+            let totalTokens = 0;
+            await readEventStream(res, (event, data) => {
+                if (event === 'result') {
+                    const text = items[data.index];
+                    text.classList.remove('pending');
+                    if (data.success) {
+                        text.textContent = data.response;
+                        totalTokens += data.usage.total_tokens;
+                    } else {
+                        text.classList.add('failed');
+                        text.textContent = data.error || '未知錯誤';
+                    }
+                } else if (event === 'done') {
+                    usageInfo.textContent = `完成 ${data.succeeded}/${data.count} 張，耗時 ${(data.elapsed_ms / 1000).toFixed(1)} 秒，Token 共 ${totalTokens}`;
+                }
+            });
+        } catch (err) {
+            showError('請求失敗，請確認伺服器是否正在運行');
+        } finally {
+            setLoading(false);
+        }
+    }
+
+    // 逐段讀取 SSE 回應，每個事件呼叫一次 onEvent(event, data)
+    async function readEventStream(res, onEvent) {
+        const reader = res.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            let sep;
+            while ((sep = buffer.indexOf('\n\n')) !== -1) {
+                const block = buffer.slice(0, sep);
+                buffer = buffer.slice(sep + 2);
+
+                let event = 'message';
+                let data = '';
+                for (const line of block.split('\n')) {
+                    if (line.startsWith('event:')) event = line.slice(6).trim();
+                    else if (line.startsWith('data:')) data += line.slice(5).trim();
+                }
+                if (data) onEvent(event, JSON.parse(data));
+            }
+        }
+    }
+
+    function showUsage(usage) {
+        if (usage) {
+            usageInfo.textContent = `Token 用量：提示 ${usage.prompt_tokens} + 回覆 ${usage.completion_tokens} = 共 ${usage.total_tokens}`
+                + (usage.cache === 'hit' ? '（快取結果，未重新呼叫 API）' : '');
+        } else {
+            usageInfo.textContent = '';
+        }
+    }
+
     function setLoading(loading) {
         analyzeBtn.disabled = loading;
         analyzeBtn.classList.toggle('loading', loading);
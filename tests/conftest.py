@@ -0,0 +1,25 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# 測試一律使用暫存 SQLite，不會連到 .env 設定的資料庫
+os.environ['DATABASE_URL'] = f'sqlite:///{tempfile.mkdtemp()}/test.db'
+
+
+@pytest.fixture
+def db():
+    """每個測試使用全新的資料表"""
+    import models
+
+    models.Base.metadata.create_all(models.engine)
+    session = models.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        models.Base.metadata.drop_all(models.engine)
@@ -0,0 +1,60 @@
+import csv
+import io
+from datetime import date
+
+import pytest
+
+from handbook import export_service
+from models import HandbookParentRecord
+
+
+def add_records(db, count):
+    for i in range(count):
+        db.add(HandbookParentRecord(
+            mpersonid=f'A{i:09d}', visit_number=1, age_stage='1-2月', record_date=date(2024, 1, i + 1),
+            checklist_items=[{'題目': '會抬頭', '結果': '是'}, {'題目': '會笑', '結果': '否', '是警訊': True}]))
+    db.commit()
+
+
+def test_csv_export_flattens_checklist(db):
+    add_records(db, 3)
+    text = ''.join(export_service.iter_csv('parent_checklist', db=db, batch_size=2))
+    rows = list(csv.reader(io.StringIO(text.lstrip('\ufeff'))))
+    assert rows[0] == [name for name, _ in export_service.DATASET_COLUMNS['parent_checklist']]
+    assert len(rows) == 1 + 6
+    assert rows[2][-2:] == ['否', 'True']
+
+
+def test_parquet_round_trip_writes_a_row_group_per_batch(db):
+    pq = pytest.importorskip('pyarrow.parquet')
+    import pyarrow as pa
+
+    add_records(db, 5)
+    sink = io.BytesIO()
+    count = export_service.write_parquet('parent_records', sink, db=db, batch_size=2)
+    sink.seek(0)
+    parquet_file = pq.ParquetFile(sink)
+
+    assert count == 5
+    assert parquet_file.metadata.num_row_groups == 3
+    schema = parquet_file.schema_arrow
+    assert schema.field('record_id').type == pa.int64()
+    assert schema.field('mpersonid').type == pa.string()
+    assert schema.field('record_date').type == pa.date32()
+    table = parquet_file.read()
+    assert table.column('record_date').to_pylist()[0] == date(2024, 1, 1)
+    assert table.column('warning_items').to_pylist()[0] == '會笑'
+
+
+def test_http_export_is_csv_only(db):
+    from app import app
+
+    add_records(db, 1)
+    client = app.test_client()
+    response = client.get('/handbook/export?dataset=parent_records&format=parquet')
+    assert response.status_code == 400
+    assert 'CLI' in response.get_json()['error']
+    response = client.get('/handbook/export?dataset=parent_records')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    assert response.get_data(as_text=True).count('\r\n') == 2
@@ -0,0 +1,104 @@
+from handbook.ocr_output import (build_followup_prompt, extraction_problems, parse_llm_json,
+                                 validate_extraction)
+
+
+def test_parses_clean_json():
+    value, info = parse_llm_json('{"a": 1, "b": [true, null]}')
+    assert value == {'a': 1, 'b': [True, None]}
+    assert info == {'repaired': False, 'truncated': False, 'incomplete': None}
+
+
+def test_skips_code_fence_and_prose():
+    value, info = parse_llm_json('結果如下：\n```json\n{"a": "x"}\n```\n以上')
+    assert value == {'a': 'x'}
+    assert info['repaired']
+
+
+def test_repairs_commas_and_python_literals():
+    value, info = parse_llm_json('{"a": True, "b": None, "c": [1, 2,], "d": 1 "e": NaN,}')
+    assert value == {'a': True, 'b': None, 'c': [1, 2], 'd': 1, 'e': None}
+    assert info['repaired'] and not info['truncated']
+
+
+def test_truncated_object_keeps_complete_fields():
+    value, info = parse_llm_json('{"name": "王小明", "items": [{"題目": "a"}, {"題目": "b"}], "notes": "寫到一半')
+    assert value == {'name': '王小明', 'items': [{'題目': 'a'}, {'題目': 'b'}]}
+    assert info['truncated']
+    assert info['incomplete'] == 'notes'
+
+
+def test_truncated_array_drops_partial_element():
+    value, info = parse_llm_json('{"items": [{"題目": "a", "結果": "是"}, {"題目": "b", "結')
+    assert value == {'items': [{'題目': 'a', '結果': '是'}]}
+    assert info['incomplete'] == 'items'
+
+
+def test_truncated_number_is_not_trusted():
+    value, info = parse_llm_json('{"a": 1, "visit_number": 3')
+    assert value == {'a': 1}
+    assert info['incomplete'] == 'visit_number'
+
+
+def test_no_json():
+    assert parse_llm_json('沒有資料')[0] is None
+    assert parse_llm_json('')[0] is None
+
+
+def test_validate_normalizes_dates_and_visit():
+    data = {'age_stage': '二至三歲', 'visit_number': '第3次', 'guidance_date': '113/05/02',
+            'parent_assessment': [{'主題': 'x'}], 'doctor_guidance': [{'主題': 'y'}]}
+    cleaned, problems = validate_extraction('health_education', data)
+    assert problems == {}
+    assert cleaned['visit_number'] == 3
+    assert cleaned['guidance_date'] == '2024-05-02'
+    assert cleaned['hospital_code'] is None
+
+
+def test_validate_reports_missing_and_invalid():
+    cleaned, problems = validate_extraction(
+        'basic_info', {'name': '王小明', 'id_number': '12345', 'birth_date': 'yesterday'})
+    assert problems == {'id_number': 'invalid', 'birth_date': 'invalid'}
+    assert cleaned['birth_date'] is None
+
+    _, problems = validate_extraction('basic_info', {'name': '王小明'})
+    assert problems == {'id_number': 'missing'}
+
+
+def test_validate_truncated_marks_absent_optional_fields():
+    _, problems = validate_extraction('basic_info', {'name': '王小明', 'id_number': 'A123456789'},
+                                      incomplete='birth_date', truncated=True)
+    assert problems == {'birth_date': 'truncated'}
+
+
+def test_id_number_accepts_resident_certificate():
+    for number in ('A123456789', 'b234567890', 'A 823456789', 'F912345678'):
+        cleaned, problems = validate_extraction('basic_info', {'name': 'x', 'id_number': number})
+        assert 'id_number' not in problems, number
+        assert cleaned['id_number'] == number.replace(' ', '').upper()
+    _, problems = validate_extraction('basic_info', {'name': 'x', 'id_number': 'A323456789'})
+    assert problems == {'id_number': 'invalid'}
+
+
+def test_checklist_results_are_normalized():
+    cleaned, problems = validate_extraction('parent_record', {
+        'age_stage': '一歲', 'visit_number': 2,
+        'checklist_items': [{'題目': 'a', '結果': '?'}, {'題目': 'b', '結果': '是', '是警訊': 1}, 'junk'],
+    })
+    assert problems == {}
+    assert cleaned['checklist_items'] == [
+        {'題目': 'a', '結果': '未勾選', '是警訊': False},
+        {'題目': 'b', '結果': '是', '是警訊': True},
+    ]
+
+
+def test_extraction_problems_on_stored_data():
+    cleaned, _ = validate_extraction('basic_info', {'name': 'x', 'id_number': 'A123456789'})
+    assert extraction_problems('basic_info', cleaned) == {}
+    assert extraction_problems('basic_info', {'name': 'x'}) == {'id_number': 'missing'}
+    assert extraction_problems('unknown', {'a': 1}) == {}
+
+
+def test_followup_prompt_lists_only_requested_fields():
+    prompt = build_followup_prompt('basic_info', ['id_number'])
+    assert '"id_number"' in prompt
+    assert '"birth_date"' not in prompt
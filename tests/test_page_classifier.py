@@ -0,0 +1,46 @@
+import io
+
+import pytest
+from PIL import Image
+
+from bench.synthetic import make_handbook_image
+from handbook.page_classifier import CONFIDENCE_THRESHOLD, classify_image
+
+
+def page(page_type, scale=1.0):
+    return Image.open(io.BytesIO(make_handbook_image(page_type, seed=2, scale=scale))).convert('RGB')
+
+
+def on_table(img, frame=None):
+    """把頁面或健保卡放在深色桌面中央"""
+    frame = frame or (img.width + 200, img.height + 200)
+    canvas = Image.new('RGB', frame, (70, 60, 50))
+    canvas.paste(img, ((frame[0] - img.width) // 2, (frame[1] - img.height) // 2))
+    return canvas
+
+
+def classify(img):
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG', quality=90)
+    page_type, confidence, features = classify_image(buffer)
+    assert buffer.tell() == 0
+    return page_type, confidence, features
+
+
+@pytest.mark.parametrize('page_type', ['parent_record', 'health_education', 'basic_info'])
+@pytest.mark.parametrize('framing', ['full', 'table'])
+def test_classifies_synthetic_pages(page_type, framing):
+    img = page(page_type)
+    if framing == 'table':
+        img = on_table(img)
+    result, confidence, _ = classify(img)
+    assert result == page_type
+    assert confidence >= CONFIDENCE_THRESHOLD
+
+
+@pytest.mark.parametrize('frame', [(1500, 2000), (2000, 1500)])
+def test_card_aspect_is_measured_on_the_card(frame):
+    # 健保卡只佔畫面一小塊時，照片本身的長寬比與健保卡無關
+    result, _, features = classify(on_table(page('basic_info', scale=0.6), frame=frame))
+    assert result == 'basic_info'
+    assert features['aspect'] == pytest.approx(85.6 / 54, abs=0.05)
@@ -0,0 +1,44 @@
+import io
+
+import pytest
+from PIL import Image, ImageEnhance, ImageFilter
+
+from bench.synthetic import make_handbook_image
+from handbook.quality_check import assess_image
+
+
+def photo(page_type='parent_record'):
+    """把合成頁面放在深色桌面上，模擬手機拍攝的畫面"""
+    page = Image.open(io.BytesIO(make_handbook_image(page_type, seed=1))).convert('RGB')
+    canvas = Image.new('RGB', (page.width + 200, page.height + 200), (70, 60, 50))
+    canvas.paste(page, (100, 100))
+    return canvas
+
+
+def issue_codes(img):
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG', quality=90)
+    result = assess_image(buffer)
+    assert buffer.tell() == 0
+    return result['ok'], [issue['code'] for issue in result['issues']]
+
+
+@pytest.mark.parametrize('page_type', ['parent_record', 'health_education', 'basic_info'])
+def test_clean_photo_passes(page_type):
+    assert issue_codes(photo(page_type)) == (True, [])
+
+
+@pytest.mark.parametrize('variant, code', [
+    (lambda img: img.filter(ImageFilter.GaussianBlur(6)), 'blurry'),
+    (lambda img: ImageEnhance.Brightness(img).enhance(0.25), 'too_dark'),
+    (lambda img: img.crop((400, 0, img.width, img.height)), 'cropped'),
+    (lambda img: img.resize((img.width // 4, img.height // 4)), 'low_resolution'),
+    (lambda img: Image.new('RGB', img.size, (128, 128, 128)), 'blank'),
+])
+def test_bad_photo_reports_issue(variant, code):
+    assert issue_codes(variant(photo())) == (False, [code])
+
+
+def test_unreadable_file():
+    result = assess_image(io.BytesIO(b'not an image'))
+    assert [issue['code'] for issue in result['issues']] == ['unreadable']
@@ -0,0 +1,106 @@
+import multiprocessing
+import threading
+import time
+
+import pytest
+
+import rate_limiter
+from rate_limiter import (FileTokenBucket, PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE,
+                          RateLimitTimeout)
+
+
+def make_bucket(tmp_path, rpm=10, tpm=0, reserve=0.0):
+    return FileTokenBucket('test', rpm=rpm, tpm=tpm, state_dir=str(tmp_path), background_reserve=reserve)
+
+
+def take_all(bucket, priority, tokens=0):
+    count = 0
+    while True:
+        try:
+            bucket.acquire(tokens, priority, timeout=0)
+        except RateLimitTimeout:
+            return count
+        count += 1
+
+
+def test_requests_run_out(tmp_path):
+    assert take_all(make_bucket(tmp_path, rpm=3), PRIORITY_INTERACTIVE) == 3
+
+
+def test_background_leaves_reserve_for_interactive(tmp_path):
+    bucket = make_bucket(tmp_path, rpm=10, reserve=0.2)
+    assert take_all(bucket, PRIORITY_BACKGROUND) == 8
+    assert take_all(bucket, PRIORITY_INTERACTIVE) == 2
+
+
+def test_background_can_run_with_tiny_rpm(tmp_path):
+    # rpm=1 時保留量不能大於 bucket 容量，否則背景請求永遠拿不到額度
+    assert take_all(make_bucket(tmp_path, rpm=1, reserve=0.2), PRIORITY_BACKGROUND) == 1
+
+
+def test_invalid_reserve_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        make_bucket(tmp_path, reserve=1.0)
+
+
+def test_background_has_default_timeout(tmp_path, monkeypatch):
+    monkeypatch.setattr(rate_limiter, 'BACKGROUND_TIMEOUT', 0.3)
+    bucket = make_bucket(tmp_path, rpm=1)
+    bucket.acquire(priority=PRIORITY_BACKGROUND)
+    start = time.monotonic()
+    with pytest.raises(RateLimitTimeout):
+        bucket.acquire(priority=PRIORITY_BACKGROUND)
+    assert time.monotonic() - start < 2
+
+
+def test_waiting_interactive_request_blocks_background(tmp_path):
+    bucket = make_bucket(tmp_path, rpm=10)
+    with bucket._state() as (state, now):
+        state['waiters']['other-process'] = now + 5
+    with pytest.raises(RateLimitTimeout):
+        bucket.acquire(priority=PRIORITY_BACKGROUND, timeout=0)
+    bucket.acquire(priority=PRIORITY_INTERACTIVE, timeout=0)
+
+
+def test_interactive_gets_refilled_token_first(tmp_path):
+    bucket = make_bucket(tmp_path, rpm=60)
+    take_all(bucket, PRIORITY_INTERACTIVE)
+    order = []
+
+    def worker(priority):
+        bucket.acquire(priority=priority, timeout=5)
+        order.append(priority)
+
+    background = threading.Thread(target=worker, args=(PRIORITY_BACKGROUND,))
+    interactive = threading.Thread(target=worker, args=(PRIORITY_INTERACTIVE,))
+    background.start()
+    time.sleep(0.1)
+    interactive.start()
+    background.join()
+    interactive.join()
+    assert order == [PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND]
+
+
+def test_refund_returns_tokens(tmp_path):
+    bucket = make_bucket(tmp_path, rpm=0, tpm=1000)
+    bucket.acquire(800, PRIORITY_INTERACTIVE, timeout=0)
+    with pytest.raises(RateLimitTimeout):
+        bucket.acquire(500, PRIORITY_INTERACTIVE, timeout=0)
+    bucket.refund(400)
+    bucket.acquire(500, PRIORITY_INTERACTIVE, timeout=0)
+
+
+def _take_in_process(state_dir, results):
+    bucket = FileTokenBucket('test', rpm=6, tpm=0, state_dir=state_dir, background_reserve=0)
+    results.put(take_all(bucket, PRIORITY_INTERACTIVE))
+
+
+def test_bucket_is_shared_across_processes(tmp_path):
+    ctx = multiprocessing.get_context('fork')
+    results = ctx.Queue()
+    processes = [ctx.Process(target=_take_in_process, args=(str(tmp_path), results)) for _ in range(2)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(10)
+    assert sum(results.get(timeout=1) for _ in processes) == 6
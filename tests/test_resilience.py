@@ -0,0 +1,203 @@
+import time
+
+import pytest
+import requests
+
+from rate_limiter import FileTokenBucket, PRIORITY_BACKGROUND, RateLimitTimeout
+from resilience import CircuitBreaker, CircuitOpenError, ResilientCaller
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def ok():
+    return FakeResponse(200)
+
+
+def connection_error():
+    raise requests.exceptions.ConnectionError('down')
+
+
+def make_caller(threshold=2, reset_timeout=0.0, max_retries=0):
+    breaker = CircuitBreaker('test', failure_threshold=threshold, reset_timeout=reset_timeout)
+    return ResilientCaller('test', breaker, max_retries=max_retries, backoff_base=0, backoff_cap=0)
+
+
+def trip(caller):
+    for _ in range(caller.breaker.failure_threshold):
+        with pytest.raises(requests.exceptions.ConnectionError):
+            caller.call(connection_error)
+
+
+def test_opens_after_threshold_and_rejects():
+    caller = make_caller(reset_timeout=60)
+    trip(caller)
+    with pytest.raises(CircuitOpenError):
+        caller.call(ok)
+
+
+def test_half_open_allows_single_probe():
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0.0)
+    breaker.record_failure()
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_probe_success_closes():
+    caller = make_caller()
+    trip(caller)
+    assert caller.call(ok).status_code == 200
+    assert caller.call(ok).status_code == 200
+
+
+def test_probe_failure_reopens():
+    caller = make_caller(reset_timeout=0.0)
+    trip(caller)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        caller.call(connection_error)
+    caller.breaker.reset_timeout = 60
+    with pytest.raises(CircuitOpenError):
+        caller.call(ok)
+
+
+def test_probe_unrelated_exception_releases_probe():
+    caller = make_caller()
+    trip(caller)
+
+    def limited():
+        raise RateLimitTimeout('busy')
+
+    with pytest.raises(RateLimitTimeout):
+        caller.call(limited)
+    assert caller.call(ok).status_code == 200
+
+
+def test_probe_broken_response_records_failure():
+    caller = make_caller()
+    trip(caller)
+
+    def broken():
+        raise requests.exceptions.ChunkedEncodingError('cut')
+
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        caller.call(broken)
+    # 仍可再探測，且成功後關閉
+    assert caller.call(ok).status_code == 200
+
+
+def test_retries_5xx_then_returns_success():
+    caller = make_caller(threshold=5, max_retries=2)
+    responses = [FakeResponse(503), FakeResponse(502), FakeResponse(200)]
+    first = responses[0]
+    assert caller.call(lambda: responses.pop(0)).status_code == 200
+    assert first.closed
+
+
+def test_429_does_not_count_as_failure():
+    caller = make_caller(threshold=1, max_retries=0)
+    assert caller.call(lambda: FakeResponse(429)).status_code == 429
+    assert caller.call(ok).status_code == 200
+
+
+class CountingHook:
+    """模擬 kimi_limiter.attempt_hook：記錄每次重試與 hedge 扣的額度"""
+
+    def __init__(self, fail_hedge=False):
+        self.calls = []
+        self.fail_hedge = fail_hedge
+
+    def __call__(self, hedge=False):
+        self.calls.append('hedge' if hedge else 'retry')
+        if hedge and self.fail_hedge:
+            raise RateLimitTimeout('no tokens')
+
+
+def test_retries_charge_one_attempt_each():
+    caller = make_caller(threshold=5, max_retries=3)
+    responses = [FakeResponse(429), FakeResponse(503), FakeResponse(200)]
+    hook = CountingHook()
+    assert caller.call(lambda: responses.pop(0), before_attempt=hook).status_code == 200
+    # 第一次由呼叫端自行扣額度，之後兩次重試各扣一次
+    assert hook.calls == ['retry', 'retry']
+
+
+def test_first_attempt_success_charges_nothing_extra():
+    hook = CountingHook()
+    make_caller().call(ok, before_attempt=hook)
+    assert hook.calls == []
+
+
+def test_retry_charge_failure_is_not_a_breaker_failure():
+    caller = make_caller(threshold=1, max_retries=1)
+
+    def limited(hedge=False):
+        raise RateLimitTimeout('busy')
+
+    with pytest.raises(RateLimitTimeout):
+        caller.call(lambda: FakeResponse(429), before_attempt=limited)
+    assert caller.call(ok).status_code == 200
+
+
+def make_hedging_caller():
+    breaker = CircuitBreaker('test', failure_threshold=5, reset_timeout=0.0)
+    caller = ResilientCaller('test', breaker, max_retries=0, hedge=True, hedge_min_samples=1)
+    caller.latency.add(0.01)
+    return caller
+
+
+def slow_then_fast():
+    sent = []
+
+    def send():
+        sent.append(1)
+        if len(sent) == 1:
+            time.sleep(0.3)
+        return FakeResponse(200)
+
+    return send, sent
+
+
+def test_hedge_charges_one_attempt():
+    caller = make_hedging_caller()
+    send, sent = slow_then_fast()
+    hook = CountingHook()
+    assert caller.call(send, before_attempt=hook).status_code == 200
+    assert len(sent) == 2
+    assert hook.calls == ['hedge']
+
+
+def test_hedge_skipped_without_tokens():
+    caller = make_hedging_caller()
+    send, sent = slow_then_fast()
+    hook = CountingHook(fail_hedge=True)
+    assert caller.call(send, before_attempt=hook).status_code == 200
+    assert len(sent) == 1
+    assert hook.calls == ['hedge']
+
+
+def test_retried_and_hedged_calls_consume_bucket_tokens(tmp_path):
+    bucket = FileTokenBucket('test', rpm=60, tpm=60000, state_dir=str(tmp_path), background_reserve=0)
+    hook = bucket.attempt_hook(1000, PRIORITY_BACKGROUND, timeout=1)
+
+    def used():
+        with bucket._state() as (state, _):
+            return round(60 - state['requests']), round(60000 - state['tokens'], -2)
+
+    responses = [FakeResponse(503), FakeResponse(503), FakeResponse(200)]
+    bucket.acquire(1000, PRIORITY_BACKGROUND)
+    make_caller(threshold=5, max_retries=2).call(lambda: responses.pop(0), before_attempt=hook)
+    assert used() == (3, 3000)
+
+    send, sent = slow_then_fast()
+    bucket.acquire(1000, PRIORITY_BACKGROUND)
+    make_hedging_caller().call(send, before_attempt=hook)
+    assert len(sent) == 2
+    assert used() == (5, 5000)
@@ -0,0 +1,106 @@
+import json
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import text
+
+import sentiment_job
+from models import LineMessage, SentimentJobRun, SentimentReport
+
+DAY = date(2026, 9, 2)
+
+
+def add_messages(db, day, groups, per_group=3):
+    start = datetime(day.year, day.month, day.day, 8, tzinfo=timezone.utc)
+    for group_id in groups:
+        for i in range(per_group):
+            db.add(LineMessage(group_id=group_id, user_id='U1', display_name='成員', message_type='text',
+                               content=f'{group_id} 訊息 {i}', line_timestamp=start + timedelta(minutes=i)))
+    db.commit()
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    """假的 Gemini：記錄每次呼叫的群組，fail 內的群組會丟出例外"""
+    state = {'calls': [], 'fail': set()}
+
+    def call(prompt):
+        group_id = next(g for g in ('G1', 'G2', 'G3') if f'{g} 訊息' in prompt)
+        state['calls'].append(group_id)
+        if group_id in state['fail']:
+            raise RuntimeError(f'{group_id} failed')
+        return json.dumps({'overall_sentiment': 'positive', 'sentiment_scores': {'positive': 1.0},
+                           'summary': group_id})
+
+    monkeypatch.setattr(sentiment_job, 'call_gemini', call)
+    return state
+
+
+def ledger(db):
+    db.expire_all()
+    return {(r.report_date, r.group_id): (r.status, r.attempts) for r in db.query(SentimentJobRun)}
+
+
+def test_rerun_skips_completed_groups(db, gemini):
+    add_messages(db, DAY, ['G1', 'G2'])
+    assert sentiment_job.run_analysis(DAY) == {'done': 2, 'skipped': 0, 'failed': 0}
+    assert sentiment_job.run_analysis(DAY) == {'done': 0, 'skipped': 2, 'failed': 0}
+    assert sorted(gemini['calls']) == ['G1', 'G2']
+    assert db.query(SentimentReport).count() == 2
+    assert ledger(db) == {(DAY, 'G1'): ('done', 1), (DAY, 'G2'): ('done', 1)}
+
+
+def test_failed_group_does_not_lose_others_and_is_retried(db, gemini):
+    add_messages(db, DAY, ['G1', 'G2', 'G3'])
+    gemini['fail'] = {'G2'}
+    assert sentiment_job.run_analysis(DAY) == {'done': 2, 'skipped': 0, 'failed': 1}
+    assert {r.group_id for r in db.query(SentimentReport)} == {'G1', 'G3'}
+    run = db.query(SentimentJobRun).filter_by(group_id='G2').one()
+    assert run.status == 'failed' and 'G2 failed' in run.error
+
+    gemini['fail'] = set()
+    gemini['calls'].clear()
+    assert sentiment_job.run_analysis(DAY) == {'done': 1, 'skipped': 2, 'failed': 0}
+    assert gemini['calls'] == ['G2']
+    assert ledger(db)[(DAY, 'G2')] == ('done', 2)
+
+
+def test_existing_report_without_ledger_is_skipped(db, gemini):
+    add_messages(db, DAY, ['G1'])
+    db.add(SentimentReport(report_date=DAY, group_id='G1', message_count=3, overall_sentiment='neutral'))
+    db.commit()
+    assert sentiment_job.run_analysis(DAY) == {'done': 0, 'skipped': 1, 'failed': 0}
+    assert gemini['calls'] == []
+
+
+def test_force_overwrites_report(db, gemini):
+    add_messages(db, DAY, ['G1'])
+    sentiment_job.run_analysis(DAY)
+    assert sentiment_job.run_analysis(DAY, force=True) == {'done': 1, 'skipped': 0, 'failed': 0}
+    assert db.query(SentimentReport).count() == 1
+    assert ledger(db)[(DAY, 'G1')] == ('done', 2)
+
+
+def test_backfill_resumes_range(db, gemini):
+    days = [DAY + timedelta(days=i) for i in range(4)]
+    for day in days:
+        add_messages(db, day, ['G1', 'G2'])
+    sentiment_job.run_analysis(days[1])
+    gemini['calls'].clear()
+
+    totals = sentiment_job.backfill(days[0], days[-1], workers=2)
+    assert totals == {'done': 6, 'skipped': 2, 'failed': 0}
+    assert len(gemini['calls']) == 6
+    assert sentiment_job.backfill(days[0], days[-1], workers=2) == {'done': 0, 'skipped': 8, 'failed': 0}
+    assert db.query(SentimentReport).count() == 8
+
+
+def test_dedupe_keeps_latest_report(db):
+    db.execute(text('DROP INDEX uq_sentiment_reports_date_group'))
+    for summary in ('old', 'new'):
+        db.add(SentimentReport(report_date=DAY, group_id='G1', message_count=1,
+                               overall_sentiment='positive', summary=summary))
+        db.commit()
+    sentiment_job.dedupe_reports()
+    db.expire_all()
+    assert [r.summary for r in db.query(SentimentReport)] == ['new']
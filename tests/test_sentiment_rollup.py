@@ -0,0 +1,97 @@
+from datetime import date
+
+import pytest
+
+import sentiment_job
+import sentiment_rollup
+from models import SentimentReport, SentimentRollup
+
+
+def make_report(day, group_id='G1', sentiment='positive', scores=None, message_count=10):
+    return SentimentReport(report_date=day, group_id=group_id, message_count=message_count,
+                           overall_sentiment=sentiment,
+                           sentiment_scores={'positive': 0.6, 'negative': 0.1, 'neutral': 0.3}
+                           if scores is None else scores)
+
+
+def rollups(db):
+    db.expire_all()
+    return {
+        (r.group_id, r.period, r.period_start): (
+            r.report_count, r.message_count, r.scored_count, round(r.positive_sum, 6),
+            round(r.negative_sum, 6), r.positive_days, r.negative_days, r.unknown_days)
+        for r in db.query(SentimentRollup)
+    }
+
+
+def test_period_start():
+    assert sentiment_rollup.period_start(date(2026, 9, 3), 'week') == date(2026, 8, 31)
+    assert sentiment_rollup.period_start(date(2026, 9, 3), 'month') == date(2026, 9, 1)
+
+
+def test_report_deltas_unscored_and_unknown_label():
+    deltas = sentiment_rollup.report_deltas(make_report(date(2026, 9, 3), sentiment='??', scores={}))
+    assert deltas == {'report_count': 1, 'message_count': 10, 'scored_count': 0, 'unknown_days': 1}
+
+
+def test_apply_accumulates_into_week_and_month(db):
+    sentiment_rollup.apply_report(db, make_report(date(2026, 8, 31)))
+    sentiment_rollup.apply_report(db, make_report(date(2026, 9, 1), sentiment='negative',
+                                                  scores={'positive': 0.2, 'negative': 0.7}))
+    db.commit()
+    rows = rollups(db)
+    assert rows[('G1', 'week', date(2026, 8, 31))] == (2, 20, 2, 0.8, 0.8, 1, 1, 0)
+    assert rows[('G1', 'month', date(2026, 8, 1))] == (1, 10, 1, 0.6, 0.1, 1, 0, 0)
+    assert rows[('G1', 'month', date(2026, 9, 1))] == (1, 10, 1, 0.2, 0.7, 0, 1, 0)
+
+
+def test_subtract_cancels_apply(db):
+    report = make_report(date(2026, 9, 2))
+    sentiment_rollup.apply_report(db, report)
+    sentiment_rollup.apply_report(db, report, sign=-1)
+    db.commit()
+    assert set(rollups(db).values()) == {(0, 0, 0, 0.0, 0.0, 0, 0, 0)}
+
+
+@pytest.mark.parametrize('reruns', [1, 3])
+def test_rerun_replaces_report_in_rollups(db, reruns):
+    day = date(2026, 9, 2)
+    sentiment_job._save_report(db, day, 'G2', 5, {'overall_sentiment': 'negative',
+                                                  'sentiment_scores': {'negative': 0.9}}, '')
+    db.commit()
+    for _ in range(reruns):
+        sentiment_job._save_report(db, day, 'G2', 8, {'overall_sentiment': 'positive',
+                                                      'sentiment_scores': {'positive': 0.75}}, '')
+        db.commit()
+
+    assert db.query(SentimentReport).count() == 1
+    incremental = rollups(db)
+    assert incremental[('G2', 'week', date(2026, 8, 31))] == (1, 8, 1, 0.75, 0.0, 1, 0, 0)
+    sentiment_rollup.rebuild_rollups(db)
+    assert rollups(db) == incremental
+
+
+def test_query_trends_averages_scored_reports(db):
+    for day, scores in ((date(2026, 9, 1), {'positive': 0.5}), (date(2026, 9, 2), {'positive': 1.0}),
+                        (date(2026, 9, 3), {})):
+        sentiment_rollup.apply_report(db, make_report(day, scores=scores))
+    db.commit()
+    series = sentiment_rollup.query_trends(db, 'week')['G1']
+    assert len(series) == 1
+    assert series[0]['report_count'] == 3
+    assert series[0]['avg_scores']['positive'] == 0.75
+    assert series[0]['days']['positive'] == 3
+
+
+@pytest.mark.parametrize('date_from, date_to, expected', [
+    (None, date(2026, 9, 7), ['2026-08-31', '2026-09-07']),
+    (None, date(2026, 9, 6), ['2026-08-31']),
+    (date(2026, 9, 13), None, ['2026-09-07', '2026-09-14']),
+    (date(2026, 9, 7), date(2026, 9, 7), ['2026-09-07']),
+])
+def test_query_trends_bounds_are_inclusive(db, date_from, date_to, expected):
+    for day in (date(2026, 9, 1), date(2026, 9, 8), date(2026, 9, 15)):
+        sentiment_rollup.apply_report(db, make_report(day))
+    db.commit()
+    series = sentiment_rollup.query_trends(db, 'week', date_from=date_from, date_to=date_to)['G1']
+    assert [point['period_start'] for point in series] == expected